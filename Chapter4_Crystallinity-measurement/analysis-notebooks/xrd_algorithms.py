@@ -1,14 +1,1562 @@
+import os
+import re
+import time
+import logging
+import inspect
+import hashlib
+import threading
+import contextvars
+import contextlib
+from collections import OrderedDict
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from datetime import datetime
+import itertools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from multiprocessing import shared_memory
 from scipy.signal import find_peaks, savgol_filter
-from scipy.optimize import curve_fit
+from scipy.optimize import curve_fit, least_squares, nnls
+from scipy.special import erf
+from scipy.sparse import csr_matrix
+from scipy.linalg import solveh_banded
+from xrd_io import read_xrd_csv
+
+try:
+    import numba  # optional compiled backend for the multi-Gaussian model
+except ImportError:
+    numba = None
+
+
+# Progress and results of the fitting functions. INFO reports each phase, DEBUG adds every
+# fitted peak, fallback fit and combination, WARNING keeps only failed fits (see set_log_level).
+# Messages go to the caller's logging configuration, e.g.
+# logging.basicConfig(level=logging.INFO, format='%(message)s') in a notebook
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+def set_log_level(level):
+    """
+    Set how much the XRD fitting functions report. Only the level of this module's logger
+    is changed; where the messages go is left to the application's logging handlers.
+
+    Parameters:
+    -----------
+    level : int or str
+        A logging level: 'DEBUG' adds every fitted peak classification, fallback fit and
+        Phase 2B combination to the 'INFO' phase summaries; 'WARNING' reports only
+        failed fits; 'ERROR' silences the module
+    """
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+
+
+# Whether the running thread or asyncio task is inside _quiet_logging. Each thread has
+# its own value, so quietening the fits of one thread leaves the others' warnings alone
+_QUIET_LOGGING = contextvars.ContextVar('xrd_quiet_logging', default=False)
+
+
+class _QuietFilter(logging.Filter):
+    """Drop records below ERROR that are logged inside a _quiet_logging block"""
+    
+    def filter(self, record):
+        return record.levelno >= logging.ERROR or not _QUIET_LOGGING.get()
+
+
+logger.addFilter(_QuietFilter())
+
+
+@contextlib.contextmanager
+def _quiet_logging(quiet=True):
+    """
+    Keep only errors from the fits run inside the block by the calling thread, e.g.
+    around the many repeated fits of a calibration or bootstrap. The logger's level and
+    other threads' messages are not touched. With quiet=False nothing changes.
+    """
+    if not quiet:
+        yield
+        return
+    token = _QUIET_LOGGING.set(True)
+    try:
+        yield
+    finally:
+        _QUIET_LOGGING.reset(token)
+
+
+class FitMetrics:
+    """
+    Collects the wall time, model evaluations and success of each step of the fitting
+    drivers: 'preprocessing', 'Phase 1', 'Phase 2A', 'Phase 2B', 'Phase 3', 'polish'
+    (multi-resolution mode) and 'plotting'. Pass one collector as ``metrics`` to any
+    number of driver calls, from one thread or several; each call is numbered as a
+    spectrum in call order and adds a row for every step it runs. Pool worker processes
+    (fit_xrd_batch) fill their own copies, so collect in the calling process.
+    """
+
+    _COLUMNS = ('spectrum', 'step', 'wall_time_s', 'nfev', 'success')
+
+    def __init__(self):
+        self.rows = []
+        self._spectra = itertools.count()
+
+    def begin_spectrum(self):
+        """Number of the next spectrum"""
+        return next(self._spectra)
+
+    def record(self, spectrum, step, start, nfev=0, success=None):
+        """Add a step that started at time.perf_counter() value start and has just ended"""
+        self.rows.append({'spectrum': spectrum, 'step': step, 'wall_time_s': time.perf_counter() - start,
+                          'nfev': int(nfev), 'success': success})
+
+    def to_frame(self, by_spectrum=False):
+        """
+        The collected steps as a DataFrame, one row per spectrum and step. With
+        by_spectrum=True, one row per spectrum with the wall time of each step in seconds
+        and their total instead.
+        """
+        table = pd.DataFrame(self.rows, columns=self._COLUMNS)
+        if not by_spectrum:
+            return table
+        times = table.pivot_table(index='spectrum', columns='step', values='wall_time_s',
+                                  aggfunc='sum', sort=False)
+        times['total'] = times.sum(axis=1)
+        times.columns.name = None
+        return times
+
+
+def gaussian(x, A, x0, sigma):
+    """Gaussian function with parameters amplitude, center, and width"""
+    return A * np.exp(-((x - x0) ** 2) / (2 * sigma ** 2))
+
+
+_MODEL_BACKENDS = ('numpy', 'numba')
+
+
+# Beyond 0.5·z² > 53·ln 2 a Gaussian is below 2⁻⁵³ of its amplitude, i.e. under the
+# rounding error of the peak itself, so the compiled loops skip those points. On an
+# ascending grid only the index window around each peak is visited
+_GAUSSIAN_TAIL = 53 * np.log(2)
+
+
+def _is_ascending(x):
+    """Whether x is sorted in ascending order (loop form for numba)"""
+    for j in range(1, x.shape[0]):
+        if x[j] < x[j - 1]:
+            return False
+    return True
+
+
+def _peak_window(x, ascending, center, width):
+    """Index range of x that can lie within _GAUSSIAN_TAIL of a peak"""
+    if not ascending:
+        return 0, x.shape[0]
+    reach = abs(width) * np.sqrt(2 * _GAUSSIAN_TAIL)
+    return np.searchsorted(x, center - reach), np.searchsorted(x, center + reach, side='right')
+
+
+def _multi_gaussian_loops(x, params, out):
+    """Sum of Gaussian peaks written as explicit loops, compiled by numba when available"""
+    out[:] = 0.0
+    ascending = _is_ascending(x)
+    for k in range(params.shape[0] // 3):
+        amp = params[3*k]
+        center = params[3*k + 1]
+        width = params[3*k + 2]
+        start, stop = _peak_window(x, ascending, center, width)
+        for j in range(start, stop):
+            z = (x[j] - center) / width
+            half_z2 = 0.5 * z * z
+            if half_z2 < _GAUSSIAN_TAIL:
+                out[j] += amp * np.exp(-half_z2)
+    return out
+
+
+def _multi_gaussian_jacobian_loops(x, params, jac):
+    """Analytic Jacobian of _multi_gaussian_loops, filled into a zeroed (points × parameters) array"""
+    ascending = _is_ascending(x)
+    for k in range(params.shape[0] // 3):
+        amp = params[3*k]
+        center = params[3*k + 1]
+        width = params[3*k + 2]
+        start, stop = _peak_window(x, ascending, center, width)
+        for j in range(start, stop):
+            z = (x[j] - center) / width
+            half_z2 = 0.5 * z * z
+            if half_z2 < _GAUSSIAN_TAIL:
+                g = np.exp(-half_z2)
+                d_center = amp * g * z / width
+                jac[j, 3*k] = g
+                jac[j, 3*k + 1] = d_center
+                jac[j, 3*k + 2] = d_center * z
+    return jac
+
+
+if numba is not None:
+    # The helpers are compiled in place so that the kernels below call the compiled versions
+    _is_ascending = numba.njit(cache=True)(_is_ascending)
+    _peak_window = numba.njit(cache=True)(_peak_window)
+    _multi_gaussian_kernel = numba.njit(cache=True)(_multi_gaussian_loops)
+    _multi_gaussian_jacobian_kernel = numba.njit(cache=True)(_multi_gaussian_jacobian_loops)
+else:
+    _multi_gaussian_kernel = _multi_gaussian_jacobian_kernel = None
+
+
+class MultiGaussianModel:
+    """
+    Sum of Gaussian peaks evaluated as one broadcast (peaks × points) array.
+
+    Instances are called as ``model(x, *params)``, the signature expected by
+    ``curve_fit``, with ``params`` given as flat [amplitude, center, width]
+    triplets. ``jacobian`` has the same signature and returns the exact
+    derivatives, so it can be passed as ``jac=`` to replace finite differencing.
+    
+    With ``backend='numba'`` both are evaluated by compiled loops that avoid the
+    temporary (peaks × points) arrays and skip points where a peak is below the
+    rounding error of its amplitude. They agree with the NumPy backend to rounding
+    error, not bit for bit. If numba is not installed the NumPy backend is used and
+    ``backend`` records that.
+    """
+    
+    def __init__(self, backend='numpy'):
+        if backend not in _MODEL_BACKENDS:
+            raise ValueError(f"backend must be one of {_MODEL_BACKENDS}, got {backend!r}")
+        if backend == 'numba' and numba is None:
+            logger.warning("numba is not installed; using the NumPy Gaussian model")
+            backend = 'numpy'
+        self.backend = backend
+
+    @staticmethod
+    def _components(x, params):
+        """Return amplitudes, widths, standardised offsets and unit Gaussians (peaks × points)"""
+        x = np.asarray(x, dtype=float)
+        num_peaks = len(params) // 3
+        p = np.asarray(params[:3 * num_peaks], dtype=float).reshape(num_peaks, 3)
+        amp = p[:, 0:1]
+        width = p[:, 2:3]
+        z = (x[np.newaxis, :] - p[:, 1:2]) / width
+        g = np.exp(-0.5 * z * z)
+        return amp, width, z, g
+
+    def __call__(self, x, *params):
+        """Fit multiple Gaussian peaks simultaneously"""
+        if len(params) < 3:
+            return np.zeros_like(np.asarray(x, dtype=float))
+        if self.backend == 'numba':
+            x = np.ascontiguousarray(x, dtype=float)
+            return _multi_gaussian_kernel(x, np.asarray(params, dtype=float), np.empty_like(x))
+        amp, _, _, g = self._components(x, params)
+        return amp[:, 0] @ g
+
+    def jacobian(self, x, *params):
+        """Analytic Jacobian (points × parameters) with columns ordered as ``params``"""
+        if self.backend == 'numba':
+            x = np.ascontiguousarray(x, dtype=float)
+            jac = np.zeros((len(x), 3 * (len(params) // 3)))
+            return _multi_gaussian_jacobian_kernel(x, np.asarray(params, dtype=float), jac)
+        amp, width, z, g = self._components(x, params)
+        d_amp = g
+        d_center = amp * g * z / width
+        d_width = d_center * z
+        jac = np.empty((g.shape[1], 3 * g.shape[0]))
+        jac[:, 0::3] = d_amp.T
+        jac[:, 1::3] = d_center.T
+        jac[:, 2::3] = d_width.T
+        return jac
+
+
+# Shared model instance used by all fitting routines in this module
+multi_gaussian = MultiGaussianModel()
+
+
+def gaussian_areas(params, lower, upper):
+    """
+    Areas of Gaussian peaks between lower and upper, from the closed-form integral
+    A·σ·√(π/2)·[erf((upper − x0)/(σ√2)) − erf((lower − x0)/(σ√2))].
+    
+    Parameters:
+    -----------
+    params : array-like
+        Flat [amplitude, center, width] triplets
+    lower, upper : float
+        Integration limits in degrees 2θ
+        
+    Returns:
+    --------
+    numpy.ndarray
+        Area of each peak
+    """
+    p = np.asarray(params, dtype=float).reshape(-1, 3)
+    amp, center, width = p[:, 0], p[:, 1], np.abs(p[:, 2])
+    scale = width * np.sqrt(2)
+    return amp * width * np.sqrt(np.pi / 2) * (erf((upper - center) / scale) - erf((lower - center) / scale))
+
+
+def _component_curve(two_theta, params):
+    """Sum of the Gaussian peaks in params on two_theta, zeros when there are none"""
+    if not params:
+        return np.zeros_like(two_theta)
+    return multi_gaussian(two_theta, *params)
+
+
+class _FitResults(dict):
+    """
+    Fitting results whose crystalline and amorphous component curves are only evaluated
+    on first access. Item access, get(), `in`, iteration and copies behave as for a plain
+    dict with every key present; pickling keeps the curves unevaluated.
+    """
+    
+    def __init__(self, *args, lazy=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # key -> (function, args) for values that have not been evaluated yet
+        self._lazy = dict(lazy or {})
+    
+    def __missing__(self, key):
+        if key not in self._lazy:
+            raise KeyError(key)
+        function, args = self._lazy.pop(key)
+        value = function(*args)
+        super().__setitem__(key, value)
+        return value
+    
+    def _materialise(self):
+        for key in list(self._lazy):
+            self[key]
+    
+    def __setitem__(self, key, value):
+        self._lazy.pop(key, None)
+        super().__setitem__(key, value)
+    
+    def __delitem__(self, key):
+        if self._lazy.pop(key, None) is None:
+            super().__delitem__(key)
+    
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+    
+    def __contains__(self, key):
+        return super().__contains__(key) or key in self._lazy
+    
+    def __len__(self):
+        return super().__len__() + len(self._lazy)
+    
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+    
+    def pop(self, key, *default):
+        if key in self._lazy:
+            self[key]
+        return super().pop(key, *default)
+    
+    def __iter__(self):
+        self._materialise()
+        return super().__iter__()
+    
+    def keys(self):
+        self._materialise()
+        return super().keys()
+    
+    def values(self):
+        self._materialise()
+        return super().values()
+    
+    def items(self):
+        self._materialise()
+        return super().items()
+    
+    def __eq__(self, other):
+        self._materialise()
+        return super().__eq__(other)
+    
+    __hash__ = None
+    
+    def __repr__(self):
+        self._materialise()
+        return super().__repr__()
+    
+    def copy(self):
+        return _FitResults(dict.items(self), lazy=self._lazy)
+    
+    def __reduce__(self):
+        return (_FitResults, (dict(dict.items(self)),), {'_lazy': self._lazy})
+
+
+class _EvaluationCounter:
+    """
+    Wraps multi_gaussian for a single fit and counts model and Jacobian evaluations,
+    including those spent in fitting attempts that fail.
+    """
+    
+    def __init__(self, model=multi_gaussian):
+        self.model = model
+        self.nfev = 0
+        self.njev = 0
+    
+    def __call__(self, x, *params):
+        self.nfev += 1
+        return self.model(x, *params)
+    
+    def jacobian(self, x, *params):
+        self.njev += 1
+        return self.model.jacobian(x, *params)
+
+
+def _warm_start_guess(init_guess, component_keys, bounds_low, bounds_high, param_cache):
+    """
+    Replace the initial guess of every component found in param_cache with its converged
+    parameters, clipped to the bounds derived from the original guess.
+    """
+    warm_guess = list(init_guess)
+    for i, key in enumerate(component_keys):
+        if key in param_cache:
+            warm_guess[3*i:3*i + 3] = np.clip(param_cache[key], bounds_low[3*i:3*i + 3],
+                                              bounds_high[3*i:3*i + 3]).tolist()
+    return warm_guess
+
+
+def _cache_fitted_components(param_cache, results, kind):
+    """
+    Store the converged parameters of one kind of component ('amorphous' or
+    'crystalline') from a fit, keeping the first value stored for each position.
+    """
+    if param_cache is None:
+        return
+    for key, params in results.get('fitted_components', {}).items():
+        if key[0] == kind:
+            param_cache.setdefault(key, np.array(params))
+
+
+class _FittingContext:
+    """
+    State shared by all the fits of one spectrum. The drivers create one per call and
+    pass it to every fit explicitly, so spectra fitted concurrently (threads, asyncio
+    executors, pool workers) or in interleaved calls cannot see each other's state.
+    
+    Parameters:
+    -----------
+    all_known_crys_peaks : list, optional
+        Every known crystalline peak position of the material. Fits that include only
+        some of these peaks still classify components near any of them as crystalline
+    backend : {'numpy', 'numba'}, default='numpy'
+        Backend of the multi-Gaussian model used by the fits (see MultiGaussianModel)
+    fallback_strategies : tuple, default=('unbounded',)
+        Alternative fits of _perform_fitting_detailed when its bounded fit fails, in
+        order of preference (see _fallback_fits)
+    fallback_selection : {'first', 'best'}, default='first'
+        How _run_fallback_fits chooses among the alternative fits that succeed
+    fallback_max_nfev : int or None, default=None
+        Evaluation budget of each alternative fit. None keeps their own limits
+    """
+    
+    def __init__(self, all_known_crys_peaks=None, backend='numpy', fallback_strategies=('unbounded',),
+                 fallback_selection='first', fallback_max_nfev=None):
+        self.all_known_crys_peaks = list(all_known_crys_peaks or [])
+        self.model = multi_gaussian if backend == 'numpy' else MultiGaussianModel(backend)
+        self.fallback_strategies = tuple(fallback_strategies)
+        self.fallback_selection = fallback_selection
+        self.fallback_max_nfev = fallback_max_nfev
+    
+    def crystalline_reference(self, known_crys_peaks):
+        """All known crystalline positions followed by any of known_crys_peaks not among them"""
+        reference = list(self.all_known_crys_peaks)
+        for pos in known_crys_peaks or []:
+            if pos not in reference:
+                reference.append(pos)
+        return reference
+
+
+class _FitBudget:
+    """
+    Wall-time and model-evaluation allowance of one driver call. The drivers check it
+    before every fit of Phases 2A and 2B; once it is exhausted the remaining single-peak
+    and combination fits are skipped and the driver goes on to Phase 3 with the best
+    model found so far. A fit that is already running is always finished, and Phase 1,
+    Phase 3 and the full-resolution polish are never skipped.
+    
+    Parameters:
+    -----------
+    time_budget_s : float or None, default=None
+        Wall time in seconds, counted from the creation of the budget. None for no limit
+    max_total_nfev : int or None, default=None
+        Model evaluations of all fits together. None for no limit
+    phase_nfev : dict, optional
+        The driver's running count of model evaluations per phase
+    """
+    
+    def __init__(self, time_budget_s=None, max_total_nfev=None, phase_nfev=None):
+        self.time_budget_s = time_budget_s
+        self.max_total_nfev = max_total_nfev
+        self.phase_nfev = phase_nfev if phase_nfev is not None else {}
+        self.start = time.perf_counter()
+        self.exhausted_in = None
+        self.skipped_peaks = []
+    
+    def nfev_used(self):
+        return sum(count for phase, count in self.phase_nfev.items() if phase != 'total')
+    
+    def check(self, phase):
+        """
+        Whether the budget is exhausted. The phase in which this first happens is recorded
+        and reported once.
+        """
+        if self.exhausted_in is None:
+            elapsed = time.perf_counter() - self.start
+            nfev_used = self.nfev_used()
+            if self.time_budget_s is not None and elapsed >= self.time_budget_s:
+                reason = f"{elapsed:.1f} s of {self.time_budget_s:g} s"
+            elif self.max_total_nfev is not None and nfev_used >= self.max_total_nfev:
+                reason = f"{nfev_used} of {self.max_total_nfev} model evaluations"
+            else:
+                return False
+            self.exhausted_in = phase
+            logger.info(f"  Budget exhausted in {phase} ({reason}); skipping the remaining fits")
+        return True
+    
+    def summary(self):
+        return {
+            'time_budget_s': self.time_budget_s,
+            'max_total_nfev': self.max_total_nfev,
+            'elapsed_s': time.perf_counter() - self.start,
+            'nfev': self.nfev_used(),
+            'limited': self.exhausted_in is not None,
+            'exhausted_in': self.exhausted_in,
+            'skipped_peaks': list(self.skipped_peaks),
+        }
+
+
+_FALLBACK_STRATEGIES = ('fixed_guess', 'unbounded', 'simplified')
+_FALLBACK_SELECTIONS = ('first', 'best')
+
+
+class _FitCancelled(Exception):
+    """Raised inside a fallback fit once another fallback fit has been chosen"""
+
+
+class _CancellableCounter(_EvaluationCounter):
+    """
+    Evaluation counter for one fallback fit. Every model and Jacobian evaluation first
+    checks the shared cancel event, so a fit that is no longer needed stops at its next
+    evaluation instead of running to convergence.
+    """
+    
+    def __init__(self, model, cancel):
+        super().__init__(model)
+        self.cancel = cancel
+    
+    def __call__(self, x, *params):
+        if self.cancel.is_set():
+            raise _FitCancelled("cancelled")
+        return super().__call__(x, *params)
+    
+    def jacobian(self, x, *params):
+        if self.cancel.is_set():
+            raise _FitCancelled("cancelled")
+        return super().jacobian(x, *params)
+
+
+# MINPACK, behind curve_fit's 'lm' method, is not re-entrant in the pinned SciPy (1.11), so
+# 'lm' fits run one at a time in the whole process, whichever thread or fit they belong to
+_MINPACK_LOCK = threading.Lock()
+
+
+def _fallback_fits(two_theta, intensity, init_guess, bounds_low, bounds_high, known_crys_peaks,
+                   with_crystalline, strategies, max_nfev=None):
+    """
+    Alternative fits of _perform_fitting_detailed for when its bounded fit fails, as
+    (name, fit) pairs in the order of strategies; fit(model) returns the fitted parameters.
+    
+    'fixed_guess' refits with the initial guess moved just inside the bounds, and is left
+    out if the guess was already within them (the refit would repeat the failed fit).
+    'unbounded' fits the initial guess with Levenberg-Marquardt and a finite-difference
+    Jacobian. 'simplified' fits one amorphous and at most one crystalline peak, so its
+    parameters do not follow the layout of the initial guess. max_nfev caps the
+    evaluation limit of every fit.
+    """
+    def budget(maxfev):
+        return maxfev if max_nfev is None else min(maxfev, max_nfev)
+    
+    fits = {}
+    guess = np.asarray(init_guess, dtype=float)
+    low = np.asarray(bounds_low, dtype=float)
+    high = np.asarray(bounds_high, dtype=float)
+    if np.any(guess < low) or np.any(guess > high):
+        fixed_guess = np.where(guess < low, low + 1e-6, np.where(guess > high, high - 1e-6, guess))
+        fits['fixed_guess'] = lambda model: curve_fit(
+            model, two_theta, intensity, jac=model.jacobian, p0=fixed_guess,
+            bounds=(bounds_low, bounds_high), maxfev=budget(20000))[0]
+    
+    # Finite-difference Jacobian: unbounded fits are often ill-conditioned, and the analytic
+    # one leads some of them to a different optimum than the published results
+    def unbounded(model):
+        with _MINPACK_LOCK:
+            return curve_fit(model, two_theta, intensity, p0=init_guess, method='lm',
+                             maxfev=budget(25000))[0]
+    fits['unbounded'] = unbounded
+    
+    # Very simple initial guess with relaxed bounds: one broad amorphous peak and,
+    # if requested, the first known crystalline peak
+    simple_guess = [np.mean(intensity) / 2, 25, 8.0]
+    simple_low = [0, 10, 3.0]
+    simple_high = [np.inf, 40, 20.0]
+    if with_crystalline and known_crys_peaks:
+        pos = known_crys_peaks[0]
+        height = intensity[np.argmin(np.abs(two_theta - pos))] * 0.5
+        simple_guess.extend([height, pos, 0.8])
+        simple_low.extend([0, pos - 1, 0.2])
+        simple_high.extend([np.inf, pos + 1, 2.0])
+    fits['simplified'] = lambda model: curve_fit(
+        model, two_theta, intensity, jac=model.jacobian, p0=simple_guess,
+        bounds=(simple_low, simple_high), maxfev=budget(15000))[0]
+    
+    return [(name, fits[name]) for name in strategies if name in fits]
+
+
+def _run_fallback_fits(fits, model, two_theta, intensity, selection='first'):
+    """
+    Run the fallback fits concurrently, one thread each, and return (name, parameters)
+    of the chosen fit, or None if every fit fails. A single fit runs in the calling thread.
+    
+    'first' takes the most preferred fit that succeeds as soon as it and every fit
+    before it have finished, and cancels the rest; 'best' waits for all of them and
+    takes the highest R². Either way the choice does not depend on which thread finishes
+    first. The evaluations of every fit, including cancelled ones, are added to model.
+    Only 'unbounded' uses MINPACK, and it holds _MINPACK_LOCK while it runs.
+    """
+    if not fits:
+        return None
+    
+    cancel = threading.Event()
+    counters = [_CancellableCounter(model.model, cancel) for _ in fits]
+    succeeded = []
+    if len(fits) == 1:
+        (name, fit), = fits
+        try:
+            succeeded.append((name, fit(counters[0])))
+        except Exception as e:
+            logger.debug("Fallback '%s' failed: %s", name, e)
+    else:
+        with ThreadPoolExecutor(max_workers=len(fits)) as executor:
+            futures = [executor.submit(fit, counter) for (_, fit), counter in zip(fits, counters)]
+            for (name, _), future in zip(fits, futures):
+                try:
+                    popt = future.result()
+                except Exception as e:
+                    logger.debug("Fallback '%s' failed: %s", name, e)
+                    continue
+                succeeded.append((name, popt))
+                if selection == 'first':
+                    cancel.set()
+                    break
+    
+    for counter in counters:
+        model.nfev += counter.nfev
+        model.njev += counter.njev
+    
+    if not succeeded:
+        return None
+    if selection == 'best' and len(succeeded) > 1:
+        ss_tot = np.sum((intensity - np.mean(intensity))**2)
+        r_squared = [1 - np.sum((intensity - model.model(two_theta, *popt))**2) / ss_tot
+                     for _, popt in succeeded]
+        for (name, _), value in zip(succeeded, r_squared):
+            logger.debug("Fallback '%s' R² = %.4f", name, value)
+        return succeeded[int(np.argmax(np.nan_to_num(r_squared, nan=-np.inf)))]
+    return succeeded[0]
+
+
+_FIT_SOLVERS = ('curve_fit', 'varpro', 'sparse')
+
+
+def _fit_variable_projection(model, x, y, p0, bounds_low, bounds_high, max_nfev=20000, ftol=1e-6):
+    """
+    Fit the multi-Gaussian model by variable projection (separable least squares).
+    
+    The amplitudes enter the model linearly, so for every trial set of centres and widths
+    they are solved exactly by non-negative least squares, and least_squares only searches
+    over the centres and widths. The amplitude bounds are always [0, inf), which NNLS
+    enforces; the initial amplitudes are not used. The Jacobian is Kaufman's approximation
+    of the projected model derivatives.
+    
+    Because NNLS switches the set of active peaks, the projected cost is only piecewise
+    smooth and the optimiser can creep along an active-set boundary for thousands of
+    iterations, so the variables are scaled by the Jacobian and the relative cost
+    tolerance is 1e-6 instead of curve_fit's 1e-8.
+    
+    Parameters:
+    -----------
+    model : _EvaluationCounter
+        Counter wrapping multi_gaussian; residual and Jacobian evaluations are added to it
+    x, y : array-like
+        2θ angles and intensities to fit
+    p0, bounds_low, bounds_high : list
+        Initial guess and bounds in the usual [amp, center, width] triplet layout
+    max_nfev : int, default=20000
+        Maximum number of residual evaluations
+    ftol : float, default=1e-6
+        Relative change in the sum of squares at which least_squares stops
+        
+    Returns:
+    --------
+    numpy.ndarray
+        Optimised parameters in [amp, center, width] triplet layout
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    nonlinear = lambda values: np.asarray(values, dtype=float).reshape(-1, 3)[:, 1:].ravel()
+    low, high = nonlinear(bounds_low), nonlinear(bounds_high)
+    theta0 = np.clip(nonlinear(p0), low, high)
+    last = {}
+    
+    def project(theta):
+        # Residual and Jacobian are evaluated at the same point, so keep the last solution
+        if last.get('theta') is None or not np.array_equal(last['theta'], theta):
+            params = np.column_stack([np.ones(len(theta) // 2), theta.reshape(-1, 2)]).ravel()
+            _, width, z, g = MultiGaussianModel._components(x, params)
+            # NNLS on the triangular factor gives the same amplitudes as on the full design
+            # matrix, and the orthogonal factor is reused by the Jacobian
+            q, r = np.linalg.qr(g.T)
+            amplitudes, _ = nnls(r, q.T @ y)
+            last.update(theta=theta.copy(), amplitudes=amplitudes, width=width, z=z, g=g, q=q)
+        return last
+    
+    def residuals(theta):
+        model.nfev += 1
+        p = project(theta)
+        return p['amplitudes'] @ p['g'] - y
+    
+    def jacobian(theta):
+        model.njev += 1
+        p = project(theta)
+        d_center = p['amplitudes'][:, None] * p['g'] * p['z'] / p['width']
+        derivatives = np.empty((len(x), len(theta)))
+        derivatives[:, 0::2] = d_center.T
+        derivatives[:, 1::2] = (d_center * p['z']).T
+        # Project out the span of the peaks with non-zero amplitude
+        active = p['amplitudes'] > 0
+        if active.all():
+            derivatives -= p['q'] @ (p['q'].T @ derivatives)
+        elif active.any():
+            q, _ = np.linalg.qr(p['g'][active].T)
+            derivatives -= q @ (q.T @ derivatives)
+        return derivatives
+    
+    res = least_squares(residuals, theta0, jac=jacobian, bounds=(low, high), x_scale='jac',
+                        ftol=ftol, max_nfev=max_nfev)
+    if not res.success:
+        raise RuntimeError("Optimal parameters not found: " + res.message)
+    
+    amplitudes = project(res.x)['amplitudes']
+    return np.column_stack([amplitudes, res.x.reshape(-1, 2)]).ravel()
+
+
+class FitSummary:
+    """
+    Parameters and goodness-of-fit metrics of one fit, without the fitted curves or peak
+    lists. Phase 2B keeps one of these per peak combination tried instead of the full
+    fitting results, and values can be read by key (summary['r_squared']) as for them.
+    """
+    
+    __slots__ = ('crystalline_params', 'amorphous_params', 'crystallinity', 'r_squared',
+                 'rmse', 'nfev', 'njev')
+    
+    def __init__(self, crystalline_params, amorphous_params, crystallinity, r_squared, rmse,
+                 nfev=0, njev=0):
+        self.crystalline_params = np.asarray(crystalline_params, dtype=float)
+        self.amorphous_params = np.asarray(amorphous_params, dtype=float)
+        self.crystallinity = float(crystallinity)
+        self.r_squared = float(r_squared)
+        self.rmse = float(rmse)
+        self.nfev = int(nfev)
+        self.njev = int(njev)
+    
+    @classmethod
+    def from_results(cls, results):
+        """Summarise the results dictionary returned by _perform_fitting_fast/_detailed"""
+        return cls(results['crystalline_params'], results['amorphous_params'],
+                   results['crystallinity'], results['r_squared'], results['rmse'],
+                   results.get('nfev', 0), results.get('njev', 0))
+    
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def __repr__(self):
+        return (f"FitSummary(crystalline_peaks={len(self.crystalline_params) // 3}, "
+                f"amorphous_peaks={len(self.amorphous_params) // 3}, "
+                f"crystallinity={self.crystallinity:.2f}, r_squared={self.r_squared:.4f})")
+
+
+# Half-width of the region around each peak, in peak widths, used by the 'sparse' solver.
+# Beyond 8σ a Gaussian is below 1.3e-14 of its amplitude
+_SPARSE_SUPPORT_SIGMA = 8.0
+
+
+def _fit_sparse_support(model, x, y, p0, bounds_low, bounds_high, max_nfev=20000,
+                        support_sigma=_SPARSE_SUPPORT_SIGMA, ftol=1e-8):
+    """
+    Fit the multi-Gaussian model evaluating every peak only within ±support_sigma widths
+    of its centre.
+    
+    The residuals and the analytic Jacobian are assembled from the points inside each
+    peak's support, and the Jacobian is returned as a sparse matrix whose pattern is
+    that support, so least_squares uses its sparse trust-region solver (LSMR). The work
+    per iteration scales with the total support of the peaks rather than with the
+    number of points times the number of peaks, which pays off for narrow crystalline
+    reflections on long or finely sampled scans. The supports follow the peaks as their
+    centres and widths change.
+    
+    Parameters:
+    -----------
+    model : _EvaluationCounter
+        Counter wrapping multi_gaussian; residual and Jacobian evaluations are added to it
+    x, y : array-like
+        2θ angles and intensities to fit
+    p0, bounds_low, bounds_high : list
+        Initial guess and bounds in the usual [amp, center, width] triplet layout
+    max_nfev : int, default=20000
+        Maximum number of residual evaluations
+    support_sigma : float, default=_SPARSE_SUPPORT_SIGMA
+        Half-width of each peak's support in units of its width
+        
+    Returns:
+    --------
+    numpy.ndarray
+        Optimised parameters in [amp, center, width] triplet layout
+    """
+    # Work on the points in ascending order so that each support is a contiguous slice
+    order = np.argsort(np.asarray(x, dtype=float), kind='stable')
+    x = np.asarray(x, dtype=float)[order]
+    y = np.asarray(y, dtype=float)[order]
+    num_params = len(p0)
+    
+    def supports(params):
+        p = np.asarray(params, dtype=float).reshape(-1, 3)
+        reach = support_sigma * np.abs(p[:, 2])
+        starts = np.searchsorted(x, p[:, 1] - reach, side='left')
+        stops = np.searchsorted(x, p[:, 1] + reach, side='right')
+        return p, starts, stops
+    
+    def residuals(params):
+        model.nfev += 1
+        p, starts, stops = supports(params)
+        fit = np.zeros_like(y)
+        for (amp, center, width), start, stop in zip(p, starts, stops):
+            z = (x[start:stop] - center) / width
+            fit[start:stop] += amp * np.exp(-0.5 * z * z)
+        return fit - y
+    
+    def jacobian(params):
+        model.njev += 1
+        p, starts, stops = supports(params)
+        rows, columns, values = [], [], []
+        for k, ((amp, center, width), start, stop) in enumerate(zip(p, starts, stops)):
+            z = (x[start:stop] - center) / width
+            g = np.exp(-0.5 * z * z)
+            d_center = amp * g * z / width
+            rows.append(np.tile(np.arange(start, stop), 3))
+            columns.append(np.repeat([3*k, 3*k + 1, 3*k + 2], stop - start))
+            values.append(np.concatenate([g, d_center, d_center * z]))
+        return csr_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(columns))),
+                          shape=(len(x), num_params))
+    
+    res = least_squares(residuals, np.asarray(p0, dtype=float), jac=jacobian,
+                        bounds=(bounds_low, bounds_high), tr_solver='lsmr', ftol=ftol, max_nfev=max_nfev)
+    if not res.success:
+        raise RuntimeError("Optimal parameters not found: " + res.message)
+    return res.x
+
+
+def _fit_peak_combination(engine, two_theta, baseline_corrected_intensity, peak_combination,
+                          known_amorp_peaks, peak_data, height_width_threshold, context,
+                          fit_options=None):
+    """
+    Fit a single Phase 2B peak combination with the given engine ('fast' or 'detailed').
+    
+    This runs either in the calling process or in a pool worker, which receives a copy
+    of the driver's fitting context.
+    
+    Returns:
+    --------
+    tuple
+        (peak_combination, fitting results or None, error message or None)
+    """
+    perform_fitting, _ = _FITTING_ENGINES[engine]
+    try:
+        results = perform_fitting(two_theta, baseline_corrected_intensity,
+                                  peak_combination, known_amorp_peaks, peak_data,
+                                  height_width_threshold, with_crystalline=True,
+                                  context=context, **(fit_options or {}))
+        return peak_combination, results, None
+    except Exception as e:
+        return peak_combination, None, str(e)
+
+
+class _SharedSpectra:
+    """
+    1D float arrays published once in a multiprocessing.shared_memory block, so pool
+    workers can read them as zero-copy NumPy views instead of receiving a pickled copy
+    with every task. The creating process owns the block and frees it on close().
+    
+    Parameters:
+    -----------
+    arrays : dict
+        Name -> array to publish; each is copied once into the block as float64
+    """
+    
+    def __init__(self, arrays):
+        arrays = {name: np.ascontiguousarray(values, dtype=float) for name, values in arrays.items()}
+        sizes = [values.size for values in arrays.values()]
+        self._shm = shared_memory.SharedMemory(create=True, size=max(1, 8 * sum(sizes)))
+        block = np.ndarray(sum(sizes), dtype=float, buffer=self._shm.buf)
+        offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(int)
+        for (name, values), offset in zip(arrays.items(), offsets):
+            block[offset:offset + values.size] = values
+        # (block name, ((array name, offset, length), ...)): what workers need to attach
+        self.descriptor = (self._shm.name, tuple((name, int(offset), int(size))
+                                                 for name, offset, size in zip(arrays, offsets, sizes)))
+    
+    def close(self):
+        self._shm.close()
+        self._shm.unlink()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _attach_shared_spectra(descriptor):
+    """Attach to a _SharedSpectra block: (SharedMemory handle, dict of read-only views)"""
+    name, layout = descriptor
+    shm = shared_memory.SharedMemory(name=name)
+    block = np.ndarray(shm.size // 8, dtype=float, buffer=shm.buf)
+    views = {}
+    for array_name, offset, size in layout:
+        views[array_name] = block[offset:offset + size]
+        views[array_name].flags.writeable = False
+    return shm, views
+
+
+# Per-process state of Phase 2B pool workers, set once by _init_combination_worker
+_COMBINATION_WORKER = {}
+
+
+def _init_combination_worker(descriptor, engine, known_crys_peaks, fit_extra):
+    """
+    Pool initializer: attach to the shared spectrum and keep the per-spectrum fitting
+    arguments, which are sent once per worker instead of once per combination.
+    """
+    shm, views = _attach_shared_spectra(descriptor)
+    _COMBINATION_WORKER.update(shm=shm, engine=engine, known_crys_peaks=list(known_crys_peaks),
+                               two_theta=views['two_theta'], intensity=views['intensity'],
+                               fit_extra=fit_extra)
+
+
+def _fit_shared_combination(peak_indices):
+    """Fit the combination of known_crys_peaks at peak_indices in a pool worker"""
+    state = _COMBINATION_WORKER
+    peak_combination = [state['known_crys_peaks'][i] for i in peak_indices]
+    return _fit_peak_combination(state['engine'], state['two_theta'], state['intensity'],
+                                 peak_combination, *state['fit_extra'])
+
+
+def _evaluate_peak_combinations(engine, two_theta, baseline_corrected_intensity, peak_combinations,
+                                known_amorp_peaks, peak_data, height_width_threshold,
+                                context, fit_options=None, executor=None, known_crys_peaks=None):
+    """
+    Fit every peak combination and yield (peak_combination, results, error) tuples.
+    
+    With an executor from _combination_pool the fits are distributed over its worker
+    processes, which already hold the spectrum and the other fitting arguments; each task
+    only carries the indices of its peaks in known_crys_peaks. Results are always yielded
+    in the order of peak_combinations, so the caller's reduction (best R², stored
+    combination results) is the same as for a serial run.
+    """
+    if executor is None or len(peak_combinations) < 2:
+        for peak_combination in peak_combinations:
+            yield _fit_peak_combination(engine, two_theta, baseline_corrected_intensity, peak_combination,
+                                        known_amorp_peaks, peak_data, height_width_threshold, context,
+                                        fit_options)
+        return
+    
+    peak_index = {pos: i for i, pos in enumerate(known_crys_peaks)}
+    futures = [executor.submit(_fit_shared_combination, tuple(peak_index[pos] for pos in peak_combination))
+               for peak_combination in peak_combinations]
+    try:
+        for future in futures:
+            yield future.result()
+    finally:
+        # A caller that stops early (e.g. out of budget) should not wait for the queued fits
+        for future in futures:
+            future.cancel()
+
+
+@contextlib.contextmanager
+def _combination_pool(n_workers, engine, two_theta, baseline_corrected_intensity, known_crys_peaks,
+                      known_amorp_peaks, peak_data, height_width_threshold, context, fit_options=None):
+    """
+    Process pool for the Phase 2B fits of one spectrum. The spectrum is published once
+    in shared memory and the remaining fitting arguments are passed to each worker once,
+    at start-up. Yields None, for serial fitting, when n_workers is None or 1.
+    """
+    if n_workers is None or n_workers <= 1:
+        yield None
+        return
+    
+    fit_extra = (known_amorp_peaks, peak_data, height_width_threshold, context, fit_options)
+    with _SharedSpectra({'two_theta': two_theta, 'intensity': baseline_corrected_intensity}) as shared:
+        executor = ProcessPoolExecutor(max_workers=n_workers, initializer=_init_combination_worker,
+                                       initargs=(shared.descriptor, engine, known_crys_peaks, fit_extra))
+        try:
+            yield executor
+        finally:
+            # Workers must be gone before the shared block is unlinked
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+_COMBINATION_SELECTIONS = ('exhaustive', 'stepwise', 'ranked')
+
+
+def _search_peak_combinations(selection, engine, two_theta, baseline_corrected_intensity, known_crys_peaks,
+                              known_amorp_peaks, peak_data, height_width_threshold, max_size,
+                              peak_metrics, single_peak_r2, amorphous_r2, search_stats, n_workers=None,
+                              fit_options=None, context=None, budget=None):
+    """
+    Phase 2B subset search. Yields (peak_combination, results, error) tuples in the same
+    way as _evaluate_peak_combinations and records the number of fits run and skipped
+    (relative to the exhaustive search) in search_stats.
+    
+    Strategies:
+    - 'exhaustive': every combination of 2..max_size peaks, in itertools order.
+    - 'stepwise': fit every pair, then grow the best subset one peak at a time while the
+      overall R² keeps improving. The number of fits grows quadratically with the number
+      of reference peaks instead of combinatorially.
+    - 'ranked': depth-first search over subsets, visiting peaks in order of their Phase 2A
+      quality score so that good combinations are found early. A subset is not extended
+      when its R² plus the summed gains of the remaining peaks (their single-peak R² over
+      the amorphous-only R²) does not exceed the best subset found so far. Fits are
+      sequential, so n_workers is not used.
+    
+    'stepwise' and 'ranked' are heuristics, not exact prunes. Peaks fitted together do not
+    add up, and a combination fit is not nested in the fits of its supersets (a known peak
+    left out is still fitted as a detected peak), so neither the summed gains nor the R² of
+    a larger combination bounds the R² of a subset, and both can miss the exhaustive
+    answer. No admissible bound tighter than R² <= 1 is available, which is why only
+    'exhaustive' is exact.
+    
+    Combinations are always reported with peaks in known_crys_peaks order so that their
+    keys match the ones produced by the exhaustive search. fit_options are passed on to
+    every combination fit (solver, warm-start parameters), together with the driver's
+    fitting context (by default one with known_crys_peaks as the crystalline reference).
+    With a _FitBudget, the search stops before the first fit that would start after the
+    budget is exhausted, and search_stats['stopped_by_budget'] is set.
+    """
+    all_combinations = [list(peak_combination)
+                        for combination_size in range(2, max_size + 1)
+                        for peak_combination in itertools.combinations(known_crys_peaks, combination_size)]
+    search_stats.update({'selection': selection, 'total_combinations': len(all_combinations),
+                         'fits_run': 0, 'fits_skipped': 0, 'stopped_by_budget': False})
+    peak_order = {pos: i for i, pos in enumerate(known_crys_peaks)}
+    if context is None:
+        context = _FittingContext(known_crys_peaks)
+    
+    def fit_batch(peak_combinations):
+        peak_combinations = [sorted(peaks, key=peak_order.get) for peaks in peak_combinations]
+        outcomes = _evaluate_peak_combinations(engine, two_theta, baseline_corrected_intensity,
+                                               peak_combinations, known_amorp_peaks, peak_data,
+                                               height_width_threshold, context, fit_options=fit_options,
+                                               executor=executor, known_crys_peaks=known_crys_peaks)
+        # Serial fits run when the next outcome is requested, so check the budget before that
+        while budget is None or not budget.check("Phase 2B"):
+            outcome = next(outcomes, None)
+            if outcome is None:
+                return
+            search_stats['fits_run'] += 1
+            yield outcome
+        search_stats['stopped_by_budget'] = True
+        outcomes.close()
+    
+    def outcome_r2(outcome):
+        # Failed fits and fits without crystallinity can never be selected as the best combination
+        _, results, error = outcome
+        if error is not None or results['crystallinity'] <= 0:
+            return -np.inf
+        return results['r_squared']
+    
+    # The ranked search fits one combination at a time, so it does not start a pool
+    with _combination_pool(n_workers if selection != 'ranked' else None, engine, two_theta,
+                           baseline_corrected_intensity, known_crys_peaks, known_amorp_peaks, peak_data,
+                           height_width_threshold, context, fit_options) as executor:
+        if selection == 'exhaustive':
+            yield from fit_batch(all_combinations)
+        
+        elif selection == 'stepwise':
+            outcomes = list(fit_batch(itertools.combinations(known_crys_peaks, 2)))
+            yield from outcomes
+            current = max(outcomes, key=outcome_r2, default=None)
+            while current is not None and np.isfinite(outcome_r2(current)) and len(current[0]) < max_size:
+                extensions = [current[0] + [pos] for pos in known_crys_peaks if pos not in current[0]]
+                outcomes = list(fit_batch(extensions))
+                yield from outcomes
+                best_extension = max(outcomes, key=outcome_r2, default=None)
+                if best_extension is None or outcome_r2(best_extension) <= outcome_r2(current):
+                    break
+                current = best_extension
+        
+        elif selection == 'ranked':
+            quality = {}
+            for pos in known_crys_peaks:
+                score = peak_metrics.get(pos, {}).get('quality_score', -np.inf)
+                quality[pos] = score if np.isfinite(score) else -np.inf
+            ranked = sorted(known_crys_peaks, key=lambda pos: -quality[pos])
+            gain = [max(0.0, single_peak_r2.get(pos, amorphous_r2) - amorphous_r2) for pos in ranked]
+            best_r2 = [-np.inf]
+            
+            def branch(subset, subset_r2, start):
+                for i in range(start, len(ranked)):
+                    # Remaining gains shrink as i grows, so once the estimate fails it fails for all later peaks
+                    if min(1.0, subset_r2 + sum(gain[i:])) <= best_r2[0]:
+                        break
+                    candidate = subset + [ranked[i]]
+                    if len(candidate) == 1:
+                        candidate_r2 = single_peak_r2.get(ranked[i], amorphous_r2)
+                    else:
+                        outcome = next(fit_batch([candidate]), None)
+                        if outcome is None:
+                            return
+                        yield outcome
+                        candidate_r2 = outcome_r2(outcome)
+                        best_r2[0] = max(best_r2[0], candidate_r2)
+                        if not np.isfinite(candidate_r2):
+                            # A superset can always reproduce its subset, so keep the parent's R²
+                            candidate_r2 = subset_r2
+                    if len(candidate) < max_size:
+                        yield from branch(candidate, candidate_r2, i + 1)
+            
+            yield from branch([], amorphous_r2, 0)
+    
+    search_stats['fits_skipped'] = search_stats['total_combinations'] - search_stats['fits_run']
+
+
+_BASELINE_METHODS = ('minimum', 'asls', 'arpls')
+
+
+def _second_difference_bands(num_points):
+    """
+    D'D for the second-difference matrix D of num_points points, in the upper banded
+    storage of scipy.linalg.solveh_banded (rows: 2nd superdiagonal, 1st, main diagonal)
+    """
+    bands = np.zeros((3, num_points))
+    bands[2] = 6.0
+    bands[2, [0, -1]] = 1.0
+    bands[2, [1, -2]] = 5.0
+    bands[1, 1:] = -4.0
+    bands[1, [1, -1]] = -2.0
+    bands[0, 2:] = 1.0
+    return bands
+
+
+def _baseline_weights(method, signal, baseline, p):
+    """Updated weights of each row of signal for an AsLS or arPLS baseline"""
+    residual = signal - baseline
+    if method == 'asls':
+        return np.where(residual > 0, p, 1 - p)
+    
+    # arPLS: logistic weights from the mean and spread of the negative residuals, which
+    # are taken to be noise about the baseline
+    negative = np.where(residual < 0, residual, np.nan)
+    with np.errstate(invalid='ignore'):
+        mean = np.nanmean(negative, axis=1, keepdims=True)
+        std = np.nanstd(negative, axis=1, keepdims=True)
+    mean = np.nan_to_num(mean)
+    std = np.where(np.isfinite(std) & (std > 0), std, 1.0)
+    exponent = np.clip(2 * (residual - (2 * std - mean)) / std, -500, 500)
+    return 1 / (1 + np.exp(exponent))
+
+
+def estimate_baseline(two_theta, intensity, method='arpls', lam=100.0, p=0.01, max_iter=100, tol=1e-5):
+    """
+    Smooth background under a spectrum by asymmetric (AsLS) or asymmetrically reweighted
+    (arPLS) penalised least squares.
+    
+    Each iteration solves (W + lam·D'D) z = W y, with D the second-difference matrix. The
+    system is pentadiagonal, so it is solved by banded Cholesky in O(n); a stack of spectra
+    is solved as one block-diagonal system per iteration, and spectra whose weights have
+    converged are dropped from later iterations.
+    
+    Parameters:
+    -----------
+    two_theta : array-like
+        Array of 2θ angles in degrees, evenly spaced
+    intensity : array-like
+        One spectrum, or a 2D array with one spectrum per row on the two_theta grid
+    method : {'arpls', 'asls'}, default='arpls'
+        'asls' weights points above the baseline by p and below it by 1 - p; 'arpls' uses
+        logistic weights from the statistics of the negative residuals and has no p
+    lam : float, default=100.0
+        Smoothness penalty for a 2θ axis in degrees; it is divided by the fourth power
+        of the step size, so the same value suits coarse and fine scans. The default
+        keeps the baseline below the amorphous halo; smaller values let it follow broad
+        peaks
+    p : float, default=0.01
+        Asymmetry of 'asls'
+    max_iter : int, default=100
+        Maximum number of reweighting iterations
+    tol : float, default=1e-5
+        Relative change of the weights below which a spectrum has converged. arPLS
+        weights settle slowly, and looser values can stop one or two hundredths of the
+        peak height away from the converged baseline
+    
+    Returns:
+    --------
+    numpy.ndarray
+        Baseline with the shape of intensity
+    """
+    if method not in ('asls', 'arpls'):
+        raise ValueError(f"method must be 'asls' or 'arpls', got {method!r}")
+    signal = np.asarray(intensity, dtype=float)
+    stacked = np.atleast_2d(signal)
+    num_spectra, num_points = stacked.shape
+    if num_points < 3:
+        raise ValueError("A baseline needs at least 3 points per spectrum")
+    
+    step = np.mean(np.diff(np.asarray(two_theta, dtype=float)))
+    penalty = lam / step**4 * _second_difference_bands(num_points)
+    weights = np.ones_like(stacked)
+    baseline = np.empty_like(stacked)
+    active = np.arange(num_spectra)
+    
+    for _ in range(max_iter):
+        # Blocks do not overlap: the bands of each block have zeros where they would
+        # reach into the previous one
+        ab = np.tile(penalty, len(active))
+        ab[2] += weights[active].ravel()
+        baseline[active] = solveh_banded(ab, (weights[active] * stacked[active]).ravel(),
+                                         check_finite=False).reshape(len(active), num_points)
+    
+        new_weights = _baseline_weights(method, stacked[active], baseline[active], p)
+        change = (np.linalg.norm(new_weights - weights[active], axis=1)
+                  / np.linalg.norm(weights[active], axis=1))
+        weights[active] = new_weights
+        active = active[change >= tol]
+        if not len(active):
+            break
+    
+    return baseline.reshape(signal.shape)
+
+
+_PREPROCESSING_CACHE = OrderedDict()
+_PREPROCESSING_CACHE_SIZE = 128
+_PREPROCESSING_CACHE_LOCK = threading.Lock()
+
+
+def clear_preprocessing_cache():
+    """Empty the memoised results of preprocess_xrd_spectrum"""
+    with _PREPROCESSING_CACHE_LOCK:
+        _PREPROCESSING_CACHE.clear()
+
+
+def _preprocessing_key(two_theta, intensity, min_prominence, baseline_method='minimum', baseline_lam=100.0):
+    """
+    Key of a spectrum in the preprocessing cache: contents of both arrays, min_prominence
+    and the baseline settings
+    """
+    return (two_theta.shape, two_theta.dtype.str, hashlib.sha1(two_theta.tobytes()).hexdigest(),
+            intensity.shape, intensity.dtype.str, hashlib.sha1(intensity.tobytes()).hexdigest(),
+            float(min_prominence), baseline_method, float(baseline_lam))
+
+
+def _seed_preprocessing_cache(entries):
+    """
+    Store (key, preprocessing result) pairs computed elsewhere, e.g. by the parent process
+    as the initializer of a worker pool, so the workers do not preprocess the spectra again.
+    """
+    with _PREPROCESSING_CACHE_LOCK:
+        for key, preprocessed in entries:
+            _PREPROCESSING_CACHE[key] = preprocessed
+            _PREPROCESSING_CACHE.move_to_end(key)
+        while len(_PREPROCESSING_CACHE) > _PREPROCESSING_CACHE_SIZE:
+            _PREPROCESSING_CACHE.popitem(last=False)
+
+
+def _condition_spectra(two_theta, intensities, baseline_method='minimum', baseline_lam=100.0):
+    """
+    Steps 1-3 of preprocess_xrd_spectrum for every row of a 2D array of spectra on the
+    two_theta grid, as whole-array operations.
+    """
+    # --- Step 1: Data Preprocessing ---
+    # Normalize intensity
+    normalized_intensity = intensities / np.max(intensities, axis=1, keepdims=True)
+    
+    # Smooth the normalized data
+    smoothed_intensity = savgol_filter(normalized_intensity, window_length=15, polyorder=3, axis=1)
+    
+    # --- Step 2: Baseline Correction ---
+    if baseline_method == 'minimum':
+        # Method: Find the minimum value of smoothed intensity as baseline level
+        baseline_curve = np.repeat(np.min(smoothed_intensity, axis=1, keepdims=True),
+                                   smoothed_intensity.shape[1], axis=1)
+    else:
+        # Method: Smooth background under the smoothed intensity, so that a sloped
+        # background is not fitted by the amorphous peaks
+        baseline_curve = estimate_baseline(two_theta, smoothed_intensity, method=baseline_method,
+                                           lam=baseline_lam)
+    baseline_level = np.min(baseline_curve, axis=1)
+    
+    # Subtract baseline from smoothed intensity
+    baseline_corrected_intensity = smoothed_intensity - baseline_curve
+    
+    # Ensure no negative values
+    baseline_corrected_intensity = np.maximum(baseline_corrected_intensity, 0)
+    
+    # Renormalize after baseline correction
+    corrected_max = np.max(baseline_corrected_intensity, axis=1, keepdims=True)
+    baseline_corrected_intensity = np.divide(baseline_corrected_intensity, corrected_max,
+                                             out=baseline_corrected_intensity, where=corrected_max > 0)
+    
+    # --- Step 3: Assess Signal Quality ---
+    # Calculate signal-to-noise ratio
+    signal_mean = np.mean(baseline_corrected_intensity, axis=1)
+    noise_estimate = np.std(baseline_corrected_intensity - 
+                           savgol_filter(baseline_corrected_intensity, window_length=21, polyorder=3, axis=1),
+                           axis=1)
+    snr = np.divide(signal_mean, noise_estimate, out=np.zeros_like(signal_mean), where=noise_estimate > 0)
+    
+    # Check if data has any significant peaks at all
+    max_peak_height = np.max(baseline_corrected_intensity, axis=1)
+    is_mostly_amorphous = max_peak_height < 0.1  # Very low peak height suggests mostly amorphous
+    
+    return {
+        'normalized_intensity': normalized_intensity,
+        'smoothed_intensity': smoothed_intensity,
+        'baseline_level': baseline_level,
+        'baseline': baseline_curve,
+        'baseline_corrected_intensity': baseline_corrected_intensity,
+        'noise': noise_estimate,
+        'signal_to_noise': snr,
+        'low_signal_to_noise': snr < 5,
+        'is_mostly_amorphous': is_mostly_amorphous
+    }
+
+
+def _detect_peaks(two_theta, baseline_corrected_intensity, snr, min_prominence):
+    """
+    Step 5 of preprocess_xrd_spectrum: peak detection on one baseline-corrected spectrum,
+    returning the peak_data dictionary passed to the fitting functions.
+    """
+    # Adjust peak detection parameters based on signal quality
+    adjusted_min_prominence = min_prominence
+    if snr < 5:  # Low SNR
+        adjusted_min_prominence = min_prominence * 1.5  # Increase prominence threshold for noisy data
+    
+    # --- Step 5: Run Peak Detection (JUST ONCE) ---
+    # A single sensitive pass detects shoulders and overlaps, and computes prominences and
+    # widths at half maximum for every peak it keeps
+    all_peaks, properties = find_peaks(baseline_corrected_intensity,
+                                       prominence=adjusted_min_prominence,
+                                       width=10,
+                                       distance=50,
+                                       rel_height=0.5)  # For width at half maximum
+    
+    # Major peaks are the prominent, broad subset. find_peaks applies the distance filter
+    # before prominence and width, so this equals a separate pass with the stricter settings
+    is_major = (properties["prominences"] >= adjusted_min_prominence * 5) & (properties["widths"] >= 20)
+    major_peaks = all_peaks[is_major]
+    
+    # Extract peak information (index-aligned with all_peaks)
+    peak_positions = two_theta[all_peaks]
+    peak_heights = baseline_corrected_intensity[all_peaks]
+    
+    # Calculate peak widths in degrees
+    avg_point_distance = np.mean(np.diff(two_theta))
+    peak_widths_degrees = properties["widths"] * avg_point_distance
+    
+    # Create peak_data dictionary to pass to the fitting function
+    return {
+        'major_peaks': major_peaks,
+        'all_peaks': all_peaks,
+        'peak_positions': peak_positions,
+        'peak_heights': peak_heights,
+        'peak_widths': peak_widths_degrees
+    }
+
+
+def _preprocess_spectrum(two_theta, intensity, min_prominence, baseline_method='minimum', baseline_lam=100.0):
+    """
+    Uncached implementation of preprocess_xrd_spectrum.
+    """
+    conditioned = _condition_spectra(two_theta, intensity[np.newaxis], baseline_method, baseline_lam)
+    preprocessed = {key: value[0] for key, value in conditioned.items()}
+    preprocessed['peak_data'] = _detect_peaks(two_theta, preprocessed['baseline_corrected_intensity'],
+                                              preprocessed['signal_to_noise'], min_prominence)
+    return preprocessed
+
+
+def _copy_preprocessed(preprocessed):
+    """Copy the arrays of a preprocessing result so callers cannot modify the cached ones"""
+    copied = {key: value.copy() if isinstance(value, np.ndarray) else value
+              for key, value in preprocessed.items()}
+    copied['peak_data'] = {key: value.copy() for key, value in preprocessed['peak_data'].items()}
+    return copied
+
+
+def preprocess_xrd_spectrum(two_theta, intensity, min_prominence=0.008, baseline_method='minimum',
+                            baseline_lam=100.0):
+    """
+    Normalise, smooth and baseline-correct a spectrum, assess its signal quality and detect
+    peaks (Steps 1-5 of fit_xrd_spectrum_fast and fit_xrd_spectrum_detailed).
+    
+    Results are kept in an LRU cache keyed on the contents of two_theta and intensity, on
+    min_prominence and on the baseline settings, so refitting the same spectrum with
+    different peak positions or fitting thresholds skips straight to fitting.
+    
+    Parameters:
+    -----------
+    two_theta : array-like
+        Array of 2θ angles in degrees
+    intensity : array-like
+        Array of corresponding intensity values
+    min_prominence : float, default=0.008
+        Minimum prominence for peak detection
+    baseline_method : {'minimum', 'asls', 'arpls'}, default='minimum'
+        Background subtracted from the smoothed intensity. 'minimum' subtracts its lowest
+        value; 'asls' and 'arpls' subtract a smooth curve from estimate_baseline, which
+        also removes a sloped background
+    baseline_lam : float, default=100.0
+        Smoothness penalty of the 'asls' and 'arpls' baselines (see estimate_baseline)
+        
+    Returns:
+    --------
+    dict
+        'normalized_intensity', 'smoothed_intensity', 'baseline_level' (lowest value of the
+        baseline), 'baseline' (the subtracted curve), 'baseline_corrected_intensity', 'noise',
+        'signal_to_noise', 'low_signal_to_noise', 'is_mostly_amorphous' and 'peak_data'
+        (detected peak indices, positions, heights and widths). Arrays are copies and may be
+        modified by the caller
+    """
+    two_theta = np.asarray(two_theta)
+    intensity = np.asarray(intensity)
+    if baseline_method not in _BASELINE_METHODS:
+        raise ValueError(f"baseline_method must be one of {_BASELINE_METHODS}, got {baseline_method!r}")
+    key = _preprocessing_key(two_theta, intensity, min_prominence, baseline_method, baseline_lam)
+    
+    with _PREPROCESSING_CACHE_LOCK:
+        preprocessed = _PREPROCESSING_CACHE.get(key)
+        if preprocessed is not None:
+            _PREPROCESSING_CACHE.move_to_end(key)
+    
+    if preprocessed is None:
+        preprocessed = _preprocess_spectrum(two_theta, intensity, min_prominence, baseline_method, baseline_lam)
+        with _PREPROCESSING_CACHE_LOCK:
+            _PREPROCESSING_CACHE[key] = preprocessed
+            while len(_PREPROCESSING_CACHE) > _PREPROCESSING_CACHE_SIZE:
+                _PREPROCESSING_CACHE.popitem(last=False)
+    
+    return _copy_preprocessed(preprocessed)
+
+
+def resample_xrd_spectra(two_thetas, intensities, step=None):
+    """
+    Put spectra measured on different 2θ grids onto one shared grid, as rows of a 2D array.
+    
+    If every spectrum already has the same grid it is kept and the intensities are only
+    stacked, without interpolation. Otherwise the grid covers the 2θ range common to all
+    spectra and intensities are linearly interpolated onto it.
+    
+    Parameters:
+    -----------
+    two_thetas : sequence of array-like
+        2θ angles in degrees of each spectrum
+    intensities : sequence of array-like
+        Corresponding intensity values of each spectrum
+    step : float or None, optional
+        Step of the shared grid in degrees. None uses the coarsest mean step of the
+        spectra, so no spectrum is sampled more finely than it was measured
+        
+    Returns:
+    --------
+    tuple
+        (two_theta grid, 2D array of intensities with one spectrum per row)
+    """
+    two_thetas = [np.asarray(two_theta, dtype=float) for two_theta in two_thetas]
+    intensities = [np.asarray(intensity, dtype=float) for intensity in intensities]
+    if len(two_thetas) != len(intensities) or not two_thetas:
+        raise ValueError("two_thetas and intensities must be non-empty and of the same length")
+    
+    if step is None and all(np.array_equal(two_theta, two_thetas[0]) for two_theta in two_thetas[1:]):
+        return two_thetas[0], np.vstack(intensities)
+    
+    if step is None:
+        step = max(abs(np.mean(np.diff(two_theta))) for two_theta in two_thetas)
+    low = max(np.min(two_theta) for two_theta in two_thetas)
+    high = min(np.max(two_theta) for two_theta in two_thetas)
+    if high <= low:
+        raise ValueError("The spectra have no 2θ range in common")
+    grid = low + step * np.arange(int(np.floor((high - low) / step + 1e-9)) + 1)
+    
+    resampled = np.empty((len(intensities), len(grid)))
+    for row, (two_theta, intensity) in enumerate(zip(two_thetas, intensities)):
+        order = np.argsort(two_theta)
+        resampled[row] = np.interp(grid, two_theta[order], intensity[order])
+    return grid, resampled
+
+
+def preprocess_xrd_spectra(two_theta, intensities, min_prominence=0.008, baseline_method='minimum',
+                           baseline_lam=100.0):
+    """
+    Preprocess a stack of spectra on a shared 2θ grid, e.g. from resample_xrd_spectra, in
+    the same way as preprocess_xrd_spectrum.
+    
+    Normalisation, both Savitzky-Golay filters (smoothing and the noise estimate), baseline
+    correction and the signal quality checks run once on the whole array; only peak
+    detection loops over the spectra. Rows agree with preprocess_xrd_spectrum to rounding
+    error: savgol_filter fits the polynomials at the ends of all rows together, which can
+    change the last bit of the first and last window_length // 2 points. The results are
+    therefore not stored in the preprocess_xrd_spectrum cache, so fits of a spectrum never
+    depend on which other spectra it was preprocessed with.
+    
+    Parameters:
+    -----------
+    two_theta : array-like
+        Shared array of 2θ angles in degrees
+    intensities : array-like
+        2D array of intensity values, one spectrum per row
+    min_prominence : float, default=0.008
+        Minimum prominence for peak detection
+    baseline_method : {'minimum', 'asls', 'arpls'}, default='minimum'
+        Background subtracted from the smoothed intensity (see preprocess_xrd_spectrum)
+    baseline_lam : float, default=100.0
+        Smoothness penalty of the 'asls' and 'arpls' baselines
+        
+    Returns:
+    --------
+    dict
+        'two_theta', 2D arrays 'normalized_intensity', 'smoothed_intensity', 'baseline' and
+        'baseline_corrected_intensity', 1D arrays 'baseline_level', 'noise',
+        'signal_to_noise', 'low_signal_to_noise' and 'is_mostly_amorphous' with one entry
+        per spectrum, and 'peak_data', a list of the detected peaks of each spectrum
+    """
+    if baseline_method not in _BASELINE_METHODS:
+        raise ValueError(f"baseline_method must be one of {_BASELINE_METHODS}, got {baseline_method!r}")
+    two_theta = np.asarray(two_theta)
+    intensities = np.asarray(intensities)
+    if intensities.ndim != 2 or intensities.shape[1] != len(two_theta):
+        raise ValueError(f"intensities must have shape (n_spectra, {len(two_theta)}), got {intensities.shape}")
+    
+    conditioned = _condition_spectra(two_theta, intensities, baseline_method, baseline_lam)
+    peak_data = [_detect_peaks(two_theta, corrected, snr, min_prominence)
+                 for corrected, snr in zip(conditioned['baseline_corrected_intensity'],
+                                           conditioned['signal_to_noise'])]
+    
+    return {'two_theta': two_theta, **conditioned, 'peak_data': peak_data}
 
 
 def _perform_fitting_fast(two_theta, baseline_corrected_intensity, known_crys_peaks, known_amorp_peaks,
                     peak_data, height_width_threshold, with_crystalline=True, 
-                    known_peak_tolerance=1.0):
+                    known_peak_tolerance=1.0, warm_start=None, solver='curve_fit', context=None,
+                    ftol=None):
     """
     Internal helper function to perform the XRD spectrum fitting process.
     This encapsulates fitting and classification logic using pre-detected peaks.
@@ -31,6 +1579,21 @@ def _perform_fitting_fast(two_theta, baseline_corrected_intensity, known_crys_pe
         Whether to include crystalline components in the fit
     known_peak_tolerance : float, default=1.0
         Tolerance in degrees for matching detected peaks to known peak positions
+    warm_start : dict or None, default=None
+        Converged parameter triplets from an earlier fit, keyed by (kind, position), e.g. of
+        the same spectrum at lower resolution or of a neighbouring temperature. Matching
+        components start from these instead of the peak-detection guesses; bounds are
+        unchanged
+    solver : {'curve_fit', 'varpro', 'sparse'}, default='curve_fit'
+        Optimiser for the bounded fit; 'varpro' solves the amplitudes linearly and
+        'sparse' evaluates each peak only near its centre
+    context : _FittingContext or None, default=None
+        The calling driver's fitting context, whose known crystalline peaks are used
+        together with known_crys_peaks to classify components
+    ftol : float or None, default=None
+        Relative change in the sum of squares at which the bounded fit stops. None keeps
+        the solver's own tolerance (1e-6 for 'varpro', 1e-8 otherwise); a looser value
+        ends fits that start close to their optimum sooner
         
     Returns:
     --------
@@ -46,6 +1609,7 @@ def _perform_fitting_fast(two_theta, baseline_corrected_intensity, known_crys_pe
     
     # --- Set Up Initial Guesses ---
     init_guess = []
+    component_keys = []  # (kind, position) of each parameter triplet, used for warm starts
     
     # Add known crystalline peaks if in crystalline fitting mode
     if with_crystalline and known_crys_peaks:
@@ -62,11 +1626,13 @@ def _perform_fitting_fast(two_theta, baseline_corrected_intensity, known_crys_pe
                 height = peak_heights[nearby_peak_idx]
                 width = peak_widths_degrees[nearby_peak_idx] if nearby_peak_idx < len(peak_widths_degrees) else 0.5
                 init_guess.extend([height, known_pos, width])
+                component_keys.append(('crystalline', known_pos))
             else:
                 # No nearby detected peak, estimate parameters based on data at this position
                 nearby_idx = np.argmin(np.abs(two_theta - known_pos))
                 height_estimate = baseline_corrected_intensity[nearby_idx] * 0.8
                 init_guess.extend([height_estimate, known_pos, 0.5])
+                component_keys.append(('crystalline', known_pos))
     
     # Add detected peaks not near known crystalline peaks if in crystalline mode
     if with_crystalline:
@@ -93,6 +1659,7 @@ def _perform_fitting_fast(two_theta, baseline_corrected_intensity, known_crys_pe
             
             # Add parameters [amplitude, position, width]
             init_guess.extend([peak_heights[i], pos, width_estimate])
+            component_keys.append(('detected', pos))
     
     # Add amorphous background peaks
     if not known_amorp_peaks:
@@ -104,11 +1671,13 @@ def _perform_fitting_fast(two_theta, baseline_corrected_intensity, known_crys_pe
     
     for pos in known_amorp_peaks:
         init_guess.extend([mean_intensity/2, pos, 5.0])  # amplitude, position, width
+        component_keys.append(('amorphous', pos))
     
     # If no components were added at all, add a minimal set
     if len(init_guess) == 0:
         # Add a broad amorphous component
         init_guess.extend([0.5, 25, 10.0])  # amplitude, position, width
+        component_keys.append(('amorphous', 25))
         num_amorphous_peaks = 1
     
     # --- Set up boundary constraints ---
@@ -141,47 +1710,38 @@ def _perform_fitting_fast(two_theta, baseline_corrected_intensity, known_crys_pe
             
         param_index += 3
     
+    # Start from parameters converged in an earlier fit, if provided
+    if warm_start:
+        init_guess = _warm_start_guess(init_guess, component_keys, bounds_low, bounds_high, warm_start)
+    
     # --- Perform Gaussian Fitting ---
+    model = _EvaluationCounter(context.model if context is not None else multi_gaussian)
+    tolerance = {} if ftol is None else {'ftol': ftol}
+    fit_strategy = 'bounded'
     try:
-        # Define Gaussian function for fitting
-        def gaussian(x, A, x0, sigma):
-            """Gaussian function with parameters amplitude, center, and width"""
-            return A * np.exp(-((x - x0) ** 2) / (2 * sigma ** 2))
-        
-        def multi_gaussian(x, *params):
-            """Fit multiple Gaussian peaks simultaneously"""
-            num_peaks = len(params) // 3
-            y_fit = np.zeros_like(x)
-            for i in range(num_peaks):
-                amp = params[3*i]
-                center = params[3*i+1]
-                width = params[3*i+2]
-                y_fit += gaussian(x, amp, center, width)
-            return y_fit
-        
         # Perform the fit
-        popt, pcov = curve_fit(multi_gaussian, two_theta, baseline_corrected_intensity, 
-                              p0=init_guess, bounds=(bounds_low, bounds_high),
-                              maxfev=20000)  # Increase maximum function evaluations
+        if solver == 'varpro':
+            popt = _fit_variable_projection(model, two_theta, baseline_corrected_intensity,
+                                            init_guess, bounds_low, bounds_high, max_nfev=20000, **tolerance)
+        elif solver == 'sparse':
+            popt = _fit_sparse_support(model, two_theta, baseline_corrected_intensity,
+                                       init_guess, bounds_low, bounds_high, max_nfev=20000, **tolerance)
+        else:
+            popt, pcov = curve_fit(model, two_theta, baseline_corrected_intensity, 
+                                  jac=model.jacobian, p0=init_guess, bounds=(bounds_low, bounds_high),
+                                  maxfev=20000, **tolerance)  # Increase maximum function evaluations
     except Exception as e:
-        print(f"Fitting error: {str(e)}")
-        print("Falling back to initial guess parameters")
+        logger.warning(f"Fitting error: {str(e).rstrip('.')}. Falling back to initial guess parameters")
+        fit_strategy = 'initial_guess'
         popt = np.array(init_guess)
     
     # --- Separate Components Based on Height-to-Width Ratio ---
     crystalline_params = []
     amorphous_params = []
     
-    # Start with ALL known crystalline peak positions from the global reference
-    all_known_crys_peaks = []
-    if hasattr(fit_xrd_spectrum_fast, '_all_known_crys_peaks') and fit_xrd_spectrum_fast._all_known_crys_peaks:
-        all_known_crys_peaks = fit_xrd_spectrum_fast._all_known_crys_peaks.copy()
-    
-    # Add any specifically passed peaks that aren't already included
-    if known_crys_peaks:
-        for pos in known_crys_peaks:
-            if pos not in all_known_crys_peaks:
-                all_known_crys_peaks.append(pos)
+    # Start with ALL known crystalline peak positions from the driver's context and
+    # add any specifically passed peaks that aren't already included
+    all_known_crys_peaks = (context or _FittingContext()).crystalline_reference(known_crys_peaks)
                 
     # Process fitted parameters
     for i in range(0, len(popt), 3):
@@ -208,28 +1768,24 @@ def _perform_fitting_fast(two_theta, baseline_corrected_intensity, known_crys_pe
         if with_crystalline and is_known_crys_peak and hw_ratio > height_width_threshold and width < 1.0:
             # This is likely a crystalline peak
             # Print information why this is classified as a crystalline peak
-            print(f"Classifying peak at {center:.2f}° as crystalline: "
-                f"height/width={hw_ratio:.2f}, width={width:.2f}°"
-                f"{' (known position)' if is_known_crys_peak else ''}")
+            logger.debug("Classifying peak at %.2f° as crystalline: height/width=%.2f, width=%.2f°%s",
+                         center, hw_ratio, width, ' (known position)' if is_known_crys_peak else '')
             crystalline_params.extend([amp, center, width])
         else:
             # This is likely an amorphous peak
             amorphous_params.extend([amp, center, width])
     
-    # --- Calculate Individual Components ---
-    crystalline_fit = np.zeros_like(two_theta)
-    if crystalline_params:
-        crystalline_fit = multi_gaussian(two_theta, *crystalline_params)
-        
-    amorphous_fit = np.zeros_like(two_theta)
-    if amorphous_params:
-        amorphous_fit = multi_gaussian(two_theta, *amorphous_params)
-        
-    total_fit = crystalline_fit + amorphous_fit
+    # --- Calculate Fitted Profile ---
+    # The crystalline and amorphous curves are only evaluated if a caller asks for them
+    total_fit = _component_curve(two_theta, crystalline_params + amorphous_params)
     
     # --- Calculate Crystallinity Index ---
-    area_crystalline = np.trapz(crystalline_fit, two_theta)
-    area_amorphous = np.trapz(amorphous_fit, two_theta)
+    # Closed-form peak areas over the measured 2θ window
+    area_window = (np.min(two_theta), np.max(two_theta))
+    crystalline_areas = gaussian_areas(crystalline_params, *area_window)
+    amorphous_areas = gaussian_areas(amorphous_params, *area_window)
+    area_crystalline = np.sum(crystalline_areas)
+    area_amorphous = np.sum(amorphous_areas)
     area_total = area_crystalline + area_amorphous
     
     if area_total > 0:
@@ -254,11 +1810,7 @@ def _perform_fitting_fast(two_theta, baseline_corrected_intensity, known_crys_pe
             'position': crystalline_params[i+1], 
             'width': crystalline_params[i+2],
             'hw_ratio': crystalline_params[i] / crystalline_params[i+2],
-            'area': np.trapz(gaussian(two_theta, 
-                                     crystalline_params[i], 
-                                     crystalline_params[i+1], 
-                                     crystalline_params[i+2]), 
-                            two_theta)
+            'area': crystalline_areas[i // 3]
         })
     
     amorphous_peak_data = []
@@ -270,15 +1822,11 @@ def _perform_fitting_fast(two_theta, baseline_corrected_intensity, known_crys_pe
             'position': amorphous_params[i+1], 
             'width': amorphous_params[i+2],
             'hw_ratio': amorphous_params[i] / amorphous_params[i+2],
-            'area': np.trapz(gaussian(two_theta, 
-                                     amorphous_params[i], 
-                                     amorphous_params[i+1], 
-                                     amorphous_params[i+2]), 
-                            two_theta)
+            'area': amorphous_areas[i // 3]
         })
     
     # Return fitting results
-    results = {
+    results = _FitResults({
         'major_peaks': major_peaks,
         'all_peaks': all_peaks,
         'peak_positions': peak_positions,
@@ -287,8 +1835,6 @@ def _perform_fitting_fast(two_theta, baseline_corrected_intensity, known_crys_pe
         'optimized_parameters': popt,
         'crystalline_params': crystalline_params,
         'amorphous_params': amorphous_params,
-        'crystalline_fit': crystalline_fit,
-        'amorphous_fit': amorphous_fit,
         'total_fit': total_fit,
         'crystallinity': crystallinity,
         'r_squared': r_squared,
@@ -297,15 +1843,28 @@ def _perform_fitting_fast(two_theta, baseline_corrected_intensity, known_crys_pe
         'crystalline_peak_data': crystalline_peak_data,
         'amorphous_peak_data': amorphous_peak_data,
         'gaussian_function': gaussian,
-        'multi_gaussian_function': multi_gaussian
-    }
+        'multi_gaussian_function': multi_gaussian,
+        'fit_known_crys_peaks': list(known_crys_peaks),
+        'with_crystalline': with_crystalline,
+        'fitted_components': (dict(zip(component_keys, np.reshape(popt, (-1, 3))))
+                              if len(popt) == 3 * len(component_keys) else {}),
+        'nfev': model.nfev,
+        'njev': model.njev,
+        'fit_strategy': fit_strategy
+    }, lazy={
+        'crystalline_fit': (_component_curve, (two_theta, crystalline_params)),
+        'amorphous_fit': (_component_curve, (two_theta, amorphous_params)),
+    })
     
     return results
 
 def fit_xrd_spectrum_fast(two_theta, intensity, known_crys_peaks=None, known_amorp_peaks=None, 
                      height_width_threshold=0.3, min_prominence=0.008, 
                      min_r_squared=0.998, amorphous_r_squared=0.80, visualise=True,
-                     max_combination_size=4):
+                     max_combination_size=4, n_workers=None, selection='exhaustive',
+                     warm_start=False, solver='curve_fit', backend='numpy', decimation=1,
+                     baseline_method='minimum', baseline_lam=100.0, time_budget_s=None,
+                     max_total_nfev=None, metrics=None):
     """
     Efficient XRD analysis function using a build-up strategy:
     1. Start with amorphous-only fit
@@ -334,131 +1893,150 @@ def fit_xrd_spectrum_fast(two_theta, intensity, known_crys_peaks=None, known_amo
         Whether to generate visualization plots
     max_combination_size : int, default=3
         Maximum number of peaks to include in combinations testing
+    n_workers : int or None, default=None
+        Number of worker processes for the Phase 2B combination search. None or 1 fits
+        the combinations serially; results are identical either way
+    selection : {'exhaustive', 'stepwise', 'ranked'}, default='exhaustive'
+        Phase 2B subset-selection strategy. 'exhaustive' fits every combination up to
+        max_combination_size and is the only exact choice. 'stepwise' and 'ranked' are
+        opt-in heuristics that prune the search using the Phase 2A quality scores and R²
+        values, and can select a different combination and crystallinity: on the bundled
+        spectra they missed the exhaustive choice on 3-5 of 27 files per engine while
+        skipping only about a quarter of the fits (see _search_peak_combinations). The
+        number of fits run and skipped is reported in results['combination_search']
+    warm_start : bool or dict, default=False
+        False starts every fit from the peak-detection guesses, as for the published
+        results. True is an opt-in that starts the combination and final combined fits from
+        the amorphous parameters converged in Phase 1 and the peak parameters converged in
+        Phase 2A. It is not a speed-up: on the bundled spectra these fits did not need fewer
+        evaluations and changed the selected model on 10 of 27 files
+        (xrd_benchmarks.benchmark_warm_start compares the two per file). A dict of parameter
+        triplets keyed by (kind, position), e.g. results['fitted_components'] of the same
+        sample at a neighbouring temperature, instead seeds the amorphous-only fit of Phase 1
+        and, with its crystalline entries, the single-peak fits of Phase 2A; the combination
+        and combined fits then start from the peak-detection guesses. Model evaluations per
+        phase are reported in results['phase_nfev'] either way
+    solver : {'curve_fit', 'varpro', 'sparse'}, default='curve_fit'
+        Optimiser for the bounded Gaussian fits. 'varpro' uses variable projection:
+        amplitudes are solved by non-negative least squares and only peak centres and
+        widths are optimised (see _fit_variable_projection). 'sparse' evaluates each
+        peak only within ±8 widths of its centre and gives least_squares a sparse
+        Jacobian (see _fit_sparse_support), for long or finely sampled scans. Results
+        use the same keys
+    backend : {'numpy', 'numba'}, default='numpy'
+        Evaluation backend of the multi-Gaussian model and its Jacobian. 'numba' uses
+        compiled kernels and falls back to NumPy if numba is not installed; fitted
+        values agree to rounding error
+    decimation : int, default=1
+        Multi-resolution mode. With decimation > 1 Phases 1-3 fit every decimation-th
+        point of the preprocessed spectrum (preprocessing and peak detection still use
+        every point), and only the selected model is refitted at full resolution,
+        starting from its decimated parameters. results['multi_resolution'] reports the
+        decimated and full-resolution crystallinity of that model, and results['all_models']
+        hold the decimated fits. Use compare_decimation_factors to choose a safe factor
+    baseline_method : {'minimum', 'asls', 'arpls'}, default='minimum'
+        Baseline correction of Step 2. 'minimum' subtracts the lowest smoothed intensity;
+        'asls' and 'arpls' subtract a smooth background curve (see estimate_baseline),
+        so a sloped background is not absorbed by the amorphous peaks. The subtracted
+        curve is returned in results['baseline']
+    baseline_lam : float, default=100.0
+        Smoothness penalty of the 'asls' and 'arpls' baselines
+    time_budget_s : float or None, default=None
+        Wall-time budget of the fitting phases in seconds. Once it is spent, the remaining
+        Phase 2A and 2B fits are skipped and Phase 3 combines the best peaks found so far
+        (see _FitBudget); results['budget_limited'] is then True and results['budget']
+        reports the time, evaluations and skipped peaks. None for no limit
+    max_total_nfev : int or None, default=None
+        Budget of model evaluations over all fits, applied in the same way. Both budgets
+        are checked between fits, so the fit running when a budget runs out is finished
+    metrics : FitMetrics or None, default=None
+        Collector for the wall time, model evaluations and success of each step of this
+        call (see FitMetrics.to_frame). None does not collect them
         
     Returns:
-    --------
-    dict
-        Dictionary containing peak information, fitted parameters, and crystallinity
-    """
-    # Set default values if None is provided
-    if known_crys_peaks is None:
-        known_crys_peaks = []  
-        
-    if known_amorp_peaks is None:
-        known_amorp_peaks = []  # Default amorphous peak positions
-    
-    # Store all known crystalline peaks in a class variable for reference
-    # This allows _perform_fitting to access all known peaks even when testing individual peaks
-    fit_xrd_spectrum_fast._all_known_crys_peaks = known_crys_peaks.copy() if known_crys_peaks else []
-    
-    # --- Step 1: Data Preprocessing ---
-    # Normalize intensity
-    normalized_intensity = intensity / np.max(intensity)
-    
-    # Smooth the normalized data
-    smoothed_intensity = savgol_filter(normalized_intensity, window_length=15, polyorder=3)
-    
-    # --- Step 2: Baseline Correction ---
-    # Method: Find the minimum value of smoothed intensity as baseline level
-    baseline_level = np.min(smoothed_intensity)
-    
-    # Subtract baseline level from smoothed intensity
-    baseline_corrected_intensity = smoothed_intensity - baseline_level
-    
-    # Ensure no negative values
-    baseline_corrected_intensity = np.maximum(baseline_corrected_intensity, 0)
-    
-    # Renormalize after baseline correction
-    if np.max(baseline_corrected_intensity) > 0:
-        baseline_corrected_intensity = baseline_corrected_intensity / np.max(baseline_corrected_intensity)
-    
-    # --- Step 3: Assess Signal Quality ---
-    # Calculate signal-to-noise ratio
-    signal_mean = np.mean(baseline_corrected_intensity)
-    noise_estimate = np.std(baseline_corrected_intensity - 
-                           savgol_filter(baseline_corrected_intensity, window_length=21, polyorder=3))
-    snr = signal_mean / noise_estimate if noise_estimate > 0 else 0
-    
-    # Adjust peak detection parameters based on signal quality
-    adjusted_min_prominence = min_prominence
-    if snr < 5:  # Low SNR
-        print(f"Low signal-to-noise ratio detected ({snr:.2f}). Adjusting detection parameters.")
-        adjusted_min_prominence = min_prominence * 1.5  # Increase prominence threshold for noisy data
-    
-    # Check if data has any significant peaks at all
-    max_peak_height = np.max(baseline_corrected_intensity)
-    is_mostly_amorphous = max_peak_height < 0.1  # Very low peak height suggests mostly amorphous
+    --------
+    dict
+        Dictionary containing peak information, fitted parameters, and crystallinity
+    """
+    if selection not in _COMBINATION_SELECTIONS:
+        raise ValueError(f"selection must be one of {_COMBINATION_SELECTIONS}, got {selection!r}")
+    if solver not in _FIT_SOLVERS:
+        raise ValueError(f"solver must be one of {_FIT_SOLVERS}, got {solver!r}")
+    if backend not in _MODEL_BACKENDS:
+        raise ValueError(f"backend must be one of {_MODEL_BACKENDS}, got {backend!r}")
+    if int(decimation) != decimation or decimation < 1:
+        raise ValueError(f"decimation must be a positive integer, got {decimation!r}")
     
-    if is_mostly_amorphous:
-        print("Sample appears to be predominantly amorphous.")
+    if time_budget_s is not None and not time_budget_s > 0:
+        raise ValueError(f"time_budget_s must be positive, got {time_budget_s!r}")
+    if max_total_nfev is not None and not max_total_nfev > 0:
+        raise ValueError(f"max_total_nfev must be positive, got {max_total_nfev!r}")
     
-    # --- Step 4: Define Gaussian Functions ---
-    def gaussian(x, A, x0, sigma):
-        """Gaussian function with parameters amplitude, center, and width"""
-        return A * np.exp(-((x - x0) ** 2) / (2 * sigma ** 2))
+    # Set default values if None is provided
+    if known_crys_peaks is None:
+        known_crys_peaks = []  
+        
+    if known_amorp_peaks is None:
+        known_amorp_peaks = []  # Default amorphous peak positions
     
-    def multi_gaussian(x, *params):
-        """Fit multiple Gaussian peaks simultaneously"""
-        num_peaks = len(params) // 3
-        y_fit = np.zeros_like(x)
-        for i in range(num_peaks):
-            amp = params[3*i]
-            center = params[3*i+1]
-            width = params[3*i+2]
-            y_fit += gaussian(x, amp, center, width)
-        return y_fit
+    # Keep all known crystalline peaks in the fitting context passed to every fit
+    # This allows _perform_fitting to access all known peaks even when testing individual peaks
+    context = _FittingContext(known_crys_peaks, backend=backend)
     
-    # --- Step 5: Run Peak Detection (JUST ONCE) ---
-    # First pass with less strict parameters to find major peaks
-    major_peaks, _ = find_peaks(baseline_corrected_intensity, 
-                               prominence=adjusted_min_prominence * 5,
-                               width=20,
-                               distance=50)
-    
-    # Second pass with more sensitive settings to detect shoulders and overlaps
-    all_peaks, _ = find_peaks(baseline_corrected_intensity,
-                             prominence=adjusted_min_prominence,  
-                             width=10,         
-                             distance=50)      
-    
-    # Use peak properties to get a better estimate of peak widths
-    _, properties = find_peaks(baseline_corrected_intensity, 
-                              prominence=adjusted_min_prominence,
-                              width=10,
-                              distance=20,
-                              rel_height=0.5)  # For width at half maximum
-    
-    # Extract peak information
-    peak_positions = two_theta[all_peaks] if len(all_peaks) > 0 else np.array([])
-    peak_heights = baseline_corrected_intensity[all_peaks] if len(all_peaks) > 0 else np.array([])
+    # Wall time, model evaluations and success of each step
+    collector = metrics if metrics is not None else FitMetrics()
+    spectrum_id = collector.begin_spectrum()
     
-    # Calculate peak widths in degrees
-    if len(properties["widths"]) > 0:
-        peak_widths_points = properties["widths"]
-        peak_distances = np.diff(two_theta)
-        avg_point_distance = np.mean(peak_distances)
-        peak_widths_degrees = peak_widths_points * avg_point_distance
-    else:
-        peak_widths_degrees = np.array([])
+    # --- Steps 1-5: Preprocessing, signal quality and peak detection (memoised per spectrum) ---
+    step_start = time.perf_counter()
+    preprocessed = preprocess_xrd_spectrum(two_theta, intensity, min_prominence, baseline_method, baseline_lam)
+    collector.record(spectrum_id, 'preprocessing', step_start)
+    normalized_intensity = preprocessed['normalized_intensity']
+    smoothed_intensity = preprocessed['smoothed_intensity']
+    baseline_level = preprocessed['baseline_level']
+    baseline_curve = preprocessed['baseline']
+    baseline_corrected_intensity = preprocessed['baseline_corrected_intensity']
+    snr = preprocessed['signal_to_noise']
+    is_mostly_amorphous = preprocessed['is_mostly_amorphous']
+    peak_data = preprocessed['peak_data']
+    major_peaks = peak_data['major_peaks']
+    all_peaks = peak_data['all_peaks']
     
-    # Create peak_data dictionary to pass to the fitting function
-    peak_data = {
-        'major_peaks': major_peaks,
-        'all_peaks': all_peaks,
-        'peak_positions': peak_positions,
-        'peak_heights': peak_heights,
-        'peak_widths': peak_widths_degrees
-    }
+    if preprocessed['low_signal_to_noise']:
+        logger.info(f"Low signal-to-noise ratio detected ({snr:.2f}). Adjusting detection parameters.")
+    if is_mostly_amorphous:
+        logger.info("Sample appears to be predominantly amorphous.")
     
     # --- Step 6: Build-Up Fitting Strategy ---
     phase_success = {"amorphous": False, "individual_peaks": False, "combinations": False, "combined": False}
     fitting_results = {}
     
+    # Converged parameters reused by later phases, and model evaluations spent in each phase
+    seed = dict(warm_start) if isinstance(warm_start, dict) else None
+    param_cache = {} if warm_start and seed is None else None
+    nfev = {"amorphous": 0, "individual_peaks": 0, "combinations": 0, "combined": 0}
+    budget = _FitBudget(time_budget_s, max_total_nfev, nfev)
+    
+    # Single-peak fits only take the seeded peaks: the amorphous parameters of an
+    # amorphous-only fit are a poor start once a crystalline peak is added
+    crystalline_seed = {key: params for key, params in seed.items() if key[0] == 'crystalline'} if seed else None
+    
+    # Multi-resolution mode: Phases 1-3 work on every decimation-th point
+    full_two_theta, full_intensity = two_theta, baseline_corrected_intensity
+    if decimation > 1:
+        two_theta = two_theta[::decimation]
+        baseline_corrected_intensity = baseline_corrected_intensity[::decimation]
+        logger.info(f"\nMulti-resolution mode: fitting phases use {len(two_theta)} of {len(full_two_theta)} points")
+    
     # PHASE 1: Start with amorphous-only fit
-    print("\nPhase 1: Performing amorphous-only fit...")
+    logger.info("\nPhase 1: Performing amorphous-only fit...")
+    step_start = time.perf_counter()
     amorphous_results = _perform_fitting_fast(two_theta, baseline_corrected_intensity,
                                        [], known_amorp_peaks, peak_data,
-                                       height_width_threshold, with_crystalline=False)
+                                       height_width_threshold, with_crystalline=False,
+                                       solver=solver, warm_start=seed, context=context)
+    nfev["amorphous"] += amorphous_results['nfev']
+    _cache_fitted_components(param_cache, amorphous_results, 'amorphous')
     
     # Store amorphous-only results
     fitting_results["amorphous"] = {
@@ -468,7 +2046,7 @@ def fit_xrd_spectrum_fast(two_theta, intensity, known_crys_peaks=None, known_amo
     
     # Check if amorphous fit is excellent (exceeds normal threshold)
     if amorphous_results['r_squared'] >= min_r_squared:
-        print(f"Phase 1: EXCELLENT - Amorphous-only fit with R² = {amorphous_results['r_squared']:.4f}")
+        logger.info(f"Phase 1: EXCELLENT - Amorphous-only fit with R² = {amorphous_results['r_squared']:.4f}")
         phase_success["amorphous"] = True
         best_fit = amorphous_results
         best_fit_name = "Amorphous Only"
@@ -476,20 +2054,23 @@ def fit_xrd_spectrum_fast(two_theta, intensity, known_crys_peaks=None, known_amo
         # Check if amorphous fit is at least acceptable
         amorphous_acceptable = amorphous_results['r_squared'] >= amorphous_r_squared
         if amorphous_acceptable:
-            print(f"Phase 1: ACCEPTABLE - Amorphous-only fit with R² = {amorphous_results['r_squared']:.4f}")
+            logger.info(f"Phase 1: ACCEPTABLE - Amorphous-only fit with R² = {amorphous_results['r_squared']:.4f}")
             phase_success["amorphous"] = True
         else:
-            print(f"Phase 1: INSUFFICIENT - Amorphous-only fit with R² = {amorphous_results['r_squared']:.4f}")
+            logger.info(f"Phase 1: INSUFFICIENT - Amorphous-only fit with R² = {amorphous_results['r_squared']:.4f}")
+    collector.record(spectrum_id, 'Phase 1', step_start, nfev["amorphous"], phase_success["amorphous"])
     
     # PHASE 2: Test individual crystalline peaks and combinations if we have any
     successful_peaks = []
     peak_metrics = {}
+    single_peak_r2 = {}
     best_individual_r2 = 0
     best_individual_results = None
     best_individual_peak = None
     
     # For storing combination results
     combination_results = {}
+    combination_search = {}
     best_combination_r2 = 0
     best_combination = None
     best_combination_results = None
@@ -613,15 +2194,22 @@ def fit_xrd_spectrum_fast(two_theta, intensity, known_crys_peaks=None, known_amo
             }
             
         # PHASE 2A: Test individual peaks first
-        print("\nPhase 2A: Testing each crystalline peak individually...")
+        logger.info("\nPhase 2A: Testing each crystalline peak individually...")
+        step_start = time.perf_counter()
         for peak_pos in known_crys_peaks:
+            if budget.check("Phase 2A"):
+                budget.skipped_peaks.append(peak_pos)
+                continue
             try:
-                print(f"  Testing peak at {peak_pos}°...")
+                logger.debug("  Testing peak at %s°...", peak_pos)
                 
                 # Test this individual peak
                 single_peak_results = _perform_fitting_fast(two_theta, baseline_corrected_intensity,
                                                    [peak_pos], known_amorp_peaks, peak_data,
-                                                   height_width_threshold, with_crystalline=True)
+                                                   height_width_threshold, with_crystalline=True,
+                                                   solver=solver, warm_start=crystalline_seed, context=context)
+                nfev["individual_peaks"] += single_peak_results['nfev']
+                _cache_fitted_components(param_cache, single_peak_results, 'crystalline')
                 
                 # Calculate comprehensive metrics around this peak
                 metrics = calculate_peak_metrics(
@@ -635,6 +2223,8 @@ def fit_xrd_spectrum_fast(two_theta, intensity, known_crys_peaks=None, known_amo
                 
                 # Store metrics for this peak
                 peak_metrics[peak_pos] = metrics
+                if single_peak_results['crystallinity'] > 0:
+                    single_peak_r2[peak_pos] = single_peak_results['r_squared']
                 
                 # Check if this peak provides any crystallinity
                 has_crystallinity = single_peak_results['crystallinity'] > 0
@@ -658,26 +2248,27 @@ def fit_xrd_spectrum_fast(two_theta, intensity, known_crys_peaks=None, known_amo
                     if quality_score > 0.3:
                         if single_peak_results['r_squared'] >= min_r_squared:
                             successful_peaks.append(peak_pos)
-                            print(f"  Peak at {peak_pos}°: SUCCESSFUL - Quality score: {quality_score:.3f}, "
-                                  f"SNR: {snr:.2f}, Correlation: {correlation:.3f}, "
-                                  f"Overall R² = {single_peak_results['r_squared']:.4f}")
+                            logger.info(f"  Peak at {peak_pos}°: SUCCESSFUL - Quality score: {quality_score:.3f}, "
+                                        f"SNR: {snr:.2f}, Correlation: {correlation:.3f}, "
+                                        f"Overall R² = {single_peak_results['r_squared']:.4f}")
                         else:
-                            print(f"  Peak at {peak_pos}°: DETECTED with good quality score ({quality_score:.3f}) but "
-                                  f"overall R² = {single_peak_results['r_squared']:.4f} < {min_r_squared:.4f}")
+                            logger.info(f"  Peak at {peak_pos}°: DETECTED with good quality score ({quality_score:.3f}) but "
+                                        f"overall R² = {single_peak_results['r_squared']:.4f} < {min_r_squared:.4f}")
                             # Include peak anyway if quality is substantially good
                             if quality_score > 0.5:
                                 successful_peaks.append(peak_pos)
-                                print(f"    - Adding anyway due to high quality score")
+                                logger.info(f"    - Adding anyway due to high quality score")
                     else:
-                        print(f"  Peak at {peak_pos}°: DETECTED but low quality score: {quality_score:.3f}")
+                        logger.info(f"  Peak at {peak_pos}°: DETECTED but low quality score: {quality_score:.3f}")
                         # Print breakdown of what factors contributed to the low score
-                        print(f"    - SNR: {snr:.2f}, Correlation: {correlation:.3f}, "
-                              f"RMSE improvement: {rmse_improvement:.5f}")
+                        logger.debug("    - SNR: %.2f, Correlation: %.3f, RMSE improvement: %.5f",
+                                     snr, correlation, rmse_improvement)
                 else:
-                    print(f"  Peak at {peak_pos}°: NOT DETECTED as crystalline")
+                    logger.info(f"  Peak at {peak_pos}°: NOT DETECTED as crystalline")
                     
             except Exception as e:
-                print(f"  Peak at {peak_pos}°: ERROR - {str(e)}")
+                logger.warning(f"  Peak at {peak_pos}°: ERROR - {str(e)}")
+        collector.record(spectrum_id, 'Phase 2A', step_start, nfev["individual_peaks"], bool(successful_peaks))
         
         # Store best individual peak result if we found one
         if best_individual_results is not None:
@@ -690,9 +2281,8 @@ def fit_xrd_spectrum_fast(two_theta, intensity, known_crys_peaks=None, known_amo
             
         # PHASE 2B: Test combinations of peaks if we have multiple peaks
         if len(known_crys_peaks) > 1:
-            import itertools
-            
-            print("\nPhase 2B: Testing combinations of crystalline peaks...")
+            logger.info("\nPhase 2B: Testing combinations of crystalline peaks...")
+            step_start = time.perf_counter()
             
             # Determine the maximum size for combinations based on the number of peaks available
             # and the user-specified maximum
@@ -702,55 +2292,59 @@ def fit_xrd_spectrum_fast(two_theta, intensity, known_crys_peaks=None, known_amo
             total_combinations = sum(len(list(itertools.combinations(known_crys_peaks, size))) 
                                    for size in range(2, actual_max_size + 1))
             
-            print(f"  Testing {total_combinations} possible peak combinations (sizes 2-{actual_max_size})...")
+            logger.info(f"  Testing {total_combinations} possible peak combinations (sizes 2-{actual_max_size})...")
             
             combination_count = 0
             promising_combinations = []
             
-            # Test combinations of different sizes
-            for combination_size in range(2, actual_max_size + 1):
-                for peak_combination in itertools.combinations(known_crys_peaks, combination_size):
-                    combination_count += 1
-                    peak_combination_list = list(peak_combination)
-                    peak_positions_str = ", ".join(f"{pos}°" for pos in peak_combination)
+            if selection != 'exhaustive':
+                logger.info(f"  Using '{selection}' subset selection instead of testing every combination; "
+                            f"it may miss the best combination")
+            if n_workers is not None and n_workers > 1:
+                logger.info(f"  Fitting combinations in parallel with {n_workers} worker processes")
+            
+            # Test combinations of different sizes (results arrive in a deterministic order)
+            for peak_combination_list, comb_results, error in _search_peak_combinations(
+                    selection, 'fast', two_theta, baseline_corrected_intensity, known_crys_peaks,
+                    known_amorp_peaks, peak_data, height_width_threshold, actual_max_size,
+                    peak_metrics, single_peak_r2, amorphous_results['r_squared'], combination_search,
+                    n_workers=n_workers, fit_options={'solver': solver, 'warm_start': param_cache},
+                    context=context, budget=budget):
+                combination_count += 1
+                peak_positions_str = ", ".join(f"{pos}°" for pos in peak_combination_list)
+                
+                # Show progress for larger sets
+                if combination_count % 5 == 0 or combination_count == total_combinations:
+                    logger.debug("  Progress: %d/%d combinations tested", combination_count, total_combinations)
+                
+                if error is not None:
+                    logger.warning(f"  Error testing combination {peak_positions_str}: {error}")
+                    continue
+                nfev["combinations"] += comb_results['nfev']
+                
+                # Store a summary for this combination; only the best one keeps its full results
+                combination_key = "-".join(str(pos) for pos in peak_combination_list)
+                combination_results[combination_key] = {
+                    "peaks": peak_combination_list,
+                    "r_squared": comb_results['r_squared'],
+                    "crystallinity": comb_results['crystallinity'],
+                    "model": FitSummary.from_results(comb_results)
+                }
+                
+                # Check if this combination has crystallinity
+                has_crystallinity = comb_results['crystallinity'] > 0
+                
+                # Check if this is the best combination so far
+                if has_crystallinity and comb_results['r_squared'] > best_combination_r2:
+                    best_combination_r2 = comb_results['r_squared']
+                    best_combination = peak_combination_list
+                    best_combination_results = comb_results
                     
-                    try:
-                        # Show progress for larger sets
-                        if combination_count % 5 == 0 or combination_count == total_combinations:
-                            print(f"  Progress: {combination_count}/{total_combinations} combinations tested")
-                        
-                        # Test this specific combination of peaks
-                        comb_results = _perform_fitting_fast(two_theta, baseline_corrected_intensity,
-                                                     peak_combination_list, known_amorp_peaks, peak_data,
-                                                     height_width_threshold, with_crystalline=True)
-                        
-                        # Store results for this combination
-                        combination_key = "-".join(str(pos) for pos in peak_combination)
-                        combination_results[combination_key] = {
-                            "peaks": peak_combination_list,
-                            "r_squared": comb_results['r_squared'],
-                            "crystallinity": comb_results['crystallinity'],
-                            "model": comb_results
-                        }
-                        
-                        # Check if this combination has crystallinity
-                        has_crystallinity = comb_results['crystallinity'] > 0
-                        
-                        # Check if this is the best combination so far
-                        if has_crystallinity and comb_results['r_squared'] > best_combination_r2:
-                            best_combination_r2 = comb_results['r_squared']
-                            best_combination = peak_combination_list
-                            best_combination_results = comb_results
-                            
-                            # If it's also better than the min_r_squared threshold, mark it as promising
-                            if comb_results['r_squared'] >= min_r_squared:
-                                promising_combinations.append(peak_combination_list)
-                                print(f"  Found excellent combination: {peak_positions_str} "
-                                      f"with R² = {comb_results['r_squared']:.4f}, "
-                                      f"Crystallinity = {comb_results['crystallinity']:.2f}%")
-                        
-                    except Exception as e:
-                        print(f"  Error testing combination {peak_positions_str}: {str(e)}")
+                    # If it's also better than the min_r_squared threshold, mark it as promising
+                    if comb_results['r_squared'] >= min_r_squared:
+                        promising_combinations.append(peak_combination_list)
+                        logger.debug("  Found excellent combination: %s with R² = %.4f, Crystallinity = %.2f%%",
+                                     peak_positions_str, comb_results['r_squared'], comb_results['crystallinity'])
             
             # Store best combination result if we found one
             if best_combination_results is not None:
@@ -765,13 +2359,18 @@ def fit_xrd_spectrum_fast(two_theta, intensity, known_crys_peaks=None, known_amo
                 # use it as our successful peaks set
                 if best_combination_r2 >= min_r_squared and (best_combination_r2 > best_individual_r2 or not successful_peaks):
                     successful_peaks = best_combination
-                    print(f"\n  Best peak combination {successful_peaks} with R² = {best_combination_r2:.4f} "
-                          f"selected for final model")
+                    logger.info(f"\n  Best peak combination {successful_peaks} with R² = {best_combination_r2:.4f} "
+                                f"selected for final model")
                     phase_success["combinations"] = True
             
             # Print summary of combinations tested
-            print(f"  Completed testing {total_combinations} peak combinations")
-            print(f"  Best combination: {best_combination} with R² = {best_combination_r2:.4f}")
+            skipped_by = f"'{selection}' selection"
+            if combination_search['stopped_by_budget']:
+                skipped_by += " and the budget"
+            logger.info(f"  Completed testing {combination_search['fits_run']} of {total_combinations} peak combinations "
+                        f"({combination_search['fits_skipped']} skipped by {skipped_by})")
+            logger.info(f"  Best combination: {best_combination} with R² = {best_combination_r2:.4f}")
+            collector.record(spectrum_id, 'Phase 2B', step_start, nfev["combinations"], phase_success["combinations"])
         
         # Fallback logic - if no peaks or combinations met our threshold but we have some promising ones
         if not successful_peaks:
@@ -779,15 +2378,15 @@ def fit_xrd_spectrum_fast(two_theta, intensity, known_crys_peaks=None, known_amo
             if best_combination_r2 > best_individual_r2 and best_combination is not None:
                 local_improvement = best_combination_r2 - amorphous_results['r_squared']
                 if local_improvement > 0.05:  # Modest improvement threshold
-                    print(f"\n  No individual peaks met threshold, but best combination will be included")
+                    logger.info(f"\n  No individual peaks met threshold, but best combination will be included")
                     successful_peaks = best_combination
                     phase_success["combinations"] = True
             # Otherwise fall back to best individual peak if it exists
             elif best_individual_peak is not None:
                 local_improvement = peak_metrics.get(best_individual_peak, {}).get('local_r2_improvement', 0)
                 if local_improvement > 0.05:  # Modest local improvement
-                    print(f"\n  No peaks met overall R² threshold, but best peak at {best_individual_peak}° "
-                          f"with local R² improvement of +{local_improvement:.4f} will be included")
+                    logger.info(f"\n  No peaks met overall R² threshold, but best peak at {best_individual_peak}° "
+                                f"with local R² improvement of +{local_improvement:.4f} will be included")
                     successful_peaks = [best_individual_peak]
                     phase_success["individual_peaks"] = True
         
@@ -797,19 +2396,22 @@ def fit_xrd_spectrum_fast(two_theta, intensity, known_crys_peaks=None, known_amo
             
         # Overall Phase 2 result
         if phase_success["individual_peaks"] or phase_success["combinations"]:
-            print(f"Phase 2: SUCCESSFUL - {len(successful_peaks)} crystalline peaks identified for final model")
+            logger.info(f"Phase 2: SUCCESSFUL - {len(successful_peaks)} crystalline peaks identified for final model")
         else:
-            print("Phase 2: FAILED - No significant crystalline peaks or combinations identified")
+            logger.info("Phase 2: FAILED - No significant crystalline peaks or combinations identified")
     else:
-        print("\nPhase 2: SKIPPED - No known crystalline peaks provided")
+        logger.info("\nPhase 2: SKIPPED - No known crystalline peaks provided")
     
     # PHASE 3: Final combined fit if we found any successful peaks
     if successful_peaks:
-        print(f"\nPhase 3: Performing final combined fit with {len(successful_peaks)} crystalline peaks...")
+        logger.info(f"\nPhase 3: Performing final combined fit with {len(successful_peaks)} crystalline peaks...")
+        step_start = time.perf_counter()
         try:
             combined_results = _perform_fitting_fast(two_theta, baseline_corrected_intensity,
                                              successful_peaks, known_amorp_peaks, peak_data,
-                                             height_width_threshold, with_crystalline=True)
+                                             height_width_threshold, with_crystalline=True,
+                                             solver=solver, warm_start=param_cache, context=context)
+            nfev["combined"] += combined_results['nfev']
             
             # Store combined results
             fitting_results["combined"] = {
@@ -820,17 +2422,18 @@ def fit_xrd_spectrum_fast(two_theta, intensity, known_crys_peaks=None, known_amo
             
             # Check if combined fit is successful
             if combined_results['r_squared'] >= min_r_squared:
-                print(f"Phase 3: SUCCESSFUL - Combined fit with R² = {combined_results['r_squared']:.4f}, "
-                      f"Crystallinity = {combined_results['crystallinity']:.2f}%")
+                logger.info(f"Phase 3: SUCCESSFUL - Combined fit with R² = {combined_results['r_squared']:.4f}, "
+                            f"Crystallinity = {combined_results['crystallinity']:.2f}%")
                 phase_success["combined"] = True
                 best_fit = combined_results
                 best_fit_name = f"Combined ({len(successful_peaks)} Peaks)"
             else:
-                print(f"Phase 3: INSUFFICIENT - Combined fit with R² = {combined_results['r_squared']:.4f} < {min_r_squared:.4f}")
+                logger.info(f"Phase 3: INSUFFICIENT - Combined fit with R² = {combined_results['r_squared']:.4f} < {min_r_squared:.4f}")
         except Exception as e:
-            print(f"Phase 3: ERROR - {str(e)}")
+            logger.warning(f"Phase 3: ERROR - {str(e)}")
+        collector.record(spectrum_id, 'Phase 3', step_start, nfev["combined"], phase_success["combined"])
     else:
-        print("\nPhase 3: SKIPPED - No successful crystalline peaks to combine")
+        logger.info("\nPhase 3: SKIPPED - No successful crystalline peaks to combine")
     
     # --- Step 7: Select Best Model ---
     # If we haven't already selected a best fit, find the one with highest R²
@@ -849,11 +2452,39 @@ def fit_xrd_spectrum_fast(two_theta, intensity, known_crys_peaks=None, known_amo
         # Fallback to amorphous-only if nothing else was successful
         best_fit = amorphous_results
         best_fit_name = "Amorphous Only (Default)"
+    
+    # Refit the selected model at full resolution, starting from its decimated parameters
+    two_theta, baseline_corrected_intensity = full_two_theta, full_intensity
+    multi_resolution = None
+    if decimation > 1:
+        step_start = time.perf_counter()
+        coarse_fit = best_fit
+        best_fit = _perform_fitting_fast(two_theta, baseline_corrected_intensity,
+                                     coarse_fit['fit_known_crys_peaks'], known_amorp_peaks, peak_data,
+                                     height_width_threshold, with_crystalline=coarse_fit['with_crystalline'],
+                                     solver=solver, warm_start=dict(coarse_fit['fitted_components']),
+                                     context=context)
+        nfev["polish"] = best_fit['nfev']
+        collector.record(spectrum_id, 'polish', step_start, nfev["polish"], best_fit['r_squared'] >= min_r_squared)
+        multi_resolution = {
+            'decimation': decimation,
+            'decimated_points': len(coarse_fit['total_fit']),
+            'decimated_crystallinity': coarse_fit['crystallinity'],
+            'decimated_r_squared': coarse_fit['r_squared'],
+            'crystallinity_change': best_fit['crystallinity'] - coarse_fit['crystallinity'],
+        }
+        logger.info(f"\nFull-resolution polish of {best_fit_name}: Crystallinity = {best_fit['crystallinity']:.2f}% "
+                    f"(decimated {coarse_fit['crystallinity']:.2f}%), {nfev['polish']} model evaluations")
         
-    print(f"\nSelected {best_fit_name} model with R² = {best_fit['r_squared']:.4f}")
+    logger.info(f"\nSelected {best_fit_name} model with R² = {best_fit['r_squared']:.4f}")
+    nfev["total"] = sum(nfev.values())
+    logger.info(f"Model evaluations: {nfev['total']} (amorphous {nfev['amorphous']}, "
+                f"individual peaks {nfev['individual_peaks']}, combinations {nfev['combinations']}, "
+                f"combined {nfev['combined']})")
     
     # --- Step 8: Visualization ---
     if visualise:
+        step_start = time.perf_counter()
         # Create a 2-panel figure: Peak Detection + Best Fit
         plt.figure(figsize=(12, 9))
         
@@ -958,6 +2589,7 @@ def fit_xrd_spectrum_fast(two_theta, intensity, known_crys_peaks=None, known_amo
 
         plt.tight_layout()
         plt.show()
+        collector.record(spectrum_id, 'plotting', step_start)
     
     # --- Step 9: Return Results ---
     # Add additional information to the best fit results
@@ -965,6 +2597,7 @@ def fit_xrd_spectrum_fast(two_theta, intensity, known_crys_peaks=None, known_amo
         'normalized_intensity': normalized_intensity,
         'smoothed_intensity': smoothed_intensity,
         'baseline_level': baseline_level,
+        'baseline': baseline_curve,
         'baseline_corrected_intensity': baseline_corrected_intensity,
         'signal_to_noise': snr,
         'is_mostly_amorphous': is_mostly_amorphous,
@@ -973,18 +2606,20 @@ def fit_xrd_spectrum_fast(two_theta, intensity, known_crys_peaks=None, known_amo
         'selected_model': best_fit_name,
         'successful_peaks': successful_peaks,
         'peak_metrics': peak_metrics,
-        'combination_results': combination_results if 'combination_results' in locals() else {}
+        'combination_results': combination_results if 'combination_results' in locals() else {},
+        'combination_search': combination_search,
+        'phase_nfev': nfev,
+        'multi_resolution': multi_resolution,
+        'budget': budget.summary(),
+        'budget_limited': budget.exhausted_in is not None
     })
     
-    # --- Clear class variable when done ---
-    if hasattr(fit_xrd_spectrum_fast, '_all_known_crys_peaks'):
-        delattr(fit_xrd_spectrum_fast, '_all_known_crys_peaks')
-    
     return best_fit
 
 def _perform_fitting_detailed(two_theta, baseline_corrected_intensity, known_crys_peaks, known_amorp_peaks,
                     peak_data, height_width_threshold, with_crystalline=True, 
-                    known_peak_tolerance=1.0):
+                    known_peak_tolerance=1.0, warm_start=None, solver='curve_fit', context=None,
+                    ftol=None):
     """
     Internal helper function to perform the XRD spectrum fitting process.
     This encapsulates fitting and classification logic using pre-detected peaks.
@@ -1007,11 +2642,29 @@ def _perform_fitting_detailed(two_theta, baseline_corrected_intensity, known_cry
         Whether to include crystalline components in the fit
     known_peak_tolerance : float, default=1.0
         Tolerance in degrees for matching detected peaks to known peak positions
+    warm_start : dict or None, default=None
+        Converged parameter triplets from an earlier fit, keyed by (kind, position), e.g. of
+        the same spectrum at lower resolution or of a neighbouring temperature. Matching
+        components start from these instead of the peak-detection guesses; bounds are
+        unchanged
+    solver : {'curve_fit', 'varpro', 'sparse'}, default='curve_fit'
+        Optimiser for the bounded fit; 'varpro' solves the amplitudes linearly and
+        'sparse' evaluates each peak only near its centre
+    context : _FittingContext or None, default=None
+        The calling driver's fitting context, whose known crystalline peaks are used
+        together with known_crys_peaks to classify components, and whose fallback
+        settings choose the alternative fits run if the bounded fit fails
+    ftol : float or None, default=None
+        Relative change in the sum of squares at which the bounded fit stops. None keeps
+        the solver's own tolerance (1e-6 for 'varpro', 1e-8 otherwise); a looser value
+        ends fits that start close to their optimum sooner
         
     Returns:
     --------
     dict
-        Dictionary containing fitting results, parameters and metrics
+        Dictionary containing fitting results, parameters and metrics. 'fit_strategy'
+        names the fit that produced the parameters: 'bounded', one of the fallback
+        strategies, or 'initial_guess' if every fit failed
     """
     # --- Extract peak data ---
     all_peaks = peak_data['all_peaks']
@@ -1022,6 +2675,7 @@ def _perform_fitting_detailed(two_theta, baseline_corrected_intensity, known_cry
     
     # --- Set Up Initial Guesses ---
     init_guess = []
+    component_keys = []  # (kind, position) of each parameter triplet, used for warm starts
     
     # Add known crystalline peaks if in crystalline fitting mode
     if with_crystalline and known_crys_peaks:
@@ -1038,11 +2692,13 @@ def _perform_fitting_detailed(two_theta, baseline_corrected_intensity, known_cry
                 height = peak_heights[nearby_peak_idx]
                 width = peak_widths_degrees[nearby_peak_idx] if nearby_peak_idx < len(peak_widths_degrees) else 0.5
                 init_guess.extend([height, known_pos, width])
+                component_keys.append(('crystalline', known_pos))
             else:
                 # No nearby detected peak, estimate parameters based on data at this position
                 nearby_idx = np.argmin(np.abs(two_theta - known_pos))
                 height_estimate = baseline_corrected_intensity[nearby_idx] * 0.8
                 init_guess.extend([height_estimate, known_pos, 0.5])
+                component_keys.append(('crystalline', known_pos))
     
     # Add detected peaks not near known crystalline peaks if in crystalline mode
     if with_crystalline:
@@ -1069,6 +2725,7 @@ def _perform_fitting_detailed(two_theta, baseline_corrected_intensity, known_cry
             
             # Add parameters [amplitude, position, width]
             init_guess.extend([peak_heights[i], pos, width_estimate])
+            component_keys.append(('detected', pos))
     
     # Add amorphous background peaks
     if not known_amorp_peaks:
@@ -1080,11 +2737,13 @@ def _perform_fitting_detailed(two_theta, baseline_corrected_intensity, known_cry
     
     for pos in known_amorp_peaks:
         init_guess.extend([mean_intensity/2, pos, 5.0])  # amplitude, position, width
+        component_keys.append(('amorphous', pos))
     
     # If no components were added at all, add a minimal set
     if len(init_guess) == 0:
         # Add a broad amorphous component
         init_guess.extend([0.5, 25, 10.0])  # amplitude, position, width
+        component_keys.append(('amorphous', 25))
         num_amorphous_peaks = 1
     
     # --- Set up boundary constraints ---
@@ -1117,142 +2776,59 @@ def _perform_fitting_detailed(two_theta, baseline_corrected_intensity, known_cry
             
         param_index += 3
     
+    # Start from parameters converged in an earlier fit, if provided
+    if warm_start:
+        init_guess = _warm_start_guess(init_guess, component_keys, bounds_low, bounds_high, warm_start)
+    
     # --- Perform Gaussian Fitting ---
+    model = _EvaluationCounter(context.model if context is not None else multi_gaussian)
+    tolerance = {} if ftol is None else {'ftol': ftol}
+    fit_strategy = 'bounded'
     try:
-        # Define Gaussian function for fitting
-        def gaussian(x, A, x0, sigma):
-            """Gaussian function with parameters amplitude, center, and width"""
-            return A * np.exp(-((x - x0) ** 2) / (2 * sigma ** 2))
-        
-        def multi_gaussian(x, *params):
-            """Fit multiple Gaussian peaks simultaneously"""
-            num_peaks = len(params) // 3
-            y_fit = np.zeros_like(x)
-            for i in range(num_peaks):
-                amp = params[3*i]
-                center = params[3*i+1]
-                width = params[3*i+2]
-                y_fit += gaussian(x, amp, center, width)
-            return y_fit
-        
         # Strategy 1: Try original fit with bounds
         try:
-            popt, pcov = curve_fit(multi_gaussian, two_theta, baseline_corrected_intensity, 
-                                  p0=init_guess, bounds=(bounds_low, bounds_high),
-                                  maxfev=20000)
-        except ValueError as e:
-            if "x0 is infeasible" in str(e):
-                print("Initial guess violates bounds. Attempting fallback strategies...")
-                
-                # Strategy 2: Validate and fix initial guess
-                print("Fixing initial guess to satisfy bounds...")
-                fixed_init_guess = []
-                for i in range(len(init_guess)):
-                    val = init_guess[i]
-                    low = bounds_low[i]
-                    high = bounds_high[i]
-                    
-                    # Ensure value is within bounds
-                    if val < low:
-                        fixed_val = low + 1e-6
-                    elif val > high:
-                        fixed_val = high - 1e-6
-                    else:
-                        fixed_val = val
-                    
-                    fixed_init_guess.append(fixed_val)
-                
-                # Try fit with fixed initial guess
-                try:
-                    popt, pcov = curve_fit(multi_gaussian, two_theta, baseline_corrected_intensity, 
-                                          p0=fixed_init_guess, bounds=(bounds_low, bounds_high),
-                                          maxfev=20000)
-                    print("Success with fixed initial guess")
-                except Exception as e2:
-                    print(f"Fixed initial guess also failed: {str(e2)}")
-                    
-                    # Strategy 3: Try without bounds (Levenberg-Marquardt)
-                    try:
-                        print("Attempting fit without bounds...")
-                        popt, pcov = curve_fit(multi_gaussian, two_theta, baseline_corrected_intensity, 
-                                              p0=init_guess, method='lm', maxfev=25000)
-                        print("Success with unbounded fit")
-                    except Exception as e3:
-                        print(f"Unbounded fit failed: {str(e3)}")
-                        
-                        # Strategy 4: Simplified parameters (last resort)
-                        try:
-                            print("Attempting simplified fit...")
-                            # Create very simple initial guess with relaxed bounds
-                            simple_guess = []
-                            simple_low = []
-                            simple_high = []
-                            
-                            # Add just one amorphous peak
-                            mean_int = np.mean(baseline_corrected_intensity)
-                            simple_guess.extend([mean_int/2, 25, 8.0])
-                            simple_low.extend([0, 10, 3.0])
-                            simple_high.extend([np.inf, 40, 20.0])
-                            
-                            # Add one crystalline peak if requested
-                            if with_crystalline and known_crys_peaks:
-                                pos = known_crys_peaks[0]
-                                data_idx = np.argmin(np.abs(two_theta - pos))
-                                height = baseline_corrected_intensity[data_idx] * 0.5
-                                simple_guess.extend([height, pos, 0.8])
-                                simple_low.extend([0, pos-1, 0.2])
-                                simple_high.extend([np.inf, pos+1, 2.0])
-                            
-                            popt, pcov = curve_fit(multi_gaussian, two_theta, baseline_corrected_intensity, 
-                                                  p0=simple_guess, bounds=(simple_low, simple_high),
-                                                  maxfev=15000)
-                            print("Success with simplified parameters")
-                        except Exception as e4:
-                            print(f"All fitting strategies failed: {str(e4)}")
-                            print("Using initial guess as final parameters")
-                            popt = np.array(init_guess)
+            if solver == 'varpro':
+                popt = _fit_variable_projection(model, two_theta, baseline_corrected_intensity,
+                                                init_guess, bounds_low, bounds_high, max_nfev=20000, **tolerance)
+            elif solver == 'sparse':
+                popt = _fit_sparse_support(model, two_theta, baseline_corrected_intensity,
+                                           init_guess, bounds_low, bounds_high, max_nfev=20000, **tolerance)
             else:
-                # Other ValueError, try unbounded fit
-                print(f"ValueError (not x0): {str(e)}. Trying unbounded fit...")
-                try:
-                    popt, pcov = curve_fit(multi_gaussian, two_theta, baseline_corrected_intensity, 
-                                          p0=init_guess, method='lm', maxfev=25000)
-                    print("Success with unbounded fit")
-                except Exception as e2:
-                    print(f"Unbounded fit also failed: {str(e2)}")
-                    popt = np.array(init_guess)
+                popt, pcov = curve_fit(model, two_theta, baseline_corrected_intensity, 
+                                      jac=model.jacobian, p0=init_guess, bounds=(bounds_low, bounds_high),
+                                      maxfev=20000, **tolerance)
         except Exception as e:
-            # Other exceptions (not ValueError)
-            print(f"Fitting error: {str(e)}")
-            try:
-                print("Trying unbounded fit as fallback...")
-                popt, pcov = curve_fit(multi_gaussian, two_theta, baseline_corrected_intensity, 
-                                      p0=init_guess, method='lm', maxfev=25000)
-                print("Success with unbounded fallback")
-            except Exception as e2:
-                print(f"Fallback also failed: {str(e2)}")
-                print("Using initial guess as final parameters")
+            # Strategies 2-4: alternative fits, run concurrently with their own budgets
+            settings = context or _FittingContext()
+            fits = _fallback_fits(two_theta, baseline_corrected_intensity, init_guess, bounds_low,
+                                  bounds_high, known_crys_peaks, with_crystalline,
+                                  settings.fallback_strategies, settings.fallback_max_nfev)
+            logger.debug("Fitting error: %s. Trying fallback fits: %s", str(e).rstrip('.'),
+                         ', '.join(name for name, _ in fits))
+            fallback = _run_fallback_fits(fits, model, two_theta, baseline_corrected_intensity,
+                                          settings.fallback_selection)
+            if fallback is not None:
+                fit_strategy, popt = fallback
+                logger.debug("Success with fallback '%s'", fit_strategy)
+                if fit_strategy == 'simplified':
+                    component_keys = []  # Parameters no longer follow the initial guess layout
+            else:
+                logger.warning("All fitting strategies failed. Using initial guess as final parameters")
+                fit_strategy = 'initial_guess'
                 popt = np.array(init_guess)
                 
     except Exception as e:
-        print(f"Outer fitting error: {str(e)}")
-        print("Using initial guess as final parameters")
+        logger.warning(f"Outer fitting error: {str(e)}. Using initial guess as final parameters")
+        fit_strategy = 'initial_guess'
         popt = np.array(init_guess)
     
     # --- Separate Components Based on Height-to-Width Ratio ---
     crystalline_params = []
     amorphous_params = []
     
-    # Start with ALL known crystalline peak positions from the global reference
-    all_known_crys_peaks = []
-    if hasattr(fit_xrd_spectrum_detailed, '_all_known_crys_peaks') and fit_xrd_spectrum_detailed._all_known_crys_peaks:
-        all_known_crys_peaks = fit_xrd_spectrum_detailed._all_known_crys_peaks.copy()
-    
-    # Add any specifically passed peaks that aren't already included
-    if known_crys_peaks:
-        for pos in known_crys_peaks:
-            if pos not in all_known_crys_peaks:
-                all_known_crys_peaks.append(pos)
+    # Start with ALL known crystalline peak positions from the driver's context and
+    # add any specifically passed peaks that aren't already included
+    all_known_crys_peaks = (context or _FittingContext()).crystalline_reference(known_crys_peaks)
                 
     # Process fitted parameters
     for i in range(0, len(popt), 3):
@@ -1279,28 +2855,24 @@ def _perform_fitting_detailed(two_theta, baseline_corrected_intensity, known_cry
         if with_crystalline and is_known_crys_peak and hw_ratio > height_width_threshold and width < 1.0:
             # This is likely a crystalline peak
             # Print information why this is classified as a crystalline peak
-            print(f"Classifying peak at {center:.2f}° as crystalline: "
-                f"height/width={hw_ratio:.2f}, width={width:.2f}°"
-                f"{' (known position)' if is_known_crys_peak else ''}")
+            logger.debug("Classifying peak at %.2f° as crystalline: height/width=%.2f, width=%.2f°%s",
+                         center, hw_ratio, width, ' (known position)' if is_known_crys_peak else '')
             crystalline_params.extend([amp, center, width])
         else:
             # This is likely an amorphous peak
             amorphous_params.extend([amp, center, width])
     
-    # --- Calculate Individual Components ---
-    crystalline_fit = np.zeros_like(two_theta)
-    if crystalline_params:
-        crystalline_fit = multi_gaussian(two_theta, *crystalline_params)
-        
-    amorphous_fit = np.zeros_like(two_theta)
-    if amorphous_params:
-        amorphous_fit = multi_gaussian(two_theta, *amorphous_params)
-        
-    total_fit = crystalline_fit + amorphous_fit
+    # --- Calculate Fitted Profile ---
+    # The crystalline and amorphous curves are only evaluated if a caller asks for them
+    total_fit = _component_curve(two_theta, crystalline_params + amorphous_params)
     
     # --- Calculate Crystallinity Index ---
-    area_crystalline = np.trapz(crystalline_fit, two_theta)
-    area_amorphous = np.trapz(amorphous_fit, two_theta)
+    # Closed-form peak areas over the measured 2θ window
+    area_window = (np.min(two_theta), np.max(two_theta))
+    crystalline_areas = gaussian_areas(crystalline_params, *area_window)
+    amorphous_areas = gaussian_areas(amorphous_params, *area_window)
+    area_crystalline = np.sum(crystalline_areas)
+    area_amorphous = np.sum(amorphous_areas)
     area_total = area_crystalline + area_amorphous
     
     if area_total > 0:
@@ -1325,11 +2897,7 @@ def _perform_fitting_detailed(two_theta, baseline_corrected_intensity, known_cry
             'position': crystalline_params[i+1], 
             'width': crystalline_params[i+2],
             'hw_ratio': crystalline_params[i] / crystalline_params[i+2],
-            'area': np.trapz(gaussian(two_theta, 
-                                     crystalline_params[i], 
-                                     crystalline_params[i+1], 
-                                     crystalline_params[i+2]), 
-                            two_theta)
+            'area': crystalline_areas[i // 3]
         })
     
     amorphous_peak_data = []
@@ -1341,15 +2909,11 @@ def _perform_fitting_detailed(two_theta, baseline_corrected_intensity, known_cry
             'position': amorphous_params[i+1], 
             'width': amorphous_params[i+2],
             'hw_ratio': amorphous_params[i] / amorphous_params[i+2],
-            'area': np.trapz(gaussian(two_theta, 
-                                     amorphous_params[i], 
-                                     amorphous_params[i+1], 
-                                     amorphous_params[i+2]), 
-                            two_theta)
+            'area': amorphous_areas[i // 3]
         })
     
     # Return fitting results
-    results = {
+    results = _FitResults({
         'major_peaks': major_peaks,
         'all_peaks': all_peaks,
         'peak_positions': peak_positions,
@@ -1358,8 +2922,6 @@ def _perform_fitting_detailed(two_theta, baseline_corrected_intensity, known_cry
         'optimized_parameters': popt,
         'crystalline_params': crystalline_params,
         'amorphous_params': amorphous_params,
-        'crystalline_fit': crystalline_fit,
-        'amorphous_fit': amorphous_fit,
         'total_fit': total_fit,
         'crystallinity': crystallinity,
         'r_squared': r_squared,
@@ -1368,15 +2930,29 @@ def _perform_fitting_detailed(two_theta, baseline_corrected_intensity, known_cry
         'crystalline_peak_data': crystalline_peak_data,
         'amorphous_peak_data': amorphous_peak_data,
         'gaussian_function': gaussian,
-        'multi_gaussian_function': multi_gaussian
-    }
+        'multi_gaussian_function': multi_gaussian,
+        'fit_known_crys_peaks': list(known_crys_peaks),
+        'with_crystalline': with_crystalline,
+        'fitted_components': (dict(zip(component_keys, np.reshape(popt, (-1, 3))))
+                              if len(popt) == 3 * len(component_keys) else {}),
+        'nfev': model.nfev,
+        'njev': model.njev,
+        'fit_strategy': fit_strategy
+    }, lazy={
+        'crystalline_fit': (_component_curve, (two_theta, crystalline_params)),
+        'amorphous_fit': (_component_curve, (two_theta, amorphous_params)),
+    })
     
     return results
 
 def fit_xrd_spectrum_detailed(two_theta, intensity, known_crys_peaks=None, known_amorp_peaks=None, 
                      height_width_threshold=0.3, min_prominence=0.008, 
                      min_r_squared=0.998, amorphous_r_squared=0.80, visualise=True,
-                     max_combination_size=4):
+                     max_combination_size=4, n_workers=None, selection='exhaustive',
+                     warm_start=False, solver='curve_fit', backend='numpy', decimation=1,
+                     baseline_method='minimum', baseline_lam=100.0, fallback_strategies=('unbounded',),
+                     fallback_selection='first', fallback_max_nfev=None, time_budget_s=None,
+                     max_total_nfev=None, metrics=None):
     """
     Efficient XRD analysis function using a build-up strategy:
     1. Start with amorphous-only fit
@@ -1405,12 +2981,103 @@ def fit_xrd_spectrum_detailed(two_theta, intensity, known_crys_peaks=None, known
         Whether to generate visualization plots
     max_combination_size : int, default=3
         Maximum number of peaks to include in combinations testing
+    n_workers : int or None, default=None
+        Number of worker processes for the Phase 2B combination search. None or 1 fits
+        the combinations serially; results are identical either way
+    selection : {'exhaustive', 'stepwise', 'ranked'}, default='exhaustive'
+        Phase 2B subset-selection strategy. 'exhaustive' fits every combination up to
+        max_combination_size and is the only exact choice. 'stepwise' and 'ranked' are
+        opt-in heuristics that prune the search using the Phase 2A quality scores and R²
+        values, and can select a different combination and crystallinity: on the bundled
+        spectra they missed the exhaustive choice on 3-5 of 27 files per engine while
+        skipping only about a quarter of the fits (see _search_peak_combinations). The
+        number of fits run and skipped is reported in results['combination_search']
+    warm_start : bool or dict, default=False
+        False starts every fit from the peak-detection guesses, as for the published
+        results. True is an opt-in that starts the combination and final combined fits from
+        the amorphous parameters converged in Phase 1 and the peak parameters converged in
+        Phase 2A. It is not a speed-up: on the bundled spectra these fits did not need fewer
+        evaluations and changed the selected model on 10 of 27 files
+        (xrd_benchmarks.benchmark_warm_start compares the two per file). A dict of parameter
+        triplets keyed by (kind, position), e.g. results['fitted_components'] of the same
+        sample at a neighbouring temperature, instead seeds the amorphous-only fit of Phase 1
+        and, with its crystalline entries, the single-peak fits of Phase 2A; the combination
+        and combined fits then start from the peak-detection guesses. Model evaluations per
+        phase are reported in results['phase_nfev'] either way
+    solver : {'curve_fit', 'varpro', 'sparse'}, default='curve_fit'
+        Optimiser for the bounded Gaussian fits. 'varpro' uses variable projection:
+        amplitudes are solved by non-negative least squares and only peak centres and
+        widths are optimised (see _fit_variable_projection). 'sparse' evaluates each
+        peak only within ±8 widths of its centre and gives least_squares a sparse
+        Jacobian (see _fit_sparse_support), for long or finely sampled scans. Results
+        use the same keys
+    backend : {'numpy', 'numba'}, default='numpy'
+        Evaluation backend of the multi-Gaussian model and its Jacobian. 'numba' uses
+        compiled kernels and falls back to NumPy if numba is not installed; fitted
+        values agree to rounding error
+    decimation : int, default=1
+        Multi-resolution mode. With decimation > 1 Phases 1-3 fit every decimation-th
+        point of the preprocessed spectrum (preprocessing and peak detection still use
+        every point), and only the selected model is refitted at full resolution,
+        starting from its decimated parameters. results['multi_resolution'] reports the
+        decimated and full-resolution crystallinity of that model, and results['all_models']
+        hold the decimated fits. Use compare_decimation_factors to choose a safe factor
+    baseline_method : {'minimum', 'asls', 'arpls'}, default='minimum'
+        Baseline correction of Step 2. 'minimum' subtracts the lowest smoothed intensity;
+        'asls' and 'arpls' subtract a smooth background curve (see estimate_baseline),
+        so a sloped background is not absorbed by the amorphous peaks. The subtracted
+        curve is returned in results['baseline']
+    baseline_lam : float, default=100.0
+        Smoothness penalty of the 'asls' and 'arpls' baselines
+    fallback_strategies : tuple, default=('unbounded',)
+        Alternative fits run when a bounded fit fails, in order of preference:
+        'fixed_guess' (the initial guess moved inside the bounds, used only if it was
+        outside them), 'unbounded' (Levenberg-Marquardt from the initial guess) and
+        'simplified' (one amorphous and one crystalline peak). Several strategies run
+        concurrently in threads. If all fail, the initial guess is used. The default
+        reproduces the published results; each fit reports the strategy that produced
+        its parameters in 'fit_strategy'
+    fallback_selection : {'first', 'best'}, default='first'
+        'first' takes the most preferred strategy that succeeds and cancels the others
+        once it has finished; 'best' runs them all and takes the highest R²
+    fallback_max_nfev : int or None, default=None
+        Evaluation budget of each fallback strategy. None keeps their own limits
+        (20000 fixed-guess, 15000 simplified and 25000 Levenberg-Marquardt evaluations)
+    time_budget_s : float or None, default=None
+        Wall-time budget of the fitting phases in seconds. Once it is spent, the remaining
+        Phase 2A and 2B fits are skipped and Phase 3 combines the best peaks found so far
+        (see _FitBudget); results['budget_limited'] is then True and results['budget']
+        reports the time, evaluations and skipped peaks. None for no limit
+    max_total_nfev : int or None, default=None
+        Budget of model evaluations over all fits, applied in the same way. Both budgets
+        are checked between fits, so the fit running when a budget runs out is finished
+    metrics : FitMetrics or None, default=None
+        Collector for the wall time, model evaluations and success of each step of this
+        call (see FitMetrics.to_frame). None does not collect them
         
     Returns:
     --------
     dict
         Dictionary containing peak information, fitted parameters, and crystallinity
     """
+    if selection not in _COMBINATION_SELECTIONS:
+        raise ValueError(f"selection must be one of {_COMBINATION_SELECTIONS}, got {selection!r}")
+    if solver not in _FIT_SOLVERS:
+        raise ValueError(f"solver must be one of {_FIT_SOLVERS}, got {solver!r}")
+    if backend not in _MODEL_BACKENDS:
+        raise ValueError(f"backend must be one of {_MODEL_BACKENDS}, got {backend!r}")
+    if int(decimation) != decimation or decimation < 1:
+        raise ValueError(f"decimation must be a positive integer, got {decimation!r}")
+    if not set(fallback_strategies) <= set(_FALLBACK_STRATEGIES):
+        raise ValueError(f"fallback_strategies must be taken from {_FALLBACK_STRATEGIES}, got {fallback_strategies!r}")
+    if fallback_selection not in _FALLBACK_SELECTIONS:
+        raise ValueError(f"fallback_selection must be one of {_FALLBACK_SELECTIONS}, got {fallback_selection!r}")
+    
+    if time_budget_s is not None and not time_budget_s > 0:
+        raise ValueError(f"time_budget_s must be positive, got {time_budget_s!r}")
+    if max_total_nfev is not None and not max_total_nfev > 0:
+        raise ValueError(f"max_total_nfev must be positive, got {max_total_nfev!r}")
+    
     # Set default values if None is provided
     if known_crys_peaks is None:
         known_crys_peaks = []  
@@ -1418,106 +3085,65 @@ def fit_xrd_spectrum_detailed(two_theta, intensity, known_crys_peaks=None, known
     if known_amorp_peaks is None:
         known_amorp_peaks = []  # Default amorphous peak positions
     
-    # Store all known crystalline peaks in a class variable for reference
+    # Keep all known crystalline peaks in the fitting context passed to every fit
     # This allows _perform_fitting to access all known peaks even when testing individual peaks
-    fit_xrd_spectrum_detailed._all_known_crys_peaks = known_crys_peaks.copy() if known_crys_peaks else []
-    
-    # --- Step 1: Data Preprocessing ---
-    # Normalize intensity
-    normalized_intensity = intensity / np.max(intensity)
+    context = _FittingContext(known_crys_peaks, backend=backend, fallback_strategies=fallback_strategies,
+                              fallback_selection=fallback_selection, fallback_max_nfev=fallback_max_nfev)
     
-    # Smooth the normalized data
-    smoothed_intensity = savgol_filter(normalized_intensity, window_length=15, polyorder=3)
-    
-    # --- Step 2: Baseline Correction ---
-    # Method: Find the minimum value of smoothed intensity as baseline level
-    baseline_level = np.min(smoothed_intensity)
-    
-    # Subtract baseline level from smoothed intensity
-    baseline_corrected_intensity = smoothed_intensity - baseline_level
-    
-    # Ensure no negative values
-    baseline_corrected_intensity = np.maximum(baseline_corrected_intensity, 0)
-    
-    # Renormalize after baseline correction
-    if np.max(baseline_corrected_intensity) > 0:
-        baseline_corrected_intensity = baseline_corrected_intensity / np.max(baseline_corrected_intensity)
-    
-    # --- Step 3: Assess Signal Quality ---
-    # Calculate signal-to-noise ratio
-    signal_mean = np.mean(baseline_corrected_intensity)
-    noise_estimate = np.std(baseline_corrected_intensity - 
-                           savgol_filter(baseline_corrected_intensity, window_length=21, polyorder=3))
-    snr = signal_mean / noise_estimate if noise_estimate > 0 else 0
-    
-    # Adjust peak detection parameters based on signal quality
-    adjusted_min_prominence = min_prominence
-    if snr < 5:  # Low SNR
-        print(f"Low signal-to-noise ratio detected ({snr:.2f}). Adjusting detection parameters.")
-        adjusted_min_prominence = min_prominence * 1.5  # Increase prominence threshold for noisy data
+    # Wall time, model evaluations and success of each step
+    collector = metrics if metrics is not None else FitMetrics()
+    spectrum_id = collector.begin_spectrum()
     
-    # Check if data has any significant peaks at all
-    max_peak_height = np.max(baseline_corrected_intensity)
-    is_mostly_amorphous = max_peak_height < 0.1  # Very low peak height suggests mostly amorphous
+    # --- Steps 1-5: Preprocessing, signal quality and peak detection (memoised per spectrum) ---
+    step_start = time.perf_counter()
+    preprocessed = preprocess_xrd_spectrum(two_theta, intensity, min_prominence, baseline_method, baseline_lam)
+    collector.record(spectrum_id, 'preprocessing', step_start)
+    normalized_intensity = preprocessed['normalized_intensity']
+    smoothed_intensity = preprocessed['smoothed_intensity']
+    baseline_level = preprocessed['baseline_level']
+    baseline_curve = preprocessed['baseline']
+    baseline_corrected_intensity = preprocessed['baseline_corrected_intensity']
+    snr = preprocessed['signal_to_noise']
+    is_mostly_amorphous = preprocessed['is_mostly_amorphous']
+    peak_data = preprocessed['peak_data']
+    major_peaks = peak_data['major_peaks']
+    all_peaks = peak_data['all_peaks']
     
+    if preprocessed['low_signal_to_noise']:
+        logger.info(f"Low signal-to-noise ratio detected ({snr:.2f}). Adjusting detection parameters.")
     if is_mostly_amorphous:
-        print("Sample appears to be predominantly amorphous.")
-    
-    # --- Step 5: Run Peak Detection (JUST ONCE) ---
-    # First pass with less strict parameters to find major peaks
-    major_peaks, _ = find_peaks(baseline_corrected_intensity, 
-                               prominence=adjusted_min_prominence * 5,
-                               width=20,
-                               distance=50)
-    
-    # Second pass with more sensitive settings to detect shoulders and overlaps
-    all_peaks, _ = find_peaks(baseline_corrected_intensity,
-                             prominence=adjusted_min_prominence,  
-                             width=10,         
-                             distance=50
-                            #  prominence=0.02, #* needs to identfy all peaks 
-                            #  width=5,         
-                            #  distance=10
-                             )      
-    
-    # Use peak properties to get a better estimate of peak widths
-    _, properties = find_peaks(baseline_corrected_intensity, 
-                              prominence=adjusted_min_prominence,
-                              width=10,
-                              distance=20,
-                              rel_height=0.5)  # For width at half maximum
-    
-    # Extract peak information
-    peak_positions = two_theta[all_peaks] if len(all_peaks) > 0 else np.array([])
-    peak_heights = baseline_corrected_intensity[all_peaks] if len(all_peaks) > 0 else np.array([])
-    
-    # Calculate peak widths in degrees
-    if len(properties["widths"]) > 0:
-        peak_widths_points = properties["widths"]
-        peak_distances = np.diff(two_theta)
-        avg_point_distance = np.mean(peak_distances)
-        peak_widths_degrees = peak_widths_points * avg_point_distance
-    else:
-        peak_widths_degrees = np.array([])
-    
-    # Create peak_data dictionary to pass to the fitting function
-    peak_data = {
-        'major_peaks': major_peaks,
-        'all_peaks': all_peaks,
-        'peak_positions': peak_positions,
-        'peak_heights': peak_heights,
-        'peak_widths': peak_widths_degrees
-    }
+        logger.info("Sample appears to be predominantly amorphous.")
     
     # --- Step 6: Build-Up Fitting Strategy ---
     phase_success = {"amorphous": False, "individual_peaks": False, "combinations": False, "combined": False}
     fitting_results = {}
     
+    # Converged parameters reused by later phases, and model evaluations spent in each phase
+    seed = dict(warm_start) if isinstance(warm_start, dict) else None
+    param_cache = {} if warm_start and seed is None else None
+    nfev = {"amorphous": 0, "individual_peaks": 0, "combinations": 0, "combined": 0}
+    budget = _FitBudget(time_budget_s, max_total_nfev, nfev)
+    
+    # Single-peak fits only take the seeded peaks: the amorphous parameters of an
+    # amorphous-only fit are a poor start once a crystalline peak is added
+    crystalline_seed = {key: params for key, params in seed.items() if key[0] == 'crystalline'} if seed else None
+    
+    # Multi-resolution mode: Phases 1-3 work on every decimation-th point
+    full_two_theta, full_intensity = two_theta, baseline_corrected_intensity
+    if decimation > 1:
+        two_theta = two_theta[::decimation]
+        baseline_corrected_intensity = baseline_corrected_intensity[::decimation]
+        logger.info(f"\nMulti-resolution mode: fitting phases use {len(two_theta)} of {len(full_two_theta)} points")
+    
     # PHASE 1: Start with amorphous-only fit
-    print("\nPhase 1: Performing amorphous-only fit...")
+    logger.info("\nPhase 1: Performing amorphous-only fit...")
+    step_start = time.perf_counter()
     amorphous_results = _perform_fitting_detailed(two_theta, baseline_corrected_intensity,
                                        [], known_amorp_peaks, peak_data,
-                                       height_width_threshold, with_crystalline=False)
+                                       height_width_threshold, with_crystalline=False,
+                                       solver=solver, warm_start=seed, context=context)
+    nfev["amorphous"] += amorphous_results['nfev']
+    _cache_fitted_components(param_cache, amorphous_results, 'amorphous')
     
     # Store amorphous-only results
     fitting_results["amorphous"] = {
@@ -1527,7 +3153,7 @@ def fit_xrd_spectrum_detailed(two_theta, intensity, known_crys_peaks=None, known
     
     # Check if amorphous fit is excellent (exceeds normal threshold)
     if amorphous_results['r_squared'] >= min_r_squared:
-        print(f"Phase 1: EXCELLENT - Amorphous-only fit with R² = {amorphous_results['r_squared']:.4f}")
+        logger.info(f"Phase 1: EXCELLENT - Amorphous-only fit with R² = {amorphous_results['r_squared']:.4f}")
         phase_success["amorphous"] = True
         best_fit = amorphous_results
         best_fit_name = "Amorphous Only"
@@ -1535,20 +3161,23 @@ def fit_xrd_spectrum_detailed(two_theta, intensity, known_crys_peaks=None, known
         # Check if amorphous fit is at least acceptable
         amorphous_acceptable = amorphous_results['r_squared'] >= amorphous_r_squared
         if amorphous_acceptable:
-            print(f"Phase 1: ACCEPTABLE - Amorphous-only fit with R² = {amorphous_results['r_squared']:.4f}")
+            logger.info(f"Phase 1: ACCEPTABLE - Amorphous-only fit with R² = {amorphous_results['r_squared']:.4f}")
             phase_success["amorphous"] = True
         else:
-            print(f"Phase 1: INSUFFICIENT - Amorphous-only fit with R² = {amorphous_results['r_squared']:.4f}")
+            logger.info(f"Phase 1: INSUFFICIENT - Amorphous-only fit with R² = {amorphous_results['r_squared']:.4f}")
+    collector.record(spectrum_id, 'Phase 1', step_start, nfev["amorphous"], phase_success["amorphous"])
     
     # PHASE 2: Test individual crystalline peaks and combinations if we have any
     successful_peaks = []
     peak_metrics = {}
+    single_peak_r2 = {}
     best_individual_r2 = 0
     best_individual_results = None
     best_individual_peak = None
     
     # For storing combination results
     combination_results = {}
+    combination_search = {}
     best_combination_r2 = 0
     best_combination = None
     best_combination_results = None
@@ -1674,15 +3303,22 @@ def fit_xrd_spectrum_detailed(two_theta, intensity, known_crys_peaks=None, known
             }
             
         # PHASE 2A: Test individual peaks first
-        print("\nPhase 2A: Testing each crystalline peak individually...")
+        logger.info("\nPhase 2A: Testing each crystalline peak individually...")
+        step_start = time.perf_counter()
         for peak_pos in known_crys_peaks:
+            if budget.check("Phase 2A"):
+                budget.skipped_peaks.append(peak_pos)
+                continue
             try:
-                print(f"  Testing peak at {peak_pos}°...")
+                logger.debug("  Testing peak at %s°...", peak_pos)
                 
                 # Test this individual peak
                 single_peak_results = _perform_fitting_detailed(two_theta, baseline_corrected_intensity,
                                                    [peak_pos], known_amorp_peaks, peak_data,
-                                                   height_width_threshold, with_crystalline=True)
+                                                   height_width_threshold, with_crystalline=True,
+                                                   solver=solver, warm_start=crystalline_seed, context=context)
+                nfev["individual_peaks"] += single_peak_results['nfev']
+                _cache_fitted_components(param_cache, single_peak_results, 'crystalline')
                 
                 # Calculate comprehensive metrics around this peak
                 metrics = calculate_peak_metrics(
@@ -1696,6 +3332,8 @@ def fit_xrd_spectrum_detailed(two_theta, intensity, known_crys_peaks=None, known
                 
                 # Store metrics for this peak
                 peak_metrics[peak_pos] = metrics
+                if single_peak_results['crystallinity'] > 0:
+                    single_peak_r2[peak_pos] = single_peak_results['r_squared']
                 
                 # Check if this peak provides any crystallinity
                 has_crystallinity = single_peak_results['crystallinity'] > 0
@@ -1719,26 +3357,27 @@ def fit_xrd_spectrum_detailed(two_theta, intensity, known_crys_peaks=None, known
                     if quality_score > 0.1: #*updated from 0.3
                         if single_peak_results['r_squared'] >= min_r_squared:
                             successful_peaks.append(peak_pos)
-                            print(f"  Peak at {peak_pos}°: SUCCESSFUL - Quality score: {quality_score:.3f}, "
-                                  f"SNR: {snr:.2f}, Correlation: {correlation:.3f}, "
-                                  f"Overall R² = {single_peak_results['r_squared']:.4f}")
+                            logger.info(f"  Peak at {peak_pos}°: SUCCESSFUL - Quality score: {quality_score:.3f}, "
+                                        f"SNR: {snr:.2f}, Correlation: {correlation:.3f}, "
+                                        f"Overall R² = {single_peak_results['r_squared']:.4f}")
                         else:
-                            print(f"  Peak at {peak_pos}°: DETECTED with good quality score ({quality_score:.3f}) but "
-                                  f"overall R² = {single_peak_results['r_squared']:.4f} < {min_r_squared:.4f}")
+                            logger.info(f"  Peak at {peak_pos}°: DETECTED with good quality score ({quality_score:.3f}) but "
+                                        f"overall R² = {single_peak_results['r_squared']:.4f} < {min_r_squared:.4f}")
                             # Include peak anyway if quality is substantially good
                             if quality_score > 0.1: #* updated from 0.5
                                 successful_peaks.append(peak_pos)
-                                print(f"    - Adding anyway due to high quality score")
+                                logger.info(f"    - Adding anyway due to high quality score")
                     else:
-                        print(f"  Peak at {peak_pos}°: DETECTED but low quality score: {quality_score:.3f}")
+                        logger.info(f"  Peak at {peak_pos}°: DETECTED but low quality score: {quality_score:.3f}")
                         # Print breakdown of what factors contributed to the low score
-                        print(f"    - SNR: {snr:.2f}, Correlation: {correlation:.3f}, "
-                              f"RMSE improvement: {rmse_improvement:.5f}")
+                        logger.debug("    - SNR: %.2f, Correlation: %.3f, RMSE improvement: %.5f",
+                                     snr, correlation, rmse_improvement)
                 else:
-                    print(f"  Peak at {peak_pos}°: NOT DETECTED as crystalline")
+                    logger.info(f"  Peak at {peak_pos}°: NOT DETECTED as crystalline")
                     
             except Exception as e:
-                print(f"  Peak at {peak_pos}°: ERROR - {str(e)}")
+                logger.warning(f"  Peak at {peak_pos}°: ERROR - {str(e)}")
+        collector.record(spectrum_id, 'Phase 2A', step_start, nfev["individual_peaks"], bool(successful_peaks))
         
         # Store best individual peak result if we found one
         if best_individual_results is not None:
@@ -1751,9 +3390,8 @@ def fit_xrd_spectrum_detailed(two_theta, intensity, known_crys_peaks=None, known
             
         # PHASE 2B: Test combinations of peaks if we have multiple peaks
         if len(known_crys_peaks) > 1:
-            import itertools
-            
-            print("\nPhase 2B: Testing combinations of crystalline peaks...")
+            logger.info("\nPhase 2B: Testing combinations of crystalline peaks...")
+            step_start = time.perf_counter()
             
             # Determine the maximum size for combinations based on the number of peaks available
             # and the user-specified maximum
@@ -1763,55 +3401,59 @@ def fit_xrd_spectrum_detailed(two_theta, intensity, known_crys_peaks=None, known
             total_combinations = sum(len(list(itertools.combinations(known_crys_peaks, size))) 
                                    for size in range(2, actual_max_size + 1))
             
-            print(f"  Testing {total_combinations} possible peak combinations (sizes 2-{actual_max_size})...")
+            logger.info(f"  Testing {total_combinations} possible peak combinations (sizes 2-{actual_max_size})...")
             
             combination_count = 0
             promising_combinations = []
             
-            # Test combinations of different sizes
-            for combination_size in range(2, actual_max_size + 1):
-                for peak_combination in itertools.combinations(known_crys_peaks, combination_size):
-                    combination_count += 1
-                    peak_combination_list = list(peak_combination)
-                    peak_positions_str = ", ".join(f"{pos}°" for pos in peak_combination)
+            if selection != 'exhaustive':
+                logger.info(f"  Using '{selection}' subset selection instead of testing every combination; "
+                            f"it may miss the best combination")
+            if n_workers is not None and n_workers > 1:
+                logger.info(f"  Fitting combinations in parallel with {n_workers} worker processes")
+            
+            # Test combinations of different sizes (results arrive in a deterministic order)
+            for peak_combination_list, comb_results, error in _search_peak_combinations(
+                    selection, 'detailed', two_theta, baseline_corrected_intensity, known_crys_peaks,
+                    known_amorp_peaks, peak_data, height_width_threshold, actual_max_size,
+                    peak_metrics, single_peak_r2, amorphous_results['r_squared'], combination_search,
+                    n_workers=n_workers, fit_options={'solver': solver, 'warm_start': param_cache},
+                    context=context, budget=budget):
+                combination_count += 1
+                peak_positions_str = ", ".join(f"{pos}°" for pos in peak_combination_list)
+                
+                # Show progress for larger sets
+                if combination_count % 5 == 0 or combination_count == total_combinations:
+                    logger.debug("  Progress: %d/%d combinations tested", combination_count, total_combinations)
+                
+                if error is not None:
+                    logger.warning(f"  Error testing combination {peak_positions_str}: {error}")
+                    continue
+                nfev["combinations"] += comb_results['nfev']
+                
+                # Store a summary for this combination; only the best one keeps its full results
+                combination_key = "-".join(str(pos) for pos in peak_combination_list)
+                combination_results[combination_key] = {
+                    "peaks": peak_combination_list,
+                    "r_squared": comb_results['r_squared'],
+                    "crystallinity": comb_results['crystallinity'],
+                    "model": FitSummary.from_results(comb_results)
+                }
+                
+                # Check if this combination has crystallinity
+                has_crystallinity = comb_results['crystallinity'] > 0
+                
+                # Check if this is the best combination so far
+                if has_crystallinity and comb_results['r_squared'] > best_combination_r2:
+                    best_combination_r2 = comb_results['r_squared']
+                    best_combination = peak_combination_list
+                    best_combination_results = comb_results
                     
-                    try:
-                        # Show progress for larger sets
-                        if combination_count % 5 == 0 or combination_count == total_combinations:
-                            print(f"  Progress: {combination_count}/{total_combinations} combinations tested")
-                        
-                        # Test this specific combination of peaks
-                        comb_results = _perform_fitting_detailed(two_theta, baseline_corrected_intensity,
-                                                     peak_combination_list, known_amorp_peaks, peak_data,
-                                                     height_width_threshold, with_crystalline=True)
-                        
-                        # Store results for this combination
-                        combination_key = "-".join(str(pos) for pos in peak_combination)
-                        combination_results[combination_key] = {
-                            "peaks": peak_combination_list,
-                            "r_squared": comb_results['r_squared'],
-                            "crystallinity": comb_results['crystallinity'],
-                            "model": comb_results
-                        }
-                        
-                        # Check if this combination has crystallinity
-                        has_crystallinity = comb_results['crystallinity'] > 0
-                        
-                        # Check if this is the best combination so far
-                        if has_crystallinity and comb_results['r_squared'] > best_combination_r2:
-                            best_combination_r2 = comb_results['r_squared']
-                            best_combination = peak_combination_list
-                            best_combination_results = comb_results
-                            
-                            # If it's also better than the min_r_squared threshold, mark it as promising
-                            if comb_results['r_squared'] >= min_r_squared:
-                                promising_combinations.append(peak_combination_list)
-                                print(f"  Found excellent combination: {peak_positions_str} "
-                                      f"with R² = {comb_results['r_squared']:.4f}, "
-                                      f"Crystallinity = {comb_results['crystallinity']:.2f}%")
-                        
-                    except Exception as e:
-                        print(f"  Error testing combination {peak_positions_str}: {str(e)}")
+                    # If it's also better than the min_r_squared threshold, mark it as promising
+                    if comb_results['r_squared'] >= min_r_squared:
+                        promising_combinations.append(peak_combination_list)
+                        logger.debug("  Found excellent combination: %s with R² = %.4f, Crystallinity = %.2f%%",
+                                     peak_positions_str, comb_results['r_squared'], comb_results['crystallinity'])
             
             # Store best combination result if we found one
             if best_combination_results is not None:
@@ -1826,13 +3468,18 @@ def fit_xrd_spectrum_detailed(two_theta, intensity, known_crys_peaks=None, known
                 # use it as our successful peaks set
                 if best_combination_r2 >= min_r_squared and (best_combination_r2 > best_individual_r2 or not successful_peaks):
                     successful_peaks = best_combination
-                    print(f"\n  Best peak combination {successful_peaks} with R² = {best_combination_r2:.4f} "
-                          f"selected for final model")
+                    logger.info(f"\n  Best peak combination {successful_peaks} with R² = {best_combination_r2:.4f} "
+                                f"selected for final model")
                     phase_success["combinations"] = True
             
             # Print summary of combinations tested
-            print(f"  Completed testing {total_combinations} peak combinations")
-            print(f"  Best combination: {best_combination} with R² = {best_combination_r2:.4f}")
+            skipped_by = f"'{selection}' selection"
+            if combination_search['stopped_by_budget']:
+                skipped_by += " and the budget"
+            logger.info(f"  Completed testing {combination_search['fits_run']} of {total_combinations} peak combinations "
+                        f"({combination_search['fits_skipped']} skipped by {skipped_by})")
+            logger.info(f"  Best combination: {best_combination} with R² = {best_combination_r2:.4f}")
+            collector.record(spectrum_id, 'Phase 2B', step_start, nfev["combinations"], phase_success["combinations"])
         
         # Fallback logic - if no peaks or combinations met our threshold but we have some promising ones
         if not successful_peaks:
@@ -1840,15 +3487,15 @@ def fit_xrd_spectrum_detailed(two_theta, intensity, known_crys_peaks=None, known
             if best_combination_r2 > best_individual_r2 and best_combination is not None:
                 local_improvement = best_combination_r2 - amorphous_results['r_squared']
                 if local_improvement > 0.05:  # Modest improvement threshold
-                    print(f"\n  No individual peaks met threshold, but best combination will be included")
+                    logger.info(f"\n  No individual peaks met threshold, but best combination will be included")
                     successful_peaks = best_combination
                     phase_success["combinations"] = True
             # Otherwise fall back to best individual peak if it exists
             elif best_individual_peak is not None:
                 local_improvement = peak_metrics.get(best_individual_peak, {}).get('local_r2_improvement', 0)
                 if local_improvement > 0.05:  # Modest local improvement
-                    print(f"\n  No peaks met overall R² threshold, but best peak at {best_individual_peak}° "
-                          f"with local R² improvement of +{local_improvement:.4f} will be included")
+                    logger.info(f"\n  No peaks met overall R² threshold, but best peak at {best_individual_peak}° "
+                                f"with local R² improvement of +{local_improvement:.4f} will be included")
                     successful_peaks = [best_individual_peak]
                     phase_success["individual_peaks"] = True
         
@@ -1858,19 +3505,22 @@ def fit_xrd_spectrum_detailed(two_theta, intensity, known_crys_peaks=None, known
             
         # Overall Phase 2 result
         if phase_success["individual_peaks"] or phase_success["combinations"]:
-            print(f"Phase 2: SUCCESSFUL - {len(successful_peaks)} crystalline peaks identified for final model")
+            logger.info(f"Phase 2: SUCCESSFUL - {len(successful_peaks)} crystalline peaks identified for final model")
         else:
-            print("Phase 2: FAILED - No significant crystalline peaks or combinations identified")
+            logger.info("Phase 2: FAILED - No significant crystalline peaks or combinations identified")
     else:
-        print("\nPhase 2: SKIPPED - No known crystalline peaks provided")
+        logger.info("\nPhase 2: SKIPPED - No known crystalline peaks provided")
     
     # PHASE 3: Final combined fit if we found any successful peaks
     if successful_peaks:
-        print(f"\nPhase 3: Performing final combined fit with {len(successful_peaks)} crystalline peaks...")
+        logger.info(f"\nPhase 3: Performing final combined fit with {len(successful_peaks)} crystalline peaks...")
+        step_start = time.perf_counter()
         try:
             combined_results = _perform_fitting_detailed(two_theta, baseline_corrected_intensity,
                                              successful_peaks, known_amorp_peaks, peak_data,
-                                             height_width_threshold, with_crystalline=True)
+                                             height_width_threshold, with_crystalline=True,
+                                             solver=solver, warm_start=param_cache, context=context)
+            nfev["combined"] += combined_results['nfev']
             
             # Store combined results
             fitting_results["combined"] = {
@@ -1881,17 +3531,18 @@ def fit_xrd_spectrum_detailed(two_theta, intensity, known_crys_peaks=None, known
             
             # Check if combined fit is successful
             if combined_results['r_squared'] >= min_r_squared:
-                print(f"Phase 3: SUCCESSFUL - Combined fit with R² = {combined_results['r_squared']:.4f}, "
-                      f"Crystallinity = {combined_results['crystallinity']:.2f}%")
+                logger.info(f"Phase 3: SUCCESSFUL - Combined fit with R² = {combined_results['r_squared']:.4f}, "
+                            f"Crystallinity = {combined_results['crystallinity']:.2f}%")
                 phase_success["combined"] = True
                 best_fit = combined_results
                 best_fit_name = f"Combined ({len(successful_peaks)} Peaks)"
             else:
-                print(f"Phase 3: INSUFFICIENT - Combined fit with R² = {combined_results['r_squared']:.4f} < {min_r_squared:.4f}")
+                logger.info(f"Phase 3: INSUFFICIENT - Combined fit with R² = {combined_results['r_squared']:.4f} < {min_r_squared:.4f}")
         except Exception as e:
-            print(f"Phase 3: ERROR - {str(e)}")
+            logger.warning(f"Phase 3: ERROR - {str(e)}")
+        collector.record(spectrum_id, 'Phase 3', step_start, nfev["combined"], phase_success["combined"])
     else:
-        print("\nPhase 3: SKIPPED - No successful crystalline peaks to combine")
+        logger.info("\nPhase 3: SKIPPED - No successful crystalline peaks to combine")
     
     # --- Step 7: Select Best Model ---
     # If we haven't already selected a best fit, find the one with highest R²
@@ -1910,11 +3561,39 @@ def fit_xrd_spectrum_detailed(two_theta, intensity, known_crys_peaks=None, known
         # Fallback to amorphous-only if nothing else was successful
         best_fit = amorphous_results
         best_fit_name = "Amorphous Only (Default)"
+    
+    # Refit the selected model at full resolution, starting from its decimated parameters
+    two_theta, baseline_corrected_intensity = full_two_theta, full_intensity
+    multi_resolution = None
+    if decimation > 1:
+        step_start = time.perf_counter()
+        coarse_fit = best_fit
+        best_fit = _perform_fitting_detailed(two_theta, baseline_corrected_intensity,
+                                     coarse_fit['fit_known_crys_peaks'], known_amorp_peaks, peak_data,
+                                     height_width_threshold, with_crystalline=coarse_fit['with_crystalline'],
+                                     solver=solver, warm_start=dict(coarse_fit['fitted_components']),
+                                     context=context)
+        nfev["polish"] = best_fit['nfev']
+        collector.record(spectrum_id, 'polish', step_start, nfev["polish"], best_fit['r_squared'] >= min_r_squared)
+        multi_resolution = {
+            'decimation': decimation,
+            'decimated_points': len(coarse_fit['total_fit']),
+            'decimated_crystallinity': coarse_fit['crystallinity'],
+            'decimated_r_squared': coarse_fit['r_squared'],
+            'crystallinity_change': best_fit['crystallinity'] - coarse_fit['crystallinity'],
+        }
+        logger.info(f"\nFull-resolution polish of {best_fit_name}: Crystallinity = {best_fit['crystallinity']:.2f}% "
+                    f"(decimated {coarse_fit['crystallinity']:.2f}%), {nfev['polish']} model evaluations")
         
-    print(f"\nSelected {best_fit_name} model with R² = {best_fit['r_squared']:.4f}")
+    logger.info(f"\nSelected {best_fit_name} model with R² = {best_fit['r_squared']:.4f}")
+    nfev["total"] = sum(nfev.values())
+    logger.info(f"Model evaluations: {nfev['total']} (amorphous {nfev['amorphous']}, "
+                f"individual peaks {nfev['individual_peaks']}, combinations {nfev['combinations']}, "
+                f"combined {nfev['combined']})")
     
     # --- Step 8: Visualization ---
     if visualise:
+        step_start = time.perf_counter()
         # Create a 2-panel figure: Peak Detection + Best Fit
         plt.figure(figsize=(12, 9))
         
@@ -2019,6 +3698,7 @@ def fit_xrd_spectrum_detailed(two_theta, intensity, known_crys_peaks=None, known
 
         plt.tight_layout()
         plt.show()
+        collector.record(spectrum_id, 'plotting', step_start)
     
     # --- Step 9: Return Results ---
     # Add additional information to the best fit results
@@ -2026,6 +3706,7 @@ def fit_xrd_spectrum_detailed(two_theta, intensity, known_crys_peaks=None, known
         'normalized_intensity': normalized_intensity,
         'smoothed_intensity': smoothed_intensity,
         'baseline_level': baseline_level,
+        'baseline': baseline_curve,
         'baseline_corrected_intensity': baseline_corrected_intensity,
         'signal_to_noise': snr,
         'is_mostly_amorphous': is_mostly_amorphous,
@@ -2034,11 +3715,679 @@ def fit_xrd_spectrum_detailed(two_theta, intensity, known_crys_peaks=None, known
         'selected_model': best_fit_name,
         'successful_peaks': successful_peaks,
         'peak_metrics': peak_metrics,
-        'combination_results': combination_results if 'combination_results' in locals() else {}
+        'combination_results': combination_results if 'combination_results' in locals() else {},
+        'combination_search': combination_search,
+        'phase_nfev': nfev,
+        'multi_resolution': multi_resolution,
+        'budget': budget.summary(),
+        'budget_limited': budget.exhausted_in is not None
     })
     
-    # --- Clear class variable when done ---
-    if hasattr(fit_xrd_spectrum_detailed, '_all_known_crys_peaks'):
-        delattr(fit_xrd_spectrum_detailed, '_all_known_crys_peaks')
-    
     return best_fit
+
+
+# Engine name -> (fitting helper, driver), used to dispatch fits inside pool workers
+_FITTING_ENGINES = {
+    'fast': (_perform_fitting_fast, fit_xrd_spectrum_fast),
+    'detailed': (_perform_fitting_detailed, fit_xrd_spectrum_detailed),
+}
+
+
+def compare_decimation_factors(two_theta, intensity, decimations=(2, 3, 5), engine='fast', **fit_kwargs):
+    """
+    Fit one spectrum at full resolution and in multi-resolution mode with each decimation
+    factor, to choose a factor that does not change the crystallinity noticeably.
+    
+    Parameters:
+    -----------
+    two_theta, intensity : array-like
+        The spectrum, as passed to fit_xrd_spectrum_fast / fit_xrd_spectrum_detailed
+    decimations : sequence of int, default=(2, 3, 5)
+        Decimation factors to compare with the full-resolution fit
+    engine : {'fast', 'detailed'}, default='fast'
+        Fitting driver to use
+    **fit_kwargs
+        Other driver arguments (known peaks, thresholds, ...); visualise is turned off
+        
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per decimation factor (1 = full resolution) with the number of points
+        fitted in Phases 1-3, crystallinity, its difference from the full-resolution
+        value, R², selected model, model evaluations and wall time
+    """
+    if engine not in _FITTING_ENGINES:
+        raise ValueError(f"engine must be one of {tuple(_FITTING_ENGINES)}, got {engine!r}")
+    _, driver = _FITTING_ENGINES[engine]
+    fit_kwargs = {**fit_kwargs, 'visualise': False}
+    
+    rows = []
+    for decimation in (1,) + tuple(d for d in decimations if d != 1):
+        start = time.perf_counter()
+        with _quiet_logging():
+            results = driver(two_theta, intensity, decimation=decimation, **fit_kwargs)
+        rows.append({
+            'decimation': decimation,
+            'points': len(np.asarray(two_theta)[::decimation]),
+            'crystallinity': results['crystallinity'],
+            'r_squared': results['r_squared'],
+            'selected_model': results['selected_model'],
+            'nfev': results['phase_nfev']['total'],
+            'time_s': time.perf_counter() - start,
+        })
+    
+    table = pd.DataFrame(rows)
+    table.insert(3, 'crystallinity_difference', table['crystallinity'] - table['crystallinity'].iloc[0])
+    logger.info(table.to_string(index=False, float_format=lambda value: f"{value:.4g}"))
+    return table
+
+
+# Measurement temperature in heated-stage file names, e.g. PEEK500907_250C_1.csv or HDPE_31C_after_1.csv;
+# '_after' marks a scan taken once the sample had cooled down again at the end of the heating run
+_TEMPERATURE_PATTERN = re.compile(r'_(-?\d+(?:\.\d+)?)C(?:_|\.|$)')
+_COOLED_PATTERN = re.compile(r'_after(?:_|\.|$)')
+
+
+def _file_temperature(path):
+    """Temperature in °C encoded in a heated-stage file name"""
+    match = _TEMPERATURE_PATTERN.search(os.path.basename(path))
+    if match is None:
+        raise ValueError(f"No temperature found in file name {os.path.basename(path)!r}")
+    return float(match.group(1))
+
+
+def fit_xrd_series(paths, known_crys_peaks, temperatures=None, engine='detailed', common_config=None,
+                   two_theta_range=(10, 40), cache_dir=None, max_peak_shift=0.4, verbose=False):
+    """
+    Fit the spectra of one sample measured at different temperatures in order of
+    temperature, starting each fit from the previous one.
+    
+    The first spectrum is fitted with known_crys_peaks. For every later spectrum the
+    known crystalline positions are the centres fitted at the previous temperature, so
+    the thermal drift of the reflections is followed instead of being set by hand for
+    each file. The amorphous-only and single-peak fits start from the previous
+    amorphous-only fit and selected model (the drivers' warm_start dict). A position is
+    only moved when the selected model of the previous spectrum contains that peak
+    within max_peak_shift of it.
+    
+    Parameters:
+    -----------
+    paths : str or list of str
+        CSV file paths, or a directory whose *.csv files are all fitted
+    known_crys_peaks : list
+        Known crystalline peak positions at the lowest temperature
+    temperatures : list of float or None, optional
+        Temperature of each file in °C. None reads it from file names such as
+        PEEK500907_250C_1.csv. Files marked '_after' (measured after cooling back down)
+        are fitted after the heating run; files at equal temperatures keep their input order
+    engine : {'detailed', 'fast'}, default='detailed'
+        Which fitting driver to use
+    common_config : dict, optional
+        Other fit arguments shared by all spectra (known_amorp_peaks, thresholds, ...).
+        known_crys_peaks and warm_start are set by the series and cannot be given here
+    two_theta_range : tuple, default=(10, 40)
+        2θ window in degrees used for fitting
+    cache_dir : str or None, optional
+        Directory for the parsed-file cache of xrd_io.read_xrd_csv. None disables caching
+    max_peak_shift : float, default=0.4
+        Largest shift in degrees of a tracked peak between neighbouring temperatures.
+        Keep it below the ±0.5° centre bounds of crystalline peaks, so that a centre
+        which stopped at its bound is not followed
+    verbose : bool, default=False
+        Whether to show the fitting progress messages of each spectrum
+        
+    Returns:
+    --------
+    list of dict
+        Per-spectrum summaries in temperature order, with the fields of fit_xrd_batch
+        plus 'temperature', 'known_crys_peaks' (positions used for that fit) and
+        'peak_drift' (shift of each tracked peak from known_crys_peaks)
+    """
+    if engine not in _FITTING_ENGINES:
+        raise ValueError(f"engine must be one of {tuple(_FITTING_ENGINES)}, got {engine!r}")
+    
+    if isinstance(paths, str) and os.path.isdir(paths):
+        paths = [os.path.join(paths, f) for f in sorted(os.listdir(paths)) if f.endswith('.csv')]
+    if temperatures is None:
+        temperatures = [_file_temperature(path) for path in paths]
+    if len(temperatures) != len(paths):
+        raise ValueError(f"Got {len(temperatures)} temperatures for {len(paths)} files")
+    order = sorted(range(len(paths)), key=lambda i: (_COOLED_PATTERN.search(os.path.basename(paths[i])) is not None,
+                                                     temperatures[i]))
+    
+    reserved = sorted({'known_crys_peaks', 'warm_start'} & set(common_config or {}))
+    if reserved:
+        raise ValueError(f"common_config cannot set {', '.join(reserved)}: fit_xrd_series sets them for every "
+                         f"spectrum (pass the starting positions as known_crys_peaks)")
+    
+    driver = _FITTING_ENGINES[engine][1]
+    config = dict(common_config or {})
+    config.update(visualise=False)
+    
+    tracked_peaks = list(known_crys_peaks)
+    seed = None
+    series = []
+    for i in order:
+        path = paths[i]
+        start = time.perf_counter()
+        summary = {'file': os.path.basename(path), 'path': path, 'temperature': temperatures[i],
+                   'known_crys_peaks': list(tracked_peaks), 'error': None}
+        try:
+            two_theta, intensity = _load_xrd_spectrum(path, two_theta_range, cache_dir)
+            with _quiet_logging(not verbose):
+                results = driver(two_theta, intensity, known_crys_peaks=list(tracked_peaks),
+                                 warm_start=seed if seed else False, **config)
+            summary.update(_summarise_fit(results))
+            
+            # Carry the converged components over, moving each tracked peak to its fitted
+            # centre; peaks the selected model left out keep their previous values
+            fitted = results['fitted_components']
+            previous = seed or {}
+            seed = {key: np.array(params) for key, params
+                    in results['all_models']['amorphous']['model']['fitted_components'].items()}
+            for j, pos in enumerate(tracked_peaks):
+                params = fitted.get(('crystalline', pos))
+                if params is not None and abs(params[1] - pos) <= max_peak_shift:
+                    tracked_peaks[j] = round(float(params[1]), 3)
+                    seed[('crystalline', tracked_peaks[j])] = np.array(params)
+                elif ('crystalline', pos) in previous:
+                    seed[('crystalline', pos)] = previous[('crystalline', pos)]
+        except Exception as e:
+            summary.update({'crystallinity': np.nan, 'r_squared': np.nan, 'error': str(e)})
+        summary['peak_drift'] = [tracked - initial for tracked, initial in zip(tracked_peaks, known_crys_peaks)]
+        summary['elapsed_s'] = time.perf_counter() - start
+        series.append(summary)
+    
+    return series
+
+
+def _load_xrd_spectrum(path, two_theta_range=(10, 40), cache_dir=None):
+    """
+    Read a diffractometer CSV export and return (two_theta, normalised intensity) within
+    two_theta_range, in the same way as the analysis notebooks.
+    """
+    scan = read_xrd_csv(path, two_theta_range=two_theta_range, cache_dir=cache_dir)
+    return scan['two_theta'], scan['intensity'] / np.max(scan['intensity'])
+
+
+def _summarise_fit(results):
+    """
+    Reduce a full fit result to the per-sample numbers needed for a crystallinity campaign,
+    leaving out the fitted curves, residuals and intermediate models.
+    """
+    return {
+        'crystallinity': results['crystallinity'],
+        'r_squared': results['r_squared'],
+        'rmse': results['rmse'],
+        'selected_model': results['selected_model'],
+        'successful_peaks': list(results['successful_peaks']),
+        'crystalline_params': np.asarray(results['crystalline_params'], dtype=float),
+        'amorphous_params': np.asarray(results['amorphous_params'], dtype=float),
+        'signal_to_noise': results['signal_to_noise'],
+        'phase_nfev': dict(results['phase_nfev']),
+        'fit_strategy': results['fit_strategy'],
+        'budget_limited': results['budget_limited'],
+    }
+
+
+def _fit_xrd_file(path, engine, config, two_theta_range, cache_dir, verbose, n_boot=0):
+    """
+    Read and fit one diffractometer file without plotting, with a bootstrap confidence
+    interval of the crystallinity if n_boot > 0. Runs in the calling process or in a pool
+    worker and returns a compact summary; errors are reported in the summary.
+    """
+    start = time.perf_counter()
+    summary = {'file': os.path.basename(path), 'path': path, 'error': None}
+    try:
+        two_theta, intensity = _load_xrd_spectrum(path, two_theta_range, cache_dir)
+        driver = _FITTING_ENGINES[engine][1]
+        with _quiet_logging(not verbose):
+            results = driver(two_theta, intensity, **config)
+        summary.update(_summarise_fit(results))
+        if n_boot:
+            uncertainty = crystallinity_uncertainty(two_theta, intensity, config, n_boot=n_boot,
+                                                    engine=engine, results=results)
+            summary.update({'crystallinity_ci': (uncertainty['ci_lower'], uncertainty['ci_upper']),
+                            'crystallinity_std': uncertainty['std']})
+    except Exception as e:
+        summary.update({'crystallinity': np.nan, 'r_squared': np.nan, 'error': str(e)})
+    summary['elapsed_s'] = time.perf_counter() - start
+    return summary
+
+
+def fit_xrd_batch(paths, per_sample_config=None, n_workers=None, engine='detailed',
+                  common_config=None, two_theta_range=(10, 40), cache_dir=None, verbose=False, n_boot=0):
+    """
+    Fit a set of diffractometer CSV files and yield a compact summary for each sample.
+    
+    Each file is read, restricted to two_theta_range, normalised and fitted with
+    fit_xrd_spectrum_fast or fit_xrd_spectrum_detailed without plotting. With n_workers > 1
+    the files are fitted in a process pool and summaries are yielded as soon as each
+    sample finishes, so the order follows completion rather than the input order.
+    
+    Parameters:
+    -----------
+    paths : str or list of str
+        CSV file paths, or a directory whose *.csv files are all fitted
+    per_sample_config : dict or callable, optional
+        Fit arguments per sample, either a dict keyed by file name (e.g.
+        {'HDPE_50C_1.csv': {'known_crys_peaks': [...], ...}}) or a function taking the
+        file name and returning such a dict
+    n_workers : int or None, default=None
+        Number of worker processes. None or 1 fits the files one after another
+    engine : {'detailed', 'fast'}, default='detailed'
+        Which fitting driver to use
+    common_config : dict, optional
+        Fit arguments shared by all samples; per-sample values take precedence
+    two_theta_range : tuple, default=(10, 40)
+        2θ window in degrees used for fitting
+    cache_dir : str or None, optional
+        Directory for the parsed-file cache of xrd_io.read_xrd_csv. None disables caching
+    verbose : bool, default=False
+        Whether to show the fitting progress messages of each sample
+    n_boot : int, default=0
+        Number of bootstrap refits per sample for a 95% confidence interval of the
+        crystallinity (see crystallinity_uncertainty). 0 skips the bootstrap
+        
+    Yields:
+    -------
+    dict
+        Per-sample summary with 'file', 'path', 'crystallinity', 'r_squared', 'rmse',
+        'selected_model', 'successful_peaks', 'crystalline_params', 'amorphous_params',
+        'signal_to_noise', 'phase_nfev', 'fit_strategy', 'budget_limited', 'elapsed_s' and 'error'
+        (None on success), plus 'crystallinity_ci' and 'crystallinity_std' if n_boot > 0
+    """
+    if engine not in _FITTING_ENGINES:
+        raise ValueError(f"engine must be one of {tuple(_FITTING_ENGINES)}, got {engine!r}")
+    
+    if isinstance(paths, str) and os.path.isdir(paths):
+        paths = [os.path.join(paths, f) for f in sorted(os.listdir(paths)) if f.endswith('.csv')]
+    
+    def sample_config(path):
+        file = os.path.basename(path)
+        if callable(per_sample_config):
+            specific = per_sample_config(file) or {}
+        else:
+            specific = (per_sample_config or {}).get(file, {})
+        config = dict(common_config or {}, **specific)
+        # Plots cannot be shown from workers, and the samples already share the pool
+        config.update(visualise=False, n_workers=None)
+        return config
+    
+    tasks = [(path, engine, sample_config(path), two_theta_range, cache_dir, verbose, n_boot) for path in paths]
+    
+    if n_workers is None or n_workers <= 1 or len(tasks) < 2:
+        for task in tasks:
+            yield _fit_xrd_file(*task)
+        return
+    
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(_fit_xrd_file, *task) for task in tasks]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+# Shifts in degrees tried for each reference crystalline position, in the 0.1° steps of hand tuning
+_CALIBRATION_SHIFTS = tuple(round(0.1 * i, 1) for i in range(-7, 8))
+
+
+def _score_peak_list(engine, two_theta, intensity, known_crys_peaks, config):
+    """
+    Fit one spectrum with one candidate list of crystalline peak positions and return the
+    numbers kept in a calibration score surface. Runs in the calling process or in a pool
+    worker; errors are reported in the result.
+    """
+    driver = _FITTING_ENGINES[engine][1]
+    try:
+        with _quiet_logging():
+            results = driver(two_theta, intensity, known_crys_peaks=list(known_crys_peaks), **config)
+        return {'r_squared': results['r_squared'], 'crystallinity': results['crystallinity'],
+                'selected_model': results['selected_model'], 'nfev': results['phase_nfev']['total'],
+                'error': None}
+    except Exception as e:
+        return {'r_squared': np.nan, 'crystallinity': np.nan, 'selected_model': None, 'nfev': 0,
+                'error': str(e)}
+
+
+def _best_calibration_row(rows, tolerance):
+    """
+    Highest-R² row of a score surface. Rows within tolerance of the best R² count as ties,
+    which go to the smallest total shift from the reference positions.
+    """
+    scored = [row for row in rows if np.isfinite(row['r_squared'])]
+    if not scored:
+        return None
+    best_r2 = max(row['r_squared'] for row in scored)
+    return min((row for row in scored if row['r_squared'] >= best_r2 - tolerance),
+               key=lambda row: row['total_shift'])
+
+
+def calibrate_crystalline_peaks(paths, ref_peaks, per_sample_config=None, shifts=_CALIBRATION_SHIFTS,
+                                per_peak=True, tolerance=5e-4, n_workers=None, engine='detailed',
+                                common_config=None, two_theta_range=(10, 40), cache_dir=None):
+    """
+    Find, for each sample, the shifts of the reference crystalline peak positions that give
+    the best fit, replacing the hand tuning of known_crys_peaks file by file.
+    
+    Every candidate list is scored by the R² of the model selected by a full fit. The search
+    first shifts all reference positions together by each value in shifts, then (with
+    per_peak) shifts each position of the best list on its own, and finally fits the list
+    combining the best shift of every position. Candidates whose R² is within tolerance of
+    the best count as ties, which go to the list closest to the reference positions.
+    
+    Each spectrum is preprocessed once; with n_workers > 1 the fits of all samples run in
+    one process pool whose workers start with those preprocessing results.
+    
+    Parameters:
+    -----------
+    paths : str or list of str
+        CSV file paths, or a directory whose *.csv files are all calibrated
+    ref_peaks : list or callable
+        Reference crystalline peak positions, or a function taking the file name and
+        returning them (e.g. lambda file: ref_peak_dict['HDPE' if 'HDPE' in file else 'PEEK'])
+    per_sample_config : dict or callable, optional
+        Other fit arguments per sample, as in fit_xrd_batch. Their known_crys_peaks and
+        warm_start entries are ignored, as the calibration sets the peak positions itself
+    shifts : sequence of float, default=-0.7 to 0.7 in steps of 0.1
+        Shifts in degrees tried for the reference positions
+    per_peak : bool, default=True
+        Whether to refine the best common shift peak by peak. Costs one fit per peak and
+        non-zero shift on top of one fit per shift
+    tolerance : float, default=5e-4
+        R² difference below which two candidate lists count as equally good. Small shifts
+        of the positions typically change R² by a few 1e-4 without a better model, so
+        such differences do not move the peaks away from the reference
+    n_workers : int or None, default=None
+        Number of worker processes. None or 1 runs the fits one after another
+    engine : {'detailed', 'fast'}, default='detailed'
+        Which fitting driver to use
+    common_config : dict, optional
+        Fit arguments shared by all samples; per-sample values take precedence
+    two_theta_range : tuple, default=(10, 40)
+        2θ window in degrees used for fitting
+    cache_dir : str or None, optional
+        Directory for the parsed-file cache of xrd_io.read_xrd_csv. None disables caching
+        
+    Returns:
+    --------
+    dict
+        Per file name: 'known_crys_peaks' (best positions), 'shifts' (from the reference
+        positions), 'r_squared', 'crystallinity' and 'selected_model' of the best fit, and
+        'score_surface', a DataFrame with one row per candidate list fitted. 'stage' is
+        'all', 'peak' or 'combined'; 'peak' is the reference position moved alone and
+        'shift' the shift of the moved positions from the reference
+    """
+    if engine not in _FITTING_ENGINES:
+        raise ValueError(f"engine must be one of {tuple(_FITTING_ENGINES)}, got {engine!r}")
+    
+    if isinstance(paths, str) and os.path.isdir(paths):
+        paths = [os.path.join(paths, f) for f in sorted(os.listdir(paths)) if f.endswith('.csv')]
+    
+    # Read and preprocess every spectrum once
+    samples = {}
+    preprocessed_entries = []
+    for path in paths:
+        file = os.path.basename(path)
+        if callable(per_sample_config):
+            specific = per_sample_config(file) or {}
+        else:
+            specific = (per_sample_config or {}).get(file, {})
+        config = dict(common_config or {}, **specific)
+        config.update(visualise=False, n_workers=None)
+        for name in ('known_crys_peaks', 'warm_start'):
+            config.pop(name, None)
+        
+        two_theta, intensity = _load_xrd_spectrum(path, two_theta_range, cache_dir)
+        preprocessing = (config.get('min_prominence', 0.008), config.get('baseline_method', 'minimum'),
+                         config.get('baseline_lam', 100.0))
+        preprocessed_entries.append((_preprocessing_key(two_theta, intensity, *preprocessing),
+                                     preprocess_xrd_spectrum(two_theta, intensity, *preprocessing)))
+        reference = list(ref_peaks(file) if callable(ref_peaks) else ref_peaks)
+        samples[file] = {'two_theta': two_theta, 'intensity': intensity, 'config': config,
+                         'reference': reference, 'rows': []}
+    
+    parallel = n_workers is not None and n_workers > 1
+    executor = (ProcessPoolExecutor(max_workers=n_workers, initializer=_seed_preprocessing_cache,
+                                    initargs=(preprocessed_entries,)) if parallel else contextlib.nullcontext())
+    
+    with executor as pool:
+        
+        def evaluate(candidates):
+            """Fit (file, stage, peak, shift, positions) candidates and add them to the score surfaces"""
+            if not candidates:
+                return
+            tasks = [(engine, samples[file]['two_theta'], samples[file]['intensity'], positions,
+                      samples[file]['config']) for file, _, _, _, positions in candidates]
+            if pool is None:
+                scores = [_score_peak_list(*task) for task in tasks]
+            else:
+                scores = list(pool.map(_score_peak_list, *zip(*tasks)))
+            for (file, stage, peak, shift, positions), score in zip(candidates, scores):
+                total_shift = sum(abs(pos - ref) for pos, ref in zip(positions, samples[file]['reference']))
+                samples[file]['rows'].append({'stage': stage, 'peak': peak, 'shift': shift,
+                                              'known_crys_peaks': list(positions),
+                                              'total_shift': round(total_shift, 3), **score})
+        
+        # Stage 1: all reference positions shifted together
+        evaluate([(file, 'all', None, shift, [round(pos + shift, 3) for pos in sample['reference']])
+                  for file, sample in samples.items() for shift in shifts])
+        
+        # Stage 2: each position of the best common shift moved on its own
+        if per_peak:
+            bases = {file: _best_calibration_row(sample['rows'], tolerance) for file, sample in samples.items()}
+            candidates = []
+            for file, base in bases.items():
+                if base is None:
+                    continue
+                for j, ref in enumerate(samples[file]['reference']):
+                    for shift in shifts:
+                        if shift == 0:
+                            continue
+                        positions = list(base['known_crys_peaks'])
+                        positions[j] = round(positions[j] + shift, 3)
+                        candidates.append((file, 'peak', ref, round(positions[j] - ref, 3), positions))
+            evaluate(candidates)
+            
+            # Stage 3: the best position of every peak together
+            combined = []
+            for file, base in bases.items():
+                if base is None:
+                    continue
+                sample = samples[file]
+                positions = []
+                for j, ref in enumerate(sample['reference']):
+                    alone = [row for row in sample['rows'] if row['stage'] == 'peak' and row['peak'] == ref]
+                    positions.append(_best_calibration_row(alone + [base], tolerance)['known_crys_peaks'][j])
+                if all(positions != row['known_crys_peaks'] for row in sample['rows']):
+                    combined.append((file, 'combined', None, np.nan, positions))
+            evaluate(combined)
+    
+    calibration = {}
+    for file, sample in samples.items():
+        best = _best_calibration_row(sample['rows'], tolerance)
+        surface = pd.DataFrame(sample['rows'])
+        if best is None:
+            calibration[file] = {'known_crys_peaks': None, 'shifts': None, 'r_squared': np.nan,
+                                 'crystallinity': np.nan, 'selected_model': None, 'score_surface': surface}
+            continue
+        calibration[file] = {
+            'known_crys_peaks': best['known_crys_peaks'],
+            'shifts': [round(pos - ref, 3) for pos, ref in zip(best['known_crys_peaks'], sample['reference'])],
+            'r_squared': best['r_squared'],
+            'crystallinity': best['crystallinity'],
+            'selected_model': best['selected_model'],
+            'score_surface': surface,
+        }
+    
+    return calibration
+
+
+def _bootstrap_refits(engine, two_theta, total_fit, residuals, fit_kwargs, seeds, block_size):
+    """
+    Refit the selected model to its fitted curve plus resampled residuals, once per seed,
+    and return the crystallinities. A refit that raises, or whose fits all failed so that
+    it only reports its initial guess, gives NaN. Runs in the calling process or in a
+    pool worker.
+    """
+    perform_fitting = _FITTING_ENGINES[engine][0]
+    num_points = len(residuals)
+    block_size = min(block_size, num_points)
+    num_blocks = -(-num_points // block_size)
+    offsets = np.arange(block_size)
+    
+    crystallinities = []
+    for seed in seeds:
+        # Moving-block resampling keeps the correlation that smoothing leaves in the residuals
+        rng = np.random.default_rng(seed)
+        starts = rng.integers(0, num_points - block_size + 1, size=num_blocks)
+        resampled = residuals[(starts[:, None] + offsets).ravel()[:num_points]]
+        try:
+            with _quiet_logging():
+                refit = perform_fitting(two_theta, total_fit + resampled, **fit_kwargs)
+            if refit['fit_strategy'] == 'initial_guess':
+                # Every fit failed: the crystallinity of the unfitted guess is not a bootstrap sample
+                crystallinities.append(np.nan)
+            else:
+                crystallinities.append(refit['crystallinity'])
+        except Exception:
+            crystallinities.append(np.nan)
+    return crystallinities
+
+
+def crystallinity_uncertainty(two_theta, intensity, config=None, n_boot=200, confidence=0.95,
+                              engine='detailed', block_size=15, n_workers=None, seed=0, results=None,
+                              ftol=None):
+    """
+    Bootstrap confidence interval of the crystallinity from a fit of one spectrum.
+    
+    The spectrum is fitted once with config, then only the selected model is refitted to
+    its fitted curve plus residuals resampled in blocks of block_size points, starting
+    from the converged parameters. The model selection is not repeated, so the interval
+    covers the noise and fit uncertainty of the chosen model, not the choice of peaks.
+    
+    Warm starts are clipped to the bounds of each component, so a model found by one of
+    the unbounded fallback fits cannot be restarted from its own parameters. The refit
+    of the original data is checked first, and such models are refitted from the
+    peak-detection guesses instead.
+    
+    Parameters:
+    -----------
+    two_theta : array-like
+        Array of 2θ angles in degrees
+    intensity : array-like
+        Array of corresponding intensity values
+    config : dict, optional
+        Fit arguments of fit_xrd_spectrum_fast or fit_xrd_spectrum_detailed
+        (known_crys_peaks, known_amorp_peaks, thresholds, solver, ...)
+    n_boot : int, default=200
+        Number of bootstrap refits
+    confidence : float, default=0.95
+        Coverage of the percentile confidence interval
+    engine : {'detailed', 'fast'}, default='detailed'
+        Which fitting driver and fitting routine to use
+    block_size : int, default=15
+        Length in points of the resampled residual blocks. Residuals of the smoothed
+        spectrum are correlated over at least the 15-point smoothing window
+    n_workers : int or None, default=None
+        Number of worker processes for the refits. None or 1 runs them one after another;
+        the result does not depend on the number of workers
+    seed : int, default=0
+        Seed of the resampling
+    results : dict, optional
+        Output of the fitting driver for this spectrum and config, which is then not fitted again
+    ftol : float or None, default=None
+        Relative change in the sum of squares at which each warm-started refit stops. None
+        keeps the solver's own tolerance. A looser value shortens the refits but can move
+        individual crystallinities by more than a point, so the warm-start check of the
+        original data runs at the same tolerance, and if it misses the refits start from
+        the peak-detection guesses at the solver's own tolerance instead
+        
+    Returns:
+    --------
+    dict
+        'crystallinity' of the original fit, 'ci_lower' and 'ci_upper' bounds, bootstrap
+        'std', 'confidence', 'n_boot', 'n_failed' (refits that raised or whose fits all
+        failed, left out of the interval) and the bootstrap 'samples' (NaN for failed
+        refits), 'warm_start' (whether the refits started from the converged parameters)
+        and 'reproduced' (whether a refit of the original data gave the same crystallinity)
+    """
+    if engine not in _FITTING_ENGINES:
+        raise ValueError(f"engine must be one of {tuple(_FITTING_ENGINES)}, got {engine!r}")
+    if not 0 < confidence < 1:
+        raise ValueError(f"confidence must be between 0 and 1, got {confidence}")
+    
+    config = dict(config or {})
+    config.update(visualise=False)
+    driver = _FITTING_ENGINES[engine][1]
+    if results is None:
+        with _quiet_logging():
+            results = driver(np.asarray(two_theta), np.asarray(intensity), **config)
+    
+    # Refit arguments of the selected model, with the driver defaults where config has none
+    defaults = {name: parameter.default for name, parameter in inspect.signature(driver).parameters.items()}
+    settings = dict(defaults, **config)
+    two_theta = np.asarray(two_theta)
+    peak_data = preprocess_xrd_spectrum(two_theta, intensity, settings['min_prominence'], settings['baseline_method'],
+                                        settings['baseline_lam'])['peak_data']
+    fit_kwargs = {
+        'known_crys_peaks': results['fit_known_crys_peaks'],
+        'known_amorp_peaks': settings['known_amorp_peaks'],
+        'peak_data': peak_data,
+        'height_width_threshold': settings['height_width_threshold'],
+        'with_crystalline': results['with_crystalline'],
+        'solver': settings['solver'],
+        'context': _FittingContext(settings['known_crys_peaks'], backend=settings['backend'],
+                                   **{name: settings[name] for name in ('fallback_strategies', 'fallback_selection',
+                                                                        'fallback_max_nfev') if name in settings}),
+    }
+    
+    perform_fitting = _FITTING_ENGINES[engine][0]
+    reproduced = False
+    # Cold refits start far from the optimum and keep the solver's own tolerance
+    for warm_start, tolerance in ((dict(results['fitted_components']), ftol), (None, None)):
+        with _quiet_logging():
+            check = perform_fitting(two_theta, np.asarray(results['baseline_corrected_intensity']),
+                                    warm_start=warm_start, ftol=tolerance, **fit_kwargs)
+        if abs(check['crystallinity'] - results['crystallinity']) < 0.01:
+            reproduced = True
+            break
+    if not reproduced:
+        logger.warning(f"Refitting the selected model gives {check['crystallinity']:.2f}% instead of "
+                       f"{results['crystallinity']:.2f}%; the interval may not describe the reported value")
+    fit_kwargs.update(warm_start=warm_start, ftol=tolerance)
+    total_fit = np.asarray(results['total_fit'])
+    residuals = np.asarray(results['residuals'])
+    residuals = residuals - residuals.mean()
+    
+    # One seed per refit, so the samples do not depend on how the refits are split up
+    seeds = np.random.SeedSequence(seed).spawn(n_boot)
+    if n_workers is None or n_workers <= 1 or n_boot < 2:
+        samples = _bootstrap_refits(engine, two_theta, total_fit, residuals, fit_kwargs, seeds, block_size)
+    else:
+        chunks = [list(chunk) for chunk in np.array_split(np.arange(n_boot), n_workers) if len(chunk)]
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(_bootstrap_refits, engine, two_theta, total_fit, residuals, fit_kwargs,
+                                       [seeds[i] for i in chunk], block_size) for chunk in chunks]
+            samples = [value for future in futures for value in future.result()]
+    
+    samples = np.asarray(samples, dtype=float)
+    n_failed = int(np.sum(~np.isfinite(samples)))
+    if n_failed == n_boot:
+        ci_lower = ci_upper = std = np.nan
+    else:
+        tail = 100 * (1 - confidence) / 2
+        ci_lower, ci_upper = np.nanpercentile(samples, [tail, 100 - tail])
+        std = np.nanstd(samples, ddof=1) if n_boot - n_failed > 1 else np.nan
+    
+    return {
+        'crystallinity': results['crystallinity'],
+        'ci_lower': ci_lower,
+        'ci_upper': ci_upper,
+        'std': std,
+        'confidence': confidence,
+        'n_boot': n_boot,
+        'n_failed': n_failed,
+        'samples': samples,
+        'warm_start': warm_start is not None,
+        'reproduced': reproduced,
+    }
@@ -0,0 +1,406 @@
+import os
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from xrd_algorithms import (MultiGaussianModel, numba, fit_xrd_spectrum_fast, fit_xrd_spectrum_detailed,
+                            clear_preprocessing_cache, _quiet_logging)
+from xrd_io import read_xrd_csv
+
+
+# Evaluation grids: (name, number of points, axis range). The XRD window is 10–40° 2θ
+# as cropped by the analysis notebooks; the DSC trace spans a typical heating run in °C
+_MODEL_GRIDS = (
+    ('XRD 10-40°', 2800, (10.0, 40.0)),
+    ('DSC trace', 4000, (25.0, 400.0)),
+)
+
+
+def _time_per_call(function, *args, repeats=200):
+    """Best of five mean wall times of function(*args), in microseconds"""
+    function(*args)  # compile / warm up
+    best = np.inf
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            function(*args)
+        best = min(best, (time.perf_counter() - start) / repeats)
+    return best * 1e6
+
+
+def benchmark_model_backends(num_peaks=6, repeats=200, verbose=True):
+    """
+    Time single evaluations of the multi-Gaussian model and its Jacobian with the NumPy
+    and numba backends on the XRD and DSC grid sizes.
+
+    Parameters:
+    -----------
+    num_peaks : int, default=6
+        Number of Gaussian peaks in the model, spread evenly over each grid
+    repeats : int, default=200
+        Evaluations per timing run; the best of five runs is reported
+    verbose : bool, default=True
+        Whether to print the results table
+
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per grid and function, with the time per call of each backend in µs,
+        the numba speedup and the largest absolute difference between the backends
+    """
+    numpy_model = MultiGaussianModel('numpy')
+    numba_model = MultiGaussianModel('numba') if numba is not None else None
+
+    rows = []
+    for name, num_points, (low, high) in _MODEL_GRIDS:
+        x = np.linspace(low, high, num_points)
+        # Alternate narrow (crystalline / melting) and broad (amorphous) peaks
+        centers = np.linspace(low, high, num_peaks + 2)[1:-1]
+        widths = np.where(np.arange(num_peaks) % 2 == 0, 0.007, 0.1) * (high - low)
+        params = np.column_stack([np.linspace(1.0, 0.2, num_peaks), centers, widths]).ravel()
+
+        for function in ('model', 'jacobian'):
+            row = {'grid': name, 'points': num_points, 'peaks': num_peaks, 'function': function}
+            evaluate = lambda model: model if function == 'model' else model.jacobian
+            row['numpy_us'] = _time_per_call(evaluate(numpy_model), x, *params, repeats=repeats)
+            if numba_model is not None:
+                row['numba_us'] = _time_per_call(evaluate(numba_model), x, *params, repeats=repeats)
+                row['speedup'] = row['numpy_us'] / row['numba_us']
+                row['max_abs_difference'] = np.max(np.abs(evaluate(numpy_model)(x, *params)
+                                                          - evaluate(numba_model)(x, *params)))
+            rows.append(row)
+
+    table = pd.DataFrame(rows)
+    if verbose:
+        if numba_model is None:
+            print("numba is not installed; only the NumPy backend was timed")
+        print(table.to_string(index=False, float_format=lambda value: f"{value:.3g}"))
+    return table
+
+
+# Per-sample fitting settings of XRD_analysis_main.ipynb ('room') and XRD_heated_method.ipynb
+# ('heated'), which produced XRD_results.xlsx and XRD_heated_results.xlsx
+_REFERENCE_PEAKS = {
+    'PEEK': [18.7, 20.6, 22.7, 28.7],   # (110), (111), (200), (211)
+    'HDPE': [21.5, 23.9, 30.0, 36.2],   # (110), (200), (210), (020)
+}
+_AMORPHOUS_PEAKS = {'PEEK': [9, 19, 22, 29, 37], 'HDPE': [14, 17, 20, 24, 30]}
+_HEIGHT_WIDTH_THRESHOLDS = {'PEEK': 0.05, 'HDPE': 0.008}
+
+_SAMPLE_CRYSTALLINE_PEAKS = {
+    'room': {
+        '500907.csv': [pos + 1 for pos in _REFERENCE_PEAKS['PEEK']],
+        '500907_2.csv': _REFERENCE_PEAKS['PEEK'],
+        '501023.csv': [pos - 0.5 for pos in _REFERENCE_PEAKS['PEEK']],
+        '501023_2.csv': _REFERENCE_PEAKS['PEEK'],
+        '501023_3.csv': _REFERENCE_PEAKS['PEEK'],
+        '501023_4.csv': _REFERENCE_PEAKS['PEEK'],
+        '501024.csv': _REFERENCE_PEAKS['PEEK'],
+        '501024_2.csv': _REFERENCE_PEAKS['PEEK'],
+        'HDPE.csv': _REFERENCE_PEAKS['HDPE'],
+        'HDPE_2.csv': _REFERENCE_PEAKS['HDPE'],
+        'HDPE_3.csv': _REFERENCE_PEAKS['HDPE'],
+        'HDPE_4.csv': _REFERENCE_PEAKS['HDPE'],
+    },
+    'heated': {
+        'PEEK500907_26C_1.csv': _REFERENCE_PEAKS['PEEK'],
+        'PEEK500907_50C_1.csv': _REFERENCE_PEAKS['PEEK'],
+        'PEEK500907_100C_1.csv': _REFERENCE_PEAKS['PEEK'],
+        'PEEK500907_150C_1.csv': _REFERENCE_PEAKS['PEEK'],
+        'PEEK500907_200C_1.csv': [18.7 + 0.1, 20.6 + 0.1, 22.7 + 0.2, 28.7],
+        'PEEK500907_250C_1.csv': _REFERENCE_PEAKS['PEEK'],
+        'PEEK500907_300C_1.csv': [pos - 0.5 for pos in _REFERENCE_PEAKS['PEEK']],
+        'PEEK500907_30C_after_1.csv': _REFERENCE_PEAKS['PEEK'],
+        'HDPE_29C_1.csv': [21.5 + 0.5, 23.9 + 0.5, 30.0 + 0.5, 36.2],
+        'HDPE_50C_1.csv': _REFERENCE_PEAKS['HDPE'],
+        'HDPE_75C_1.csv': [21.5, 23.9, 30.0 - 0.5, 36.2],
+        'HDPE_100C_1.csv': [pos - 0.5 for pos in _REFERENCE_PEAKS['HDPE']],
+        'HDPE_110C_1.csv': [21.5 - 0.5, 23.9 - 0.7, 30.0 - 0.2, 36.2 - 0.2],
+        'HDPE_120C_1.csv': [21.5 - 0.5, 23.9 - 0.7, 30.0 - 0.2, 36.2 - 0.2],
+        'HDPE_31C_after_1.csv': _REFERENCE_PEAKS['HDPE'],
+    },
+}
+
+# Dataset -> (data folder and results workbook relative to the data directory, notebook settings).
+# The room-temperature notebook leaves min_prominence at its default
+_DATASETS = {
+    'room': ('XRD', 'XRD_results.xlsx',
+             {'min_r_squared': 0.95, 'amorphous_r_squared': 0.90}),
+    'heated': (os.path.join('XRD', 'heated'), 'XRD_heated_results.xlsx',
+               {'min_r_squared': 0.99, 'amorphous_r_squared': 0.90,
+                'min_prominence': {'PEEK': 0.008, 'HDPE': 0.0001}}),
+}
+
+_ENGINES = {'fast': fit_xrd_spectrum_fast, 'detailed': fit_xrd_spectrum_detailed}
+
+_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'data')
+
+
+def _notebook_config(dataset, file_name):
+    """Fitting keyword arguments the analysis notebook uses for one file"""
+    polymer = 'HDPE' if 'HDPE' in file_name else 'PEEK'
+    settings = dict(_DATASETS[dataset][2])
+    if 'min_prominence' in settings:
+        settings['min_prominence'] = settings['min_prominence'][polymer]
+    return {
+        'known_crys_peaks': _SAMPLE_CRYSTALLINE_PEAKS[dataset][file_name],
+        'known_amorp_peaks': _AMORPHOUS_PEAKS[polymer],
+        'height_width_threshold': _HEIGHT_WIDTH_THRESHOLDS[polymer],
+        'visualise': False,
+        **settings,
+    }
+
+
+def _published_crystallinity(workbook_path):
+    """Crystallinity in % per file name from the Overview sheet of a results workbook"""
+    overview = pd.read_excel(workbook_path, sheet_name='Overview')
+    return dict(zip(overview['Filename'], overview['Crystallinity_percent']))
+
+
+def _check_choices(engines, datasets):
+    """Raise ValueError for an unknown engine or dataset name"""
+    for engine in engines:
+        if engine not in _ENGINES:
+            raise ValueError(f"engine must be one of {tuple(_ENGINES)}, got {engine!r}")
+    for dataset in datasets:
+        if dataset not in _DATASETS:
+            raise ValueError(f"dataset must be one of {tuple(_DATASETS)}, got {dataset!r}")
+
+
+def _bundled_spectra(datasets, data_dir=None, files=None):
+    """
+    Yield (dataset, file name, 2θ, intensity, notebook settings) for the bundled files of each
+    dataset, or only those named in files. Spectra are cropped to 10-40° and normalised to the
+    highest point, as in the notebooks.
+    """
+    data_dir = _DATA_DIR if data_dir is None else data_dir
+    for dataset in datasets:
+        folder = _DATASETS[dataset][0]
+        for file_name in _SAMPLE_CRYSTALLINE_PEAKS[dataset]:
+            if files is not None and file_name not in files:
+                continue
+            scan = read_xrd_csv(os.path.join(data_dir, folder, file_name), two_theta_range=(10, 40))
+            yield (dataset, file_name, scan['two_theta'], scan['intensity'] / np.max(scan['intensity']),
+                   _notebook_config(dataset, file_name))
+
+
+def _run_engine(engine, two_theta, intensity, config, trace_memory=False):
+    """One silent fit from a cold preprocessing cache: (results, wall time in s, peak traced MB or NaN)"""
+    clear_preprocessing_cache()
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        with _quiet_logging():
+            results = _ENGINES[engine](two_theta, intensity, **config)
+        elapsed = time.perf_counter() - start
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1e6 if trace_memory else np.nan
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return results, elapsed, peak_mb
+
+
+def benchmark_crystallinity_engines(engines=('fast', 'detailed'), datasets=('room', 'heated'), tolerance=0.5,
+                                    trace_memory=True, data_dir=None, fit_options=None, verbose=True):
+    """
+    Run the crystallinity engines over the bundled XRD datasets with the analysis notebooks'
+    per-sample settings and compare each result with the published value.
+    
+    Parameters:
+    -----------
+    engines : tuple, default=('fast', 'detailed')
+        Engines to run, from 'fast' (fit_xrd_spectrum_fast) and 'detailed'
+        (fit_xrd_spectrum_detailed)
+    datasets : tuple, default=('room', 'heated')
+        'room' fits data/XRD/*.csv against XRD_results.xlsx and 'heated' fits
+        data/XRD/heated/*.csv against XRD_heated_results.xlsx
+    tolerance : float, default=0.5
+        Largest absolute difference from the published crystallinity, in percentage points,
+        for a fit to pass
+    trace_memory : bool, default=True
+        Measure the peak memory allocated during each fit with tracemalloc. This is done in a
+        second, untimed run of the same fit, because tracing slows fitting down by about half
+    data_dir : str or None, optional
+        Folder holding XRD/, XRD/heated/ and the results workbooks. None uses the
+        repository's data folder
+    fit_options : dict or None, optional
+        Extra keyword arguments for every fit (e.g. solver or backend), on top of the
+        notebook settings, to benchmark a variant against the published values
+    verbose : bool, default=True
+        Whether to print the results table and a summary per engine
+    
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per dataset, file and engine with the wall time in s, the peak traced memory
+        in MB, the total model evaluations, the crystallinity and R², the published
+        crystallinity, their difference and whether it is within tolerance
+    """
+    _check_choices(engines, datasets)
+    data_dir = _DATA_DIR if data_dir is None else data_dir
+    published = {dataset: _published_crystallinity(os.path.join(data_dir, _DATASETS[dataset][1]))
+                 for dataset in datasets}
+    
+    rows = []
+    for dataset, file_name, two_theta, intensity, config in _bundled_spectra(datasets, data_dir):
+        config = {**config, **(fit_options or {})}
+        for engine in engines:
+            results, elapsed, _ = _run_engine(engine, two_theta, intensity, config)
+            peak_mb = (_run_engine(engine, two_theta, intensity, config, trace_memory=True)[2]
+                       if trace_memory else np.nan)
+            reference = published[dataset].get(file_name, np.nan)
+            difference = results['crystallinity'] - reference
+            rows.append({
+                'dataset': dataset, 'file': file_name, 'engine': engine,
+                'time_s': elapsed, 'peak_memory_mb': peak_mb,
+                'nfev': results['phase_nfev']['total'],
+                'crystallinity': results['crystallinity'], 'r_squared': results['r_squared'],
+                'published': reference, 'difference': difference,
+                'passed': bool(abs(difference) <= tolerance),
+            })
+    
+    table = pd.DataFrame(rows)
+    if verbose:
+        print(table.to_string(index=False, float_format=lambda value: f"{value:.4g}"))
+        summary = table.groupby('engine', sort=False).agg(
+            passed=('passed', 'sum'), fits=('passed', 'size'), time_s=('time_s', 'sum'),
+            peak_memory_mb=('peak_memory_mb', 'max'), nfev=('nfev', 'sum'))
+        print(f"\nWithin {tolerance} percentage points of the published crystallinity:")
+        print(summary.to_string(float_format=lambda value: f"{value:.4g}"))
+    return table
+
+
+def benchmark_warm_start(engines=('fast', 'detailed'), datasets=('room', 'heated'), tolerance=0.5,
+                         data_dir=None, fit_options=None, verbose=True):
+    """
+    Fit every bundled spectrum with and without warm_start and compare the two runs per
+    engine and file. Warm starts can lead the optimiser to a different optimum, so fewer
+    model evaluations only count as a speed-up for files whose crystallinity stays within
+    tolerance of the cold-start value.
+    
+    Parameters:
+    -----------
+    engines : tuple, default=('fast', 'detailed')
+        Engines to run, from 'fast' (fit_xrd_spectrum_fast) and 'detailed'
+        (fit_xrd_spectrum_detailed)
+    datasets : tuple, default=('room', 'heated')
+        Bundled datasets to fit (see benchmark_crystallinity_engines)
+    tolerance : float, default=0.5
+        Largest absolute difference between the warm- and cold-start crystallinity, in
+        percentage points, for the two fits to count as the same result
+    data_dir : str or None, optional
+        Folder holding XRD/ and XRD/heated/. None uses the repository's data folder
+    fit_options : dict or None, optional
+        Extra keyword arguments for every fit, on top of the notebook settings
+    verbose : bool, default=True
+        Whether to print the results table and a summary per engine
+    
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per dataset, file and engine with the total model evaluations, wall time
+        in s and crystallinity of the cold and warm runs, the crystallinity difference and
+        whether it is within tolerance
+    """
+    _check_choices(engines, datasets)
+    
+    rows = []
+    for dataset, file_name, two_theta, intensity, config in _bundled_spectra(datasets, data_dir):
+        config = {**config, **(fit_options or {})}
+        for engine in engines:
+            row = {'dataset': dataset, 'file': file_name, 'engine': engine}
+            for start, warm_start in (('cold', False), ('warm', True)):
+                results, elapsed, _ = _run_engine(engine, two_theta, intensity,
+                                                  {**config, 'warm_start': warm_start})
+                row.update({f'nfev_{start}': results['phase_nfev']['total'], f'time_{start}_s': elapsed,
+                            f'crystallinity_{start}': results['crystallinity']})
+            row['difference'] = row['crystallinity_warm'] - row['crystallinity_cold']
+            row['same'] = bool(abs(row['difference']) <= tolerance)
+            rows.append(row)
+    
+    table = pd.DataFrame(rows)
+    if verbose:
+        print(table.to_string(index=False, float_format=lambda value: f"{value:.4g}"))
+        same = table[table['same']]
+        summary = pd.DataFrame({
+            'files': table.groupby('engine', sort=False).size(),
+            'same': same.groupby('engine', sort=False).size(),
+            'nfev_cold': same.groupby('engine', sort=False)['nfev_cold'].sum(),
+            'nfev_warm': same.groupby('engine', sort=False)['nfev_warm'].sum(),
+            'time_cold_s': same.groupby('engine', sort=False)['time_cold_s'].sum(),
+            'time_warm_s': same.groupby('engine', sort=False)['time_warm_s'].sum(),
+        }).fillna(0)
+        print(f"\nFiles whose warm-start crystallinity is within {tolerance} percentage points of the "
+              f"cold start, with their totals:")
+        print(summary.to_string(float_format=lambda value: f"{value:.4g}"))
+    return table
+
+
+# Two room-temperature and two heated spectra, one of each polymer
+_THREAD_CHECK_FILES = ('501023_2.csv', 'HDPE.csv', 'PEEK500907_200C_1.csv', 'HDPE_75C_1.csv')
+
+
+def check_threaded_fits(engines=('fast', 'detailed'), files=_THREAD_CHECK_FILES, n_threads=4, data_dir=None,
+                        fit_options=None, verbose=True):
+    """
+    Fit a few bundled spectra one after another, then all of them at once from a thread pool,
+    and compare the crystallinities. Every driver call carries its own fitting context, and the
+    detailed engine runs its fallback fits in threads of its own, so the results should be
+    identical however the calls are interleaved.
+    
+    Parameters:
+    -----------
+    engines : tuple, default=('fast', 'detailed')
+        Engines to run, from 'fast' (fit_xrd_spectrum_fast) and 'detailed'
+        (fit_xrd_spectrum_detailed)
+    files : tuple, default=_THREAD_CHECK_FILES
+        Names of bundled room-temperature or heated files to fit
+    n_threads : int, default=4
+        Number of threads for the concurrent run
+    data_dir : str or None, optional
+        Folder holding XRD/ and XRD/heated/. None uses the repository's data folder
+    fit_options : dict or None, optional
+        Extra keyword arguments for every fit (e.g. fallback_strategies), on top of the
+        notebook settings
+    verbose : bool, default=True
+        Whether to print the comparison table
+    
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per file and engine with the serial and threaded crystallinity and whether
+        they are identical
+    """
+    _check_choices(engines, ())
+    tasks = [(dataset, file_name, engine, two_theta, intensity, {**config, **(fit_options or {})})
+             for dataset, file_name, two_theta, intensity, config in _bundled_spectra(tuple(_DATASETS), data_dir, files)
+             for engine in engines]
+    
+    def crystallinity(task):
+        _, _, engine, two_theta, intensity, config = task
+        with _quiet_logging():
+            return _ENGINES[engine](two_theta, intensity, **config)['crystallinity']
+    
+    clear_preprocessing_cache()
+    serial = [crystallinity(task) for task in tasks]
+    # Start from a cold cache again so that preprocessing also runs concurrently
+    clear_preprocessing_cache()
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        threaded = list(executor.map(crystallinity, tasks))
+    
+    table = pd.DataFrame([{'dataset': dataset, 'file': file_name, 'engine': engine, 'serial': serial_value,
+                           'threaded': threaded_value, 'identical': serial_value == threaded_value}
+                          for (dataset, file_name, engine, *_), serial_value, threaded_value
+                          in zip(tasks, serial, threaded)])
+    if verbose:
+        print(table.to_string(index=False, float_format=lambda value: f"{value:.6g}"))
+        print(f"\n{int(table['identical'].sum())} of {len(table)} threaded fits match the serial fits")
+    return table
+
+if __name__ == '__main__':
+    benchmark_model_backends()
+    benchmark_crystallinity_engines()
+    benchmark_warm_start()
+    check_threaded_fits()
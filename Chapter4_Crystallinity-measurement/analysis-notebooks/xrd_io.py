@@ -0,0 +1,136 @@
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+
+
+# Scan-point column headers in the instrument export -> array names returned by read_xrd_csv
+_COLUMN_NAMES = {
+    'Angle': 'two_theta',
+    'TimePerStep': 'time_per_step',
+    'Intensity': 'intensity',
+    'ESD': 'esd',
+}
+
+# Metadata fields kept as text even when they look numeric (e.g. sample 500907)
+_TEXT_FIELDS = {'Sample identification', 'Comment'}
+
+# Bump when the parsed layout changes so that old cache files are not reused
+_CACHE_VERSION = 1
+
+
+def _parse_value(text, numeric=True):
+    """Convert a metadata field to int or float where possible, otherwise keep the string"""
+    text = text.strip()
+    if not text:
+        return None
+    for convert in ((int, float) if numeric else ()):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    return text
+
+
+def parse_xrd_text(text):
+    """
+    Parse the contents of a diffractometer CSV export.
+
+    The file starts with a [Measurement conditions] block of "name,value[,value...]" lines,
+    followed by a [Scan points] block with a column header line and comma-separated numbers.
+    The length of the header block is not assumed.
+
+    Parameters:
+    -----------
+    text : str
+        Full contents of the CSV file
+
+    Returns:
+    --------
+    tuple
+        (metadata dict, dict of column arrays keyed by the names in _COLUMN_NAMES)
+    """
+    header, marker, scan_points = text.partition('[Scan points]')
+    if not marker:
+        raise ValueError("No [Scan points] section found")
+
+    metadata = {}
+    for line in header.splitlines():
+        line = line.strip()
+        if not line or line.startswith('['):
+            continue
+        name, _, values = line.partition(',')
+        name = name.strip()
+        values = [_parse_value(value, numeric=name not in _TEXT_FIELDS) for value in values.split(',')]
+        metadata[name] = values[0] if len(values) == 1 else values
+
+    column_line, _, rows = scan_points.lstrip().partition('\n')
+    columns = [column.strip() for column in column_line.split(',')]
+    values = np.array(rows.replace(',', ' ').split(), dtype=float)
+    if values.size % len(columns):
+        raise ValueError(f"Scan points do not form complete rows of {len(columns)} columns")
+    values = values.reshape(-1, len(columns))
+
+    data = {_COLUMN_NAMES.get(column, column): values[:, i].copy() for i, column in enumerate(columns)}
+    return metadata, data
+
+
+def read_xrd_csv(path, two_theta_range=None, cache_dir=None):
+    """
+    Read a diffractometer CSV export into NumPy arrays.
+
+    Parameters:
+    -----------
+    path : str
+        Path to the CSV file
+    two_theta_range : tuple or None, optional
+        (min, max) 2θ window in degrees to keep, inclusive. None keeps every scan point
+    cache_dir : str or None, optional
+        Directory for parsed copies of the file, stored as uncompressed .npz files named by a
+        hash of the file contents, so an edited file is parsed again. None disables caching
+
+    Returns:
+    --------
+    dict
+        'metadata' (the [Measurement conditions] fields), 'two_theta', 'intensity', 'esd',
+        'time_per_step' arrays and 'path'
+    """
+    with open(path, 'rb') as f:
+        content = f.read()
+
+    cache_path = None
+    if cache_dir is not None:
+        digest = hashlib.sha1(content).hexdigest()
+        stem = os.path.splitext(os.path.basename(path))[0]
+        cache_path = os.path.join(cache_dir, f"{stem}-{digest}-v{_CACHE_VERSION}.npz")
+
+    if cache_path is not None and os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            metadata = json.loads(str(cached['metadata']))
+            data = {name: cached[name] for name in cached.files if name != 'metadata'}
+    else:
+        metadata, data = parse_xrd_text(content.decode('utf-8-sig'))
+        if cache_path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            # Write to a uniquely named temporary file first, so that concurrent writers (threads
+            # or processes) never share a path and readers never see a partial file
+            with tempfile.NamedTemporaryFile(dir=cache_dir, prefix=f"{stem}-", suffix='.tmp.npz',
+                                             delete=False) as temp_file:
+                try:
+                    np.savez(temp_file, metadata=json.dumps(metadata), **data)
+                except BaseException:
+                    temp_file.close()
+                    os.unlink(temp_file.name)
+                    raise
+            try:
+                os.replace(temp_file.name, cache_path)
+            except BaseException:
+                os.unlink(temp_file.name)
+                raise
+
+    if two_theta_range is not None:
+        keep = (data['two_theta'] >= two_theta_range[0]) & (data['two_theta'] <= two_theta_range[1])
+        data = {name: values[keep] for name, values in data.items()}
+
+    return {'metadata': metadata, **data, 'path': path}